@@ -1,16 +1,33 @@
 # app.py
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, g, has_request_context
+from werkzeug.local import LocalProxy
 import sqlite3
 import math
 from datetime import datetime
 import os, random
+import argparse
+import threading
 import unicodedata
+import functools
+from urllib.parse import quote as url_quote
+import srs
+import item_index
+import example_index
+import grammar_pattern
+import change_log
+import learner_shards
+import text_codec
+import startup
+from jinja2 import FileSystemBytecodeCache
 
 app = Flask(__name__)
+# Jinja 編譯結果存入暫存目錄的 bytecode 快取，重新啟動時不必再編譯模板
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 app.secret_key = 'your_super_secret_key' 
 DB_NAME = 'jp_db.db'
 PER_PAGE = 20 # 每頁顯示 20 筆資料
+QUERY_SHAPE_CACHE_SIZE = 256 # 已組好的查詢 SQL (依篩選條件形狀) 的快取數量
 BATCH_SIZE = 20 # 每批載入的卡片數量 需與flashcard_deck的BATCH_SIZE大小一致
 
 # 詞性列表 (用於單字詞性篩選與新增快捷鍵)
@@ -45,6 +62,59 @@ MASTER_POS_LIST_RAW = [
     # --- 不常見 ---
     'Other (其他)'     
 ]
+SUGGEST_LIMIT = 10
+USED_IN_LIMIT = 50 # 編輯頁「出現於例句」面板最多顯示筆數
+DUPLICATES_PAGE_LIMIT = 100 # 重複檢查頁最多顯示的群組數
+QUIZ_CHOICES = 4 # 選擇題模式每題的選項數 (含正確答案)
+# 自動線上備份的間隔 (小時)，0 表示不啟用；手動備份/還原請用 python backup.py
+BACKUP_INTERVAL_HOURS = 0
+# 背景維護 (閒置時 incremental vacuum、統計過期時 ANALYZE、定期 PRAGMA optimize)；第一次使用時才建立
+_maintenance_scheduler = None
+_maintenance_lock = threading.Lock()
+# 唯讀查詢 (列表、單字卡、搜尋等) 使用連線池，prepared statement 快取可跨請求重複使用；
+# 啟用記憶體唯讀副本時改由記憶體中的副本提供，寫入仍直接寫入 jp_db.db
+READ_REPLICA_ENABLED = False
+# 過長的說明 (explanation) 以 zlib + 訓練字典壓縮儲存；停用後已壓縮的資料仍可讀取，python text_codec.py decompress 可全部還原
+TEXT_COMPRESSION_ENABLED = False
+# 多使用者模式：每位學習者使用 learners/<ID>.db (第一次使用時由 jp_db.db 複製並清空個人排程)，
+# 學習者 ID 取自前端反向代理驗證後帶入的標頭 (或 WSGI 的 REMOTE_USER)；未啟用時所有請求共用 jp_db.db
+# 應用程式本身不驗證使用者：只能部署在受信任的反向代理之後，由代理覆寫 (不可轉送) 用戶端自行帶入的同名標頭
+MULTI_LEARNER_ENABLED = False
+LEARNER_HEADER = 'X-Remote-User'
+LEARNER_EXEMPT_ENDPOINTS = ('static', 'api_learners_status') # 不屬於任何學習者、不需要使用者名稱的端點
+# init_db 的結構版本 (存於 PRAGMA user_version)：修改 init_db 時加 1，既有的資料庫 (含學習者分片) 會在下次使用時遷移
+#   2: strip_html 不再以空白取代行內標籤，重建純文字影子欄位與由它衍生的索引
+#   3: 新卡片改為每天開放 srs.NEW_CARDS_PER_DAY 張，重新分散已建立但尚未複習過的卡片
+#   4: 文法句型連同接續與後接字串一起比對，重建文法句型索引
+#   5: 讀音表保存表記，trigram 改依主鍵刪除並移除 idx_trigram_item，重建讀音與 trigram 索引
+#   6: 干擾選項改為出題時計算，移除預先計算的干擾選項表
+SCHEMA_VERSION = 6
+schema_gate = startup.SchemaGate(SCHEMA_VERSION, lambda db_name: init_db(db_name))
+default_store = learner_shards.LearnerStore(DB_NAME, READ_REPLICA_ENABLED)
+learner_pool = learner_shards.LearnerShardPool(DB_NAME, migrate=lambda db_name: ensure_schema(db_name),
+                                               read_replica=READ_REPLICA_ENABLED)
+
+# 以下物件皆屬於目前請求的資料庫 (current_store())，各分片有各自的一份：
+# 自動完成用的記憶體前綴索引 (啟動時建立，之後依變更日誌增量更新，含匯入腳本等其他行程的寫入)
+suggest_index = LocalProxy(lambda: current_store().suggest_index)
+suggest_feed = LocalProxy(lambda: current_store().suggest_feed)
+# 「使用此單字的例句」反向索引 (自動機於第一次增量更新時建立)
+example_linker = LocalProxy(lambda: current_store().example_linker)
+# 文法句型比對 (已編譯的句型快取於行程內，只重新比對有變動的項目)
+grammar_matcher = LocalProxy(lambda: current_store().grammar_matcher)
+# 唯讀連線池 (或記憶體唯讀副本)
+read_pool = LocalProxy(lambda: current_store().read_pool)
+# 單一寫入執行緒：新增/編輯/刪除等寫入以工作形式排入佇列，多個工作合併在同一個交易中 commit
+write_queue = LocalProxy(lambda: current_store().write_queue)
+# 已渲染的頁面片段 (列表每一列、篩選選單)：PRAGMA data_version 改變時讀取變更日誌，只淘汰有變動的項目
+data_version = LocalProxy(lambda: current_store().data_version)
+fragment_cache = LocalProxy(lambda: current_store().fragment_cache)
+fragment_feed = LocalProxy(lambda: current_store().fragment_feed)
+# 近似重複分析結果 (依變更日誌版本快取，資料未變動時不重新計算)
+duplicate_finder = LocalProxy(lambda: current_store().duplicate_finder)
+# 選擇題干擾選項的特徵與分桶 (同步時只重新載入變動的項目)
+distractors = LocalProxy(lambda: current_store().distractors)
+
 # 預處理詞性列表，只保留縮寫 (例如: '名')
 MASTER_POS_LIST = [pos.split(' ')[0].strip() for pos in MASTER_POS_LIST_RAW]
 
@@ -53,17 +123,38 @@ MASTER_POS_TUPLES = [(pos.split(' ')[0].strip(), pos.strip()) for pos in MASTER_
 
 # ----------------- 資料庫工具函數 -----------------
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+def current_store():
+    """目前請求使用的資料庫及其快取：多使用者模式下為該學習者的分片，其他情況 (含請求之外) 為 jp_db.db。"""
+    if MULTI_LEARNER_ENABLED and has_request_context() and 'learner_store' in g:
+        return g.learner_store
+    return default_store
+
+def get_db_connection(db_name=None):
+    conn = sqlite3.connect(db_name or current_store().db_name)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_read_connection():
+    """唯讀查詢用的連線 (連線池)：啟用記憶體副本時從副本取得 (磁碟資料有變動會先刷新)。close() 會歸還連線池。"""
+    return read_pool.connect()
+
 def get_table_name(data_type):
     return 'vocab_table' if data_type == 'vocab' else 'grammar_table'
 
-def init_db():
-    conn = get_db_connection()
+def _table_exists(cursor, table_name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return cursor.fetchone() is not None
+
+def _column_exists(cursor, table_name, column_name):
+    cursor.execute(f'PRAGMA table_info({table_name})')
+    return any(row['name'] == column_name for row in cursor.fetchall())
+
+def init_db(db_name=None):
+    import maintenance
+    import stats_cube
+    conn = get_db_connection(db_name)
     cursor = conn.cursor()
+    previous_version = cursor.execute('PRAGMA user_version').fetchone()[0]
     
     # 1. 單字表
     cursor.execute('''
@@ -123,9 +214,156 @@ def init_db():
         )
     ''')
     
+    # 7. 卡片排程狀態表 (SRS)：(item_type, due_at, item_id) 索引讓「下 N 張到期卡片」成為範圍掃描
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_state_table (
+            item_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL,
+            due_at INTEGER NOT NULL,
+            interval_days REAL NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            reps INTEGER NOT NULL DEFAULT 0,
+            lapses INTEGER NOT NULL DEFAULT 0,
+            last_review_at INTEGER,
+            PRIMARY KEY (item_type, item_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_card_state_due
+        ON card_state_table (item_type, due_at, item_id)
+    ''')
+    
+    # 8. 複習紀錄表 (SRS)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_log_table (
+            id INTEGER PRIMARY KEY,
+            item_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL,
+            grade INTEGER NOT NULL,
+            reviewed_at INTEGER NOT NULL,
+            interval_days REAL,
+            ease REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_review_log_item
+        ON review_log_table (item_type, item_id, reviewed_at)
+    ''')
+    if previous_version < 3:
+        staggered = srs.stagger_new_cards(conn)
+        if staggered:
+            print(f"🔧 已將 {staggered} 張尚未複習的新卡片分散為每天 {srs.NEW_CARDS_PER_DAY} 張")
+    
+    # 9. 單字表新增詞性排序鍵 (反正規化，取代查詢時的 GROUP_CONCAT)
+    if not _column_exists(cursor, 'vocab_table', 'pos_sort_key'):
+        cursor.execute('ALTER TABLE vocab_table ADD COLUMN pos_sort_key TEXT')
+        item_index.backfill_pos_sort_keys(conn)
+    # 無詞性的項目固定排在最後，因此索引以 (pos_sort_key IS NULL) 開頭；升冪/降冪各一個
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vocab_pos_sort
+        ON vocab_table ((pos_sort_key IS NULL), pos_sort_key, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vocab_pos_sort_desc
+        ON vocab_table ((pos_sort_key IS NULL), pos_sort_key DESC, id DESC)
+    ''')
+    
+    # 10. 讀音/羅馬拼音表與 trigram 倒排索引 (容錯搜尋、羅馬拼音搜尋)
+    term_index_is_new = not _table_exists(cursor, 'term_reading_table')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS term_reading_table (
+            item_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL,
+            surface TEXT,
+            reading_kana TEXT,
+            romaji TEXT,
+            kana_gram_count INTEGER NOT NULL DEFAULT 0,
+            romaji_gram_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (item_type, item_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trigram_index_table (
+            trigram TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, item_type, item_id)
+        ) WITHOUT ROWID
+    ''')
+    # 舊 trigram 由讀音表保存的表記/讀音重新算出後依主鍵刪除，不需要 (item_type, item_id) 索引
+    cursor.execute('DROP INDEX IF EXISTS idx_trigram_item')
+    term_surface_is_new = not _column_exists(cursor, 'term_reading_table', 'surface')
+    if term_surface_is_new:
+        cursor.execute('ALTER TABLE term_reading_table ADD COLUMN surface TEXT')
+    
+    # 11. 漢字倒排索引 (「含有 食 的所有單字」)
+    kanji_index_is_new = not _table_exists(cursor, 'kanji_index_table')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kanji_index_table (
+            kanji TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (kanji, item_type, item_id)
+        ) WITHOUT ROWID
+    ''')
+    # 舊漢字同樣由讀音表保存的表記重新算出後依主鍵刪除
+    cursor.execute('DROP INDEX IF EXISTS idx_kanji_item')
+    
+    # 12. 例句反向索引 (單字 -> 含有其表記/讀音的例句)
+    example_link_is_new = not _table_exists(cursor, 'example_link_table')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS example_link_table (
+            vocab_id INTEGER NOT NULL,
+            source_type TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            PRIMARY KEY (vocab_id, source_type, source_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_example_link_source
+        ON example_link_table (source_type, source_id)
+    ''')
+    
+    # 13. 純文字影子欄位 (搜尋用，不含 Quill HTML 標籤)；須在例句反向索引回填之前寫入
+    for item_type in ('vocab', 'grammar'):
+        table_name = get_table_name(item_type)
+        missing_columns = [plain for _, plain in item_index.PLAIN_TEXT_COLUMNS
+                           if not _column_exists(cursor, table_name, plain)]
+        for plain in missing_columns:
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {plain} TEXT')
+        if missing_columns or previous_version < 2:
+            item_index.backfill_plain_text(conn, item_type)
+    
+    # 14. 文法句型索引 (文法 -> 符合該句型的例句)
+    grammar_match_is_new = not _table_exists(cursor, 'grammar_match_table')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grammar_match_table (
+            grammar_id INTEGER NOT NULL,
+            source_type TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            PRIMARY KEY (grammar_id, source_type, source_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_grammar_match_source
+        ON grammar_match_table (source_type, source_id)
+    ''')
+    
+    # 回填新建立的索引 (term 索引重建時會一併寫入漢字索引)
+    if term_index_is_new or term_surface_is_new or previous_version < 5:
+        item_index.backfill_term_index(conn, 'vocab')
+        item_index.backfill_term_index(conn, 'grammar')
+    elif kanji_index_is_new:
+        item_index.backfill_kanji_index(conn, 'vocab')
+        item_index.backfill_kanji_index(conn, 'grammar')
+    if example_link_is_new or previous_version < 2:
+        example_index.rebuild_example_links(conn)
+    if grammar_match_is_new or previous_version < 4:
+        grammar_pattern.rebuild_grammar_matches(conn)
+    
     conn.commit()
     
-    # 7. 填充 pos_master_table
+    # 15. 填充 pos_master_table
     for pos_abbr in MASTER_POS_LIST:
         try:
             cursor.execute('INSERT INTO pos_master_table (name) VALUES (?)', (pos_abbr,))
@@ -134,7 +372,47 @@ def init_db():
             pass
             
     conn.commit()
+
+    # 16. 切換為 auto_vacuum=INCREMENTAL (只需執行一次完整 VACUUM，之後由背景維護分段歸還空頁)
+    if maintenance.ensure_incremental_auto_vacuum(conn):
+        print("🔧 已將資料庫切換為 auto_vacuum=INCREMENTAL")
+
+    # 17. 變更日誌 (觸發器寫入，供 /api/changes 差異同步與行程內快取增量更新)
+    if change_log.create_change_log(conn):
+        print("🔧 已建立變更日誌 change_log_table")
+
+    # 18. 壓縮字典表 (改寫尚未壓縮的過長說明在 ensure_schema 中執行，不受結構版本影響)
+    text_codec.create_dictionary_table(conn)
+
+    # 19. 選擇題干擾選項改為出題時由詞性/分類計算 (distractor_index.DistractorIndex)，移除舊版預先計算的表
+    cursor.execute('DROP TABLE IF EXISTS distractor_table')
+    cursor.execute('DROP TABLE IF EXISTS distractor_state_table')
+
+    # 20. 統計儀表板的分類 × 詞性彙總表 (之後依變更日誌增量更新)
+    if stats_cube.create_stats_tables(conn):
+        print(f"🔧 已建立統計彙總表 ({stats_cube.rebuild(conn)} 個項目)")
+
+    # 版本號在所有步驟完成後才寫入。前面的步驟會分別 commit (含 VACUUM)，中途失敗時資料庫可能只遷移了一部分，
+    # 但版本號仍是舊的，下次會從頭再執行一次；因此每個步驟都必須可重複執行 (冪等)
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
     conn.close()
+
+def ensure_schema(db_name=None):
+    """
+    每個行程每個資料庫只執行一次：結構版本 (user_version) 過舊時執行 init_db；
+    啟用壓縮時改寫尚未壓縮的過長說明 (匯入腳本寫入的資料也會在下次啟動時壓縮)。
+    """
+    db_name = db_name or current_store().db_name
+    if schema_gate.ensure(db_name) and TEXT_COMPRESSION_ENABLED:
+        conn = get_db_connection(db_name)
+        try:
+            compressed = text_codec.compress_existing(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        if compressed:
+            print(f"🔧 已壓縮 {compressed} 筆過長的說明")
     
 # ----------------- SQL注入內容正規化 -----------------
 # app.py 內部的函式修正
@@ -186,116 +464,132 @@ def _convert_kana(text, target_type='hiragana'):
     return "".join(converted_text)
 
 # ----------------- 查詢組件生成函數 (用於處理 JOIN 和 WHERE 條件) -----------------
-def _get_query_components(data_type, category, search_term, pos_filter=None, sort_by_pos=False): 
+@functools.lru_cache(maxsize=QUERY_SHAPE_CACHE_SIZE)
+def _compile_query_shape(data_type, category_kind, pos_kind, search_variants, fuzzy_count, has_kanji):
     """
-    根據參數生成基礎查詢的 SELECT/FROM, WHERE 子句和參數列表。
+    依篩選條件的「形狀」組出 SELECT/FROM/WHERE (所有值都以 ? 帶入)。
+    同一形狀的請求得到同一個 SQL 字串，連線的 prepared statement 快取才能跨請求重複使用。
+    category_kind: None / 'uncategorized' / 'named'；pos_kind: None / 'none' (無詞性) / 'named'；
+    search_variants: LIKE 搜尋的字串版本數 (0~3)。
     """
-    
-    table_name = get_table_name(data_type) 
-    
-    if data_type not in ['vocab', 'grammar']:
-        return None, None, None, None
-
-    term_column = 'term' 
+    table_name = get_table_name(data_type)
 
     # 基礎 SELECT 和 FROM
-    select_clause = f"T1.id, T1.{term_column}, T1.explanation, T1.example_sentence"
+    select_clause = "T1.id, T1.term, T1.explanation, T1.example_sentence"
+    if data_type == 'vocab':
+        # pos_sort_key 同時作為詞性排序鍵與顯示用的詞性字串
+        select_clause += ", T1.pos_sort_key"
     from_clause = f"FROM {table_name} AS T1"
     where_clauses = []
-    params = []
     is_distinct = False
-    
-    # 處理分類條件
-    if category:
-        if category == '__uncategorized__':
-            # LEFT JOIN item_category_table 並檢查連結是否為 NULL，找出無分類的項目
-            from_clause += """
-                LEFT JOIN item_category_table AS T2 ON T1.id = T2.item_id AND T2.item_type = ?
-            """
-            params.append(data_type)
-            where_clauses.append("T2.category_id IS NULL")
-            is_distinct = True
-        else:
-            # 必須 JOIN item_category_table 和 category_table (特定分類篩選)
-            from_clause += """
-                JOIN item_category_table AS T2 ON T1.id = T2.item_id 
-                JOIN category_table AS T3 ON T2.category_id = T3.id
-            """
-            # 確保只篩選當前 data_type 的項目
-            where_clauses.append("T3.name = ? AND T2.item_type = ?")
-            params.extend([category, data_type])
-            is_distinct = True
-        
-    # 處理詞性 JOIN (包含篩選和排序)
-    if data_type == 'vocab' and (pos_filter or sort_by_pos):
-        
-        # 如果有篩選條件，我們必須使用 INNER JOIN
-        join_type = "INNER" if pos_filter else "LEFT"
-        
+
+    # 容錯搜尋結果 (以 VALUES 表帶入排名，必須在其他 JOIN 參數之前)
+    if fuzzy_count:
+        values_sql = ", ".join(["(?, ?)"] * fuzzy_count)
         from_clause += f"""
-            {join_type} JOIN item_pos_table AS T_POS ON T1.id = T_POS.item_id 
-            {join_type} JOIN pos_master_table AS T_POS_M ON T_POS.pos_id = T_POS_M.id
+            JOIN (SELECT column1 AS id, column2 AS rank FROM (VALUES {values_sql})) AS T_RANK ON T_RANK.id = T1.id
         """
-        
-        # 如果有篩選條件，增加 WHERE
-        if pos_filter:
-             where_clauses.append("T_POS_M.name = ?")
-             params.append(pos_filter)
-             
-        # 如果需要排序，增加 SELECT 子句
-        if sort_by_pos:
-            select_clause += ", GROUP_CONCAT(T_POS_M.name) AS pos_string_for_sort" 
-            
-        is_distinct = True # 只要有 JOIN，都可能需要 GROUP BY/DISTINCT
+        select_clause += ", T_RANK.rank AS fuzzy_rank"
 
-    # 處理搜尋條件 (搜尋範圍涵蓋 term, explanation, example_sentence)
-    where_clause_str = ""
-    if where_clauses:
-        where_clause_str = " WHERE " + " AND ".join(where_clauses)
-    
-    if search_term:
-        # 1. 取得所有需要查詢的版本 (原始詞 + 轉換後的假名)
-        search_terms_to_check = {search_term} # 用 set 確保唯一性
-        
-        # 轉換為平假名並加入集合
-        search_term_hiragana = _convert_kana(search_term, 'hiragana')
-        if search_term_hiragana != search_term:
-            search_terms_to_check.add(search_term_hiragana)
-            
-        # 轉換為片假名並加入集合
-        search_term_katakana = _convert_kana(search_term, 'katakana')
-        if search_term_katakana != search_term and search_term_katakana != search_term_hiragana:
-            search_terms_to_check.add(search_term_katakana)
-            
-        # 2. 建立 OR 條件列表和參數列表
-        search_params = []
-        all_search_clauses = []
-        base_search_query = f"(T1.{term_column} LIKE ? OR T1.explanation LIKE ? OR T1.example_sentence LIKE ?)"
-        
-        # 3. 針對每個需要查詢的版本，建立一組查詢條件和參數
-        for term_to_check in search_terms_to_check:
-            all_search_clauses.append(base_search_query)
-            search_param = f"%{term_to_check}%"
-            search_params.extend([search_param, search_param, search_param]) 
+    # 漢字篩選 (每個項目在索引中對同一漢字只有一列，不需 DISTINCT)
+    if has_kanji:
+        from_clause += """
+            JOIN kanji_index_table AS T_KANJI ON T_KANJI.item_id = T1.id AND T_KANJI.item_type = ? AND T_KANJI.kanji = ?
+        """
+
+    if category_kind == 'uncategorized':
+        # LEFT JOIN item_category_table 並檢查連結是否為 NULL，找出無分類的項目
+        from_clause += """
+            LEFT JOIN item_category_table AS T2 ON T1.id = T2.item_id AND T2.item_type = ?
+        """
+        where_clauses.append("T2.category_id IS NULL")
+        is_distinct = True
+    elif category_kind == 'named':
+        # 必須 JOIN item_category_table 和 category_table (特定分類篩選)
+        from_clause += """
+            JOIN item_category_table AS T2 ON T1.id = T2.item_id 
+            JOIN category_table AS T3 ON T2.category_id = T3.id
+        """
+        # 確保只篩選當前 data_type 的項目
+        where_clauses.append("T3.name = ? AND T2.item_type = ?")
+        is_distinct = True
+
+    # 詞性篩選 JOIN (詞性排序改用 T1.pos_sort_key，不需 JOIN)；無詞性的項目 pos_sort_key 為 NULL
+    if pos_kind == 'none':
+        where_clauses.append("T1.pos_sort_key IS NULL")
+    elif pos_kind == 'named':
+        from_clause += """
+            INNER JOIN item_pos_table AS T_POS ON T1.id = T_POS.item_id 
+            INNER JOIN pos_master_table AS T_POS_M ON T_POS.pos_id = T_POS_M.id
+        """
+        where_clauses.append("T_POS_M.name = ?")
+        is_distinct = True
+
+    # 搜尋條件 (比對純文字影子欄位，不會命中 HTML 標籤)
+    if search_variants:
+        base_search_query = "(T1.term_plain LIKE ? OR T1.explanation_plain LIKE ? OR T1.example_plain LIKE ?)"
+        where_clauses.append("(" + " OR ".join([base_search_query] * search_variants) + ")")
 
-        # 4. 組合最終的 WHERE 條件
-        full_search_query = " OR ".join(all_search_clauses)
-        where_clauses.append(f"({full_search_query})") # 加上括號確保 AND/OR 優先級
-        params.extend(search_params)
-    
     where_clause_str = ""
     if where_clauses:
         where_clause_str = " WHERE " + " AND ".join(where_clauses)
-    
+
     if is_distinct:
-        # 如果有 JOIN 且沒有 GROUP BY，則使用 DISTINCT。如果使用了 GROUP_CONCAT，則需要 GROUP BY。
-        if sort_by_pos:
-            # 必須使用 GROUP BY，這樣才能使用 GROUP_CONCAT
-            return select_clause, from_clause, where_clause_str, params
-        else:
-            # 如果只是篩選，使用 DISTINCT
-            select_clause = "DISTINCT " + select_clause
-        
+        # 如果有 JOIN，使用 DISTINCT 避免重複
+        select_clause = "DISTINCT " + select_clause
+
+    return select_clause, from_clause, where_clause_str
+
+def _search_variants(search_term):
+    """搜尋字串的各版本 (原始詞 + 轉換後的平假名/片假名)；與影子欄位一樣做 NFKC 正規化。"""
+    search_term = backend_normalize(search_term)
+    variants = [search_term]
+    for target_type in ('hiragana', 'katakana'):
+        converted = _convert_kana(search_term, target_type)
+        if converted not in variants:
+            variants.append(converted)
+    return variants
+
+def _get_query_components(data_type, category, search_term, pos_filter=None, fuzzy_ranking=None, kanji_filter=None): 
+    """
+    根據參數生成基礎查詢的 SELECT/FROM, WHERE 子句和參數列表 (SQL 依形狀快取，這裡只組參數)。
+    fuzzy_ranking: trigram 容錯搜尋的 [(item_id, similarity), ...]，提供時取代 LIKE 搜尋。
+    kanji_filter: 只列出表記含有該漢字的項目 (走 kanji_index_table 主鍵)。
+    """
+    import stats_cube
+    if data_type not in ['vocab', 'grammar']:
+        return None, None, None, None
+
+    # 參數順序需與 _compile_query_shape 中 ? 出現的順序一致
+    params = []
+    if fuzzy_ranking:
+        for rank, (item_id, _) in enumerate(fuzzy_ranking):
+            params.extend([item_id, rank])
+    if kanji_filter:
+        params.extend([data_type, kanji_filter])
+
+    category_kind = None
+    if category == '__uncategorized__':
+        category_kind = 'uncategorized'
+        params.append(data_type)
+    elif category:
+        category_kind = 'named'
+        params.extend([category, data_type])
+
+    pos_kind = None
+    if data_type == 'vocab' and pos_filter == stats_cube.NO_POS:
+        pos_kind = 'none'
+    elif data_type == 'vocab' and pos_filter:
+        pos_kind = 'named'
+        params.append(pos_filter)
+
+    variants = _search_variants(search_term) if (search_term and not fuzzy_ranking) else []
+    for variant in variants:
+        params.extend([f"%{variant}%"] * 3)
+
+    select_clause, from_clause, where_clause_str = _compile_query_shape(
+        data_type, category_kind, pos_kind, len(variants), len(fuzzy_ranking or ()), bool(kanji_filter)
+    )
     return select_clause, from_clause, where_clause_str, params
 
 # ----------------- 詞性處理工具函數-----------------
@@ -335,9 +629,12 @@ def update_item_pos(item_id, pos_list, conn):
                 except sqlite3.IntegrityError:
                     pass
 
+    # 3. 更新反正規化的詞性排序鍵
+    item_index.refresh_pos_sort_keys(conn, [item_id])
+
 def get_item_pos_string(item_id):
     """根據 item_id 查詢並返回詞性字串 (名, 動, 自動,...)"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -350,10 +647,57 @@ def get_item_pos_string(item_id):
     conn.close()
     return ','.join(pos_list)
 
+# ----------------- 壓縮欄位 -----------------
+def pack_explanation(explanation, conn):
+    """啟用壓縮時，過長的說明以壓縮格式寫入 (讀取端一律經過 text_codec.unpack)。"""
+    return text_codec.pack(conn, explanation) if TEXT_COMPRESSION_ENABLED else explanation
+
+# ----------------- 衍生索引維護 -----------------
+def update_item_indexes(item_id, item_type, conn, term=None):
+    """項目新增或編輯後，更新其純文字欄位、讀音、羅馬拼音、trigram、例句反向索引與文法句型索引。"""
+    item_index.refresh_plain_text(conn, item_type, [item_id])
+    item_index.refresh_term_index(conn, item_type, [item_id])
+    if item_type == 'vocab' and term is not None:
+        example_linker.refresh_vocab(conn, item_id, term)
+    example_linker.refresh_sources(conn, item_type, [item_id])
+    if item_type == 'grammar':
+        grammar_matcher.refresh_grammar(conn, item_id)
+    grammar_matcher.refresh_sources(conn, item_type, [item_id])
+
+def delete_item_indexes(item_ids, item_type, conn):
+    """項目刪除前，移除其所有衍生索引與排程狀態 (item_ids 為 ID 列表)。"""
+    item_index.delete_term_index(conn, item_type, item_ids)
+    example_linker.remove(conn, item_type, item_ids)
+    grammar_matcher.remove(conn, item_type, item_ids)
+    srs.delete_card_states(conn, item_type, item_ids)
+
+def get_grammar_match_counts(grammar_ids, conn):
+    """返回 {grammar_id: 符合句型的例句數}。"""
+    placeholders = ",".join("?" * len(grammar_ids))
+    rows = conn.execute(f'''
+        SELECT grammar_id, COUNT(*) FROM grammar_match_table
+        WHERE grammar_id IN ({placeholders}) GROUP BY grammar_id
+    ''', list(grammar_ids)).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def get_example_links(vocab_id, conn, limit=USED_IN_LIMIT):
+    """返回含有該單字的例句 (依來源類型、ID 排序，不含單字本身的例句)。"""
+    rows = conn.execute('''
+        SELECT L.source_type, L.source_id, COALESCE(V.term, G.term) AS term,
+               COALESCE(V.example_sentence, G.example_sentence) AS example_sentence
+        FROM example_link_table AS L
+        LEFT JOIN vocab_table AS V ON L.source_type = 'vocab' AND V.id = L.source_id
+        LEFT JOIN grammar_table AS G ON L.source_type = 'grammar' AND G.id = L.source_id
+        WHERE L.vocab_id = ? AND NOT (L.source_type = 'vocab' AND L.source_id = L.vocab_id)
+        ORDER BY L.source_type, L.source_id
+        LIMIT ?
+    ''', (vocab_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
 # ----------------- 分類處理工具函數-----------------
 def get_all_categories():
     """獲取所有分類名稱的列表"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT name FROM category_table ORDER BY name')
     categories = [row['name'] for row in cursor.fetchall()]
@@ -361,7 +705,7 @@ def get_all_categories():
     return categories
 
 def get_all_categories_with_counts():
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -424,7 +768,7 @@ def update_item_categories(item_id, item_type, category_string, conn):
 
 def get_item_categories_string(item_id, item_type):
     """根據 item_id 和 item_type 查詢並返回分類字串 (N5, 動詞)"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -439,60 +783,19 @@ def get_item_categories_string(item_id, item_type):
 # ----------------- 單字卡 -----------------
 def get_flashcard_query_parts(data_type, category_filter, pos_filter=None):
     """
-    建立 Flashcard 查詢的 FROM, JOIN, WHERE 語句和對應的參數。
+    建立 Flashcard 查詢的 FROM, JOIN, WHERE 語句和對應的參數 (與列表頁共用 _compile_query_shape)。
     返回: (SQL_FRAGMENT, PARAMS)
     """
-    
-    params = []
-    
-    if data_type == 'vocab':
-        table_name = 'vocab_table'
-        item_type = 'vocab'
-    elif data_type == 'grammar':
-        table_name = 'grammar_table'
-        item_type = 'grammar'
-    else:
+    if data_type not in ['vocab', 'grammar']:
         return ("", [])
 
-    from_join_parts = [f"FROM {table_name} AS T1"]
-    where_clauses = ["1=1"]
-    
-    # 1. Category 過濾
-    if category_filter and category_filter != 'all':
-        
-        if category_filter == '__uncategorized__':
-            from_join_parts.append(
-                f"""LEFT JOIN item_category_table AS T2 ON T1.id = T2.item_id AND T2.item_type = '{item_type}'"""
-            )
-            where_clauses.append("T2.category_id IS NULL")
-        else:
-            # 使用 INNER JOIN 確保只有包含該分類的項目被選中
-            from_join_parts.append(
-                f"""INNER JOIN item_category_table AS T2 ON T1.id = T2.item_id AND T2.item_type = '{item_type}'
-                   INNER JOIN category_table AS T3 ON T2.category_id = T3.id"""
-            )
-            where_clauses.append("T3.name = ?")
-            params.append(category_filter)
-    else:
-        pass 
-
-    # 2. POS 過濾 (僅針對 vocab)
-    if data_type == 'vocab' and pos_filter and pos_filter != 'all':
+    category = category_filter if category_filter and category_filter != 'all' else None
+    pos_abbr = None
+    if pos_filter and pos_filter != 'all':
         pos_abbr = pos_filter.split(' ')[0].strip() if ' ' in pos_filter else pos_filter
-        
-        # 使用 INNER JOIN item_pos_table 進行詞性過濾
-        from_join_parts.append(
-            f"""INNER JOIN item_pos_table AS T_POS ON T1.id = T_POS.item_id
-               INNER JOIN pos_master_table AS T_POS_M ON T_POS.pos_id = T_POS_M.id"""
-        )
-        where_clauses.append("T_POS_M.name = ?")
-        params.append(pos_abbr)
 
-    # 重新處理 FROM/JOIN 語句
-    from_join = " ".join(from_join_parts)
-    where_sql = " WHERE " + " AND ".join(where_clauses)
-    
-    return (f"{from_join} {where_sql}", params)
+    _, from_clause, where_clause_str, params = _get_query_components(data_type, category, None, pos_abbr)
+    return (f"{from_clause} {where_clause_str}", params)
 
 # ----------------- URL部分 -----------------
 @app.route('/')
@@ -500,6 +803,26 @@ def home():
     """API 路由：首頁。"""
     return render_template('home.html')
 
+# ----------------- 漢字 kanji -----------------
+@app.route('/kanji_overview')
+def kanji_overview():
+    """API 路由：漢字總覽 (依含有該漢字的單字數排序)。"""
+    data_type = request.args.get('data_type', 'vocab')
+    if data_type not in ['vocab', 'grammar']:
+        data_type = 'vocab'
+    conn = get_read_connection()
+    try:
+        rows = conn.execute('''
+            SELECT kanji, COUNT(*) AS count FROM kanji_index_table
+            WHERE item_type = ?
+            GROUP BY kanji
+            ORDER BY count DESC, kanji
+        ''', (data_type,)).fetchall()
+    finally:
+        conn.close()
+    kanji_counts = [{'kanji': row['kanji'], 'count': row['count']} for row in rows]
+    return render_template('kanji_overview.html', kanji_counts=kanji_counts, data_type=data_type)
+
 # ----------------- 分類 categories -----------------
 @app.route('/categories_overview')
 def categories_overview():
@@ -519,74 +842,74 @@ def api_add_category():
     # 沿用你現有的後端規範化函式，確保資料安全
     normalized_name = backend_normalize(category_name)
 
-    conn = get_db_connection()
-    try:
+    def add_category_job(conn):
         cursor = conn.cursor()
         # 檢查是否重複
         cursor.execute('SELECT id FROM category_table WHERE name = ?', (normalized_name,))
         if cursor.fetchone():
-            return jsonify({'success': False, 'message': f'分類「{normalized_name}」已存在。'}), 409
+            return False
 
         # 執行插入
         cursor.execute('INSERT INTO category_table (name) VALUES (?)', (normalized_name,))
-        conn.commit()
+        return True
+
+    try:
+        if not write_queue.run(add_category_job):
+            return jsonify({'success': False, 'message': f'分類「{normalized_name}」已存在。'}), 409
         
         flash(f'成功建立分類：{normalized_name}', 'success')
         return jsonify({'success': True})
     except sqlite3.Error as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': f'資料庫錯誤: {e}'}), 500
-    finally:
-        conn.close()
         
 @app.route('/api/edit_category/<path:old_name>', methods=['POST'])
 def api_edit_category(old_name):
     """API 路由：編輯分類。"""
-    conn = get_db_connection()
-    try:
-        data = request.get_json()
-        new_name = data.get('new_name', '').strip()
+    data = request.get_json()
+    new_name = data.get('new_name', '').strip()
 
-        if not new_name:
-            return jsonify({'success': False, 'message': '新的分類名稱不能為空'}), 400
-        
+    if not new_name:
+        return jsonify({'success': False, 'message': '新的分類名稱不能為空'}), 400
+
+    def edit_category_job(conn):
+        """返回 'unchanged' / 'missing' / 'exists' / 'renamed'。"""
+        cursor = conn.cursor()
         if new_name == old_name:
             # 檢查舊名稱是否真的存在
-            cursor = conn.cursor()
             cursor.execute('SELECT id FROM category_table WHERE name = ?', (old_name,))
-            if cursor.fetchone():
-                 return jsonify({'success': True, 'message': '名稱未更改'}), 200
-            else:
-                 return jsonify({'success': False, 'message': '原分類不存在'}), 404
-
-        cursor = conn.cursor()
+            return 'unchanged' if cursor.fetchone() else 'original_missing'
         
         # 檢查新的分類名稱是否已存在 (避免唯一性約束錯誤)
         cursor.execute('SELECT id FROM category_table WHERE name = ?', (new_name,))
         if cursor.fetchone():
-            return jsonify({'success': False, 'message': f'分類名稱「{new_name}」已存在。'}), 409
+            return 'exists'
 
         # 更新 category_table 中的名稱 (item_category_table 會通過外鍵關係保持正確)
         cursor.execute('UPDATE category_table SET name = ? WHERE name = ?', (new_name, old_name))
-        
-        if cursor.rowcount == 0:
-            return jsonify({'success': False, 'message': '分類不存在或無法找到'}), 404
+        return 'renamed' if cursor.rowcount else 'missing'
 
-        conn.commit()
-        flash(f'分類名稱已從「{old_name}」成功更改為「{new_name}」！', 'success')
-        return jsonify({'success': True})
+    try:
+        result = write_queue.run(edit_category_job)
     except sqlite3.Error as e:
-        conn.rollback()
         # 由於已檢查，此處主要處理其他可能的資料庫錯誤
         return jsonify({'success': False, 'message': f'資料庫錯誤: {e}'}), 500
-    finally:
-        conn.close()
+
+    if result == 'unchanged':
+        return jsonify({'success': True, 'message': '名稱未更改'}), 200
+    if result == 'exists':
+        return jsonify({'success': False, 'message': f'分類名稱「{new_name}」已存在。'}), 409
+    if result == 'original_missing':
+        return jsonify({'success': False, 'message': '原分類不存在'}), 404
+    if result == 'missing':
+        return jsonify({'success': False, 'message': '分類不存在或無法找到'}), 404
+
+    flash(f'分類名稱已從「{old_name}」成功更改為「{new_name}」！', 'success')
+    return jsonify({'success': True})
         
 @app.route('/api/delete_category/<path:category_name>', methods=['POST'])
 def api_delete_category(category_name):
     """API 路由：刪除分類。"""
-    conn = get_db_connection()
-    try:
+    def delete_category_job(conn):
         cursor = conn.cursor()
         
         # 1. 查找分類 ID
@@ -594,7 +917,7 @@ def api_delete_category(category_name):
         category_id = cursor.fetchone()
         
         if not category_id:
-            return jsonify({'success': False, 'message': '分類不存在'}), 404
+            return False
             
         category_id = category_id[0]
         
@@ -603,15 +926,15 @@ def api_delete_category(category_name):
         
         # 3. 刪除 category_table 中的分類
         cursor.execute('DELETE FROM category_table WHERE id = ?', (category_id,))
-        
-        conn.commit()
+        return True
+
+    try:
+        if not write_queue.run(delete_category_job):
+            return jsonify({'success': False, 'message': '分類不存在'}), 404
         flash(f'分類「{category_name}」已從所有筆記中移除！', 'success')
         return jsonify({'success': True})
     except sqlite3.Error as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/add/<data_type>', methods=['GET', 'POST'])
 def add_item(data_type, page, category, search, sort_by, sort_order, pos):
@@ -619,7 +942,6 @@ def add_item(data_type, page, category, search, sort_by, sort_order, pos):
     if data_type not in ['vocab', 'grammar']:
         return redirect(url_for('home'))
 
-    conn = get_db_connection()
     all_categories = get_all_categories()
     
     if request.method == 'POST':
@@ -637,31 +959,36 @@ def add_item(data_type, page, category, search, sort_by, sort_order, pos):
         # 獲取詞性數據 (僅 vocab)
         selected_pos_list = request.form.getlist('selected_pos') # NEW
         
-        try:
+        def add_item_job(conn):
             cursor = conn.cursor()
             
             if data_type == 'vocab':
                 cursor.execute(
                     'INSERT INTO vocab_table (term, explanation, example_sentence) VALUES (?, ?, ?)',
-                    (term, explanation, example_sentence)
+                    (term, pack_explanation(explanation, conn), example_sentence)
                 )
             else:
                 # grammar
                 cursor.execute(
                     'INSERT INTO grammar_table (term, explanation, example_sentence) VALUES (?, ?, ?)',
-                    (term, explanation, example_sentence)
+                    (term, pack_explanation(explanation, conn), example_sentence)
                 )
             
             item_id = cursor.lastrowid
             
+            # 更新衍生索引 (讀音/trigram)
+            update_item_indexes(item_id, data_type, conn, term)
+            
             # 處理分類連結表
             update_item_categories(item_id, data_type, category_string, conn)
             
             # 處理詞性連結表 (僅 vocab)
             if data_type == 'vocab':
                 update_item_pos(item_id, selected_pos_list, conn) # NEW
-            
-            conn.commit()
+            return item_id
+        
+        try:
+            item_id = write_queue.run(add_item_job)
             flash(f'{data_type}「{term}」已成功新增！', 'success')
             return redirect(url_for('list_page', data_type=data_type,
                             page=page, 
@@ -671,10 +998,7 @@ def add_item(data_type, page, category, search, sort_by, sort_order, pos):
                             sort_order=sort_order, 
                             pos=pos))
         except sqlite3.Error as e:
-            conn.rollback()
             flash(f'新增失敗: {e}', 'danger')
-        finally:
-            conn.close()
     # GET 請求
     template_name = f'add_{data_type}.html'
     return render_template(template_name, master_pos_list=MASTER_POS_LIST_RAW, all_categories=all_categories)
@@ -687,7 +1011,6 @@ def edit_item(data_type, item_id):
         return redirect(url_for('home'))
     table_name = get_table_name(data_type)
     data_type_display = '單字' if data_type == 'vocab' else '文法'
-    conn = get_db_connection()
     all_categories = get_all_categories()
     
     if request.method == 'POST':
@@ -704,29 +1027,27 @@ def edit_item(data_type, item_id):
         # 獲取詞性數據 (僅 vocab)
         selected_pos_list = request.form.getlist('selected_pos')
 
-        try:
+        def edit_item_job(conn):
             cursor = conn.cursor()
             
             # 1. 更新主表
-            if data_type == 'vocab':
-                cursor.execute(
-                    f'UPDATE {table_name} SET term=?, explanation=?, example_sentence=? WHERE id=?',
-                    (term, explanation, example_sentence, item_id)
-                )
-            else:
-                cursor.execute(
-                    f'UPDATE {table_name} SET term=?, explanation=?, example_sentence=? WHERE id=?',
-                    (term, explanation, example_sentence, item_id)
-                )
+            cursor.execute(
+                f'UPDATE {table_name} SET term=?, explanation=?, example_sentence=? WHERE id=?',
+                (term, pack_explanation(explanation, conn), example_sentence, item_id)
+            )
 
-            # 2. 更新分類連結表
+            # 2. 更新衍生索引 (讀音/trigram)
+            update_item_indexes(item_id, data_type, conn, term)
+            
+            # 3. 更新分類連結表
             update_item_categories(item_id, data_type, category_string, conn)
             
-            # 3. 更新詞性連結表 (僅 vocab)
+            # 4. 更新詞性連結表 (僅 vocab)
             if data_type == 'vocab':
                 update_item_pos(item_id, selected_pos_list, conn) # NEW
-            
-            conn.commit()
+
+        try:
+            write_queue.run(edit_item_job)
             flash(f'{data_type_display}「{term}」已成功更新！', 'success')
             return redirect(url_for('list_page', data_type=data_type, 
                                     page=request.args.get('page', None), 
@@ -734,17 +1055,19 @@ def edit_item(data_type, item_id):
                                     search=request.args.get('search',None), 
                                     sort_by=request.args.get('sort_by', None), 
                                     sort_order=request.args.get('sort_order', None), 
-                                    pos=request.args.get('pos', None)))
+                                    pos=request.args.get('pos', None),
+                                    kanji=request.args.get('kanji', None)))
         except sqlite3.Error as e:
-            conn.rollback()
             flash(f'更新失敗: {e}', 'danger')
-        finally:
-            conn.close()
 
     # GET 請求
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f'SELECT * FROM {table_name} WHERE id = ?', (item_id,))
     item = cursor.fetchone()
+    if item is not None:
+        item = text_codec.unpack_item(conn, dict(item))
+    used_in = get_example_links(item_id, conn) if (item is not None and data_type == 'vocab') else []
     conn.close()
 
     if item is None:
@@ -755,7 +1078,8 @@ def edit_item(data_type, item_id):
                                 search=request.args.get('search',None), 
                                 sort_by=request.args.get('sort_by', None), 
                                 sort_order=request.args.get('sort_order', None), 
-                                pos=request.args.get('pos', None)))
+                                pos=request.args.get('pos', None),
+                                kanji=request.args.get('kanji', None)))
 
     item = dict(item) 
     item['categories'] = get_item_categories_string(item_id, data_type)
@@ -766,7 +1090,7 @@ def edit_item(data_type, item_id):
         item['selected_pos_list'] = [p.strip() for p in pos_string.split(',') if p.strip()] # NEW
     
     # 傳遞完整的 MASTER_POS_LIST_RAW 給前端，因為前端需要顯示括號內的中文
-    return render_template('edit_item.html', item=item, data_type=data_type, all_categories=all_categories, master_pos_list=MASTER_POS_LIST_RAW)
+    return render_template('edit_item.html', item=item, data_type=data_type, all_categories=all_categories, master_pos_list=MASTER_POS_LIST_RAW, used_in=used_in)
 
 @app.route('/delete/<data_type>/<int:item_id>', methods=['GET', 'POST'])
 def delete_item(data_type, item_id):
@@ -778,9 +1102,7 @@ def delete_item(data_type, item_id):
     table_name = get_table_name(data_type)
     data_type_display = '單字' if data_type == 'vocab' else '文法'
     
-    conn = get_db_connection()
-    
-    try:
+    def delete_item_job(conn):
         cursor = conn.cursor()
         # 1. 刪除 item_category_table 中的連結
         cursor.execute('DELETE FROM item_category_table WHERE item_id = ? AND item_type = ?', (item_id, data_type))
@@ -789,16 +1111,17 @@ def delete_item(data_type, item_id):
         if data_type == 'vocab':
             cursor.execute('DELETE FROM item_pos_table WHERE item_id = ?', (item_id,))
         
-        # 3. 刪除主表中的項目
-        cursor.execute(f'DELETE FROM {table_name} WHERE id = ?', (item_id,))
+        # 3. 刪除衍生索引、卡片排程狀態與複習紀錄
+        delete_item_indexes([item_id], data_type, conn)
         
-        conn.commit()
+        # 4. 刪除主表中的項目
+        cursor.execute(f'DELETE FROM {table_name} WHERE id = ?', (item_id,))
+    
+    try:
+        write_queue.run(delete_item_job)
         flash(f'該筆{data_type_display}已成功刪除。', 'success')
     except sqlite3.Error as e:
-        conn.rollback()
         flash(f'刪除失敗: {e}', 'danger')
-    finally:
-        conn.close()
 
     return redirect(url_for('list_page', data_type=data_type, 
                             page=request.args.get('page', None), 
@@ -806,7 +1129,158 @@ def delete_item(data_type, item_id):
                             search=request.args.get('search',None), 
                             sort_by=request.args.get('sort_by', None), 
                             sort_order=request.args.get('sort_order', None), 
-                            pos=request.args.get('pos', None)))
+                            pos=request.args.get('pos', None),
+                            kanji=request.args.get('kanji', None)))
+
+# ----------------- 串流匯出 -----------------
+@app.route('/export/<data_type>', methods=['GET'])
+def export_items(data_type):
+    """
+    API 路由：以串流方式匯出單字或文法 (?format=tsv|csv|ndjson)，篩選參數與列表頁相同。
+    TSV 使用 import_anki_data 的欄位配置，可以直接重新匯入。
+    """
+    import export_data
+    if data_type not in ['vocab', 'grammar']:
+        return redirect(url_for('home'))
+    export_format = request.args.get('format', 'tsv')
+    if export_format not in export_data.EXPORT_FORMATS:
+        flash(f'不支援的匯出格式: {export_format}', 'danger')
+        return redirect(url_for('list_page', data_type=data_type))
+
+    kanji_filter = request.args.get('kanji') or None
+    if kanji_filter and not (len(kanji_filter) == 1 and item_index.is_kanji(kanji_filter)):
+        kanji_filter = None
+    _, from_clause, where_clause_str, params = _get_query_components(
+        data_type, request.args.get('category'), request.args.get('search'), request.args.get('pos'),
+        kanji_filter=kanji_filter
+    )
+    query = export_data.build_export_query(data_type, from_clause, where_clause_str)
+
+    store = current_store() # 產生器在請求結束後才執行，需先取得目前的分片
+    def generate():
+        # 連線在產生器內開啟，回應串流結束 (或客戶端中斷) 時關閉
+        conn = store.read_pool.connect()
+        try:
+            yield from export_data.stream_export(
+                export_data.iter_export_rows(conn, data_type, query, params), export_format
+            )
+        finally:
+            conn.close()
+
+    extension = 'txt' if export_format == 'tsv' else export_format
+    filename = f"{request.args.get('category') or data_type}.{extension}"
+    return Response(generate(), mimetype=export_data.EXPORT_MIMETYPES[export_format], headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{url_quote(filename)}",
+    })
+
+# ----------------- 批次操作 -----------------
+BULK_ACTIONS = ('delete', 'add_category', 'remove_category', 'set_pos')
+
+def _load_bulk_ids(data_type, payload, conn):
+    """
+    將批次操作的目標項目寫入暫存表 temp.bulk_ids，返回筆數。
+    payload 可帶 ids (ID 列表)，或 filter (與列表頁相同的 category/search/pos/kanji 條件，只做完全比對)。
+    """
+    table_name = get_table_name(data_type)
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_ids (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.bulk_ids')
+
+    if isinstance(payload.get('filter'), dict):
+        filters = payload['filter']
+        kanji_filter = filters.get('kanji') or None
+        if kanji_filter and not (len(kanji_filter) == 1 and item_index.is_kanji(kanji_filter)):
+            kanji_filter = None
+        _, from_clause, where_clause_str, params = _get_query_components(
+            data_type, filters.get('category') or None, filters.get('search') or None,
+            filters.get('pos') or None, kanji_filter=kanji_filter
+        )
+        conn.execute(f'INSERT OR IGNORE INTO temp.bulk_ids (id) SELECT DISTINCT T1.id {from_clause} {where_clause_str}', params)
+    else:
+        id_rows = []
+        for raw_id in payload.get('ids') or []:
+            try:
+                id_rows.append((int(raw_id),))
+            except (TypeError, ValueError):
+                continue
+        conn.executemany('INSERT OR IGNORE INTO temp.bulk_ids (id) VALUES (?)', id_rows)
+        # 只保留實際存在的項目
+        conn.execute(f'DELETE FROM temp.bulk_ids WHERE id NOT IN (SELECT id FROM {table_name})')
+
+    return conn.execute('SELECT COUNT(*) FROM temp.bulk_ids').fetchone()[0]
+
+@app.route('/api/bulk/<data_type>', methods=['POST'])
+def api_bulk(data_type):
+    """
+    API 路由：批次刪除、加入/移除分類、設定詞性。
+    所有變更以 set-based SQL 在同一個交易中完成，返回符合 (matched) 與實際變更 (affected) 的筆數。
+    """
+    if data_type not in ['vocab', 'grammar']:
+        return jsonify({'success': False, 'message': '無效的資料類型'}), 400
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    category_name = (data.get('category') or '').strip()
+    if action not in BULK_ACTIONS:
+        return jsonify({'success': False, 'message': '無效的批次操作'}), 400
+    if action in ('add_category', 'remove_category') and not category_name:
+        return jsonify({'success': False, 'message': '請輸入分類名稱'}), 400
+    if action == 'set_pos' and data_type != 'vocab':
+        return jsonify({'success': False, 'message': '只有單字可以設定詞性'}), 400
+
+    table_name = get_table_name(data_type)
+
+    def bulk_job(conn):
+        """返回 (matched, affected)。"""
+        cursor = conn.cursor()
+        matched = _load_bulk_ids(data_type, data, conn)
+        affected = 0
+
+        if matched and action == 'delete':
+            deleted_ids = [row[0] for row in cursor.execute('SELECT id FROM temp.bulk_ids')]
+            cursor.execute('DELETE FROM item_category_table WHERE item_type = ? AND item_id IN (SELECT id FROM temp.bulk_ids)', (data_type,))
+            if data_type == 'vocab':
+                cursor.execute('DELETE FROM item_pos_table WHERE item_id IN (SELECT id FROM temp.bulk_ids)')
+            delete_item_indexes(deleted_ids, data_type, conn)
+            cursor.execute(f'DELETE FROM {table_name} WHERE id IN (SELECT id FROM temp.bulk_ids)')
+            affected = cursor.rowcount
+
+        elif matched and action == 'add_category':
+            category_id = get_or_create_category(category_name, conn)
+            cursor.execute('''
+                INSERT OR IGNORE INTO item_category_table (item_id, item_type, category_id)
+                SELECT id, ?, ? FROM temp.bulk_ids
+            ''', (data_type, category_id))
+            affected = cursor.rowcount
+
+        elif matched and action == 'remove_category':
+            cursor.execute('''
+                DELETE FROM item_category_table
+                WHERE item_type = ? AND item_id IN (SELECT id FROM temp.bulk_ids)
+                  AND category_id = (SELECT id FROM category_table WHERE name = ?)
+            ''', (data_type, category_name))
+            affected = cursor.rowcount
+
+        elif matched and action == 'set_pos':
+            # 以新的詞性集合取代原有詞性 (空列表 = 清除詞性)
+            pos_ids = {get_pos_id(p, conn) for p in data.get('pos') or []} - {None}
+            cursor.execute('DELETE FROM item_pos_table WHERE item_id IN (SELECT id FROM temp.bulk_ids)')
+            if pos_ids:
+                placeholders = ",".join("?" * len(pos_ids))
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO item_pos_table (item_id, pos_id)
+                    SELECT B.id, M.id FROM temp.bulk_ids AS B, pos_master_table AS M WHERE M.id IN ({placeholders})
+                ''', list(pos_ids))
+            cursor.execute(f'UPDATE vocab_table SET pos_sort_key = {item_index.POS_SORT_KEY_SUBQUERY} WHERE id IN (SELECT id FROM temp.bulk_ids)')
+            affected = cursor.rowcount
+
+        return matched, affected
+
+    try:
+        matched, affected = write_queue.run(bulk_job)
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'批次操作失敗: {e}'}), 500
+
+    return jsonify({'success': True, 'action': action, 'matched': matched, 'affected': affected})
 
 @app.route('/add/vocab', methods=['GET', 'POST'])
 def add_vocab():
@@ -882,6 +1356,54 @@ class PaginationMock:
             
         return final_pages
 
+def render_fragment(template_name, **context):
+    """渲染片段模板 (不經過 context processor，模板中只能使用 url_for 等 Jinja 全域函數)。"""
+    return app.jinja_env.get_template(template_name).render(**context)
+
+def sync_fragment_cache(conn):
+    """
+    資料有變動 (data_version 改變) 時讀取變更日誌，只淘汰受影響的片段：
+    變動項目的列、所有文法列 (例句變動會改變句型命中數)、分類有變動時的篩選/批次選單。
+    返回目前的快取世代，存入片段時比對。
+    """
+    version = data_version.current()
+    if not fragment_cache.stale(version):
+        return fragment_cache.generation
+    changes = fragment_feed.poll(conn)
+    if changes is None:
+        fragment_feed.reset(conn)
+        return fragment_cache.invalidate(version)
+    items = {(entity, entity_id) for entity, entity_id, _ in changes if entity in change_log.ITEM_ENTITIES}
+    categories_changed = any(entity == 'category' for entity, _, _ in changes)
+
+    def affected(key):
+        if key[0] == 'row':
+            return (key[1], key[2]) in items or (key[1] == 'grammar' and bool(items))
+        return categories_changed
+
+    return fragment_cache.invalidate(version, affected)
+
+@functools.lru_cache(maxsize=QUERY_SHAPE_CACHE_SIZE)
+def _list_order_clause(data_type, sort_by, sort_order, is_fuzzy):
+    """列表頁的 ORDER BY 子句 (只允許白名單欄位，依排序形狀快取)。"""
+    if is_fuzzy:
+        # 容錯搜尋結果依相似度排序
+        return " ORDER BY fuzzy_rank ASC"
+    allowed_sorts = {
+        'id': 'T1.id',
+        'term': 'T1.term',
+        'timestamp': 'T1.id', 
+        'pos': 'T1.pos_sort_key',
+    }
+    sort_column = allowed_sorts.get(sort_by, 'T1.id') 
+    if sort_by == 'pos' and data_type != 'vocab':
+        sort_column = 'T1.id' # 文法沒有詞性
+    sort_order_sql = 'DESC' if sort_order == 'desc' else 'ASC'
+    if sort_by == 'pos' and data_type == 'vocab':
+        # 讓沒有詞性的項目排在最後 (NULLS LAST)，與 idx_vocab_pos_sort(_desc) 索引順序一致
+        return f" ORDER BY ({sort_column} IS NULL) ASC, {sort_column} {sort_order_sql}, T1.id {sort_order_sql}"
+    return f" ORDER BY {sort_column} {sort_order_sql}"
+
 @app.route('/list/<data_type>', methods=['GET'])
 def list_page(data_type):
     """API 路由：單字或文法清單。"""
@@ -889,31 +1411,45 @@ def list_page(data_type):
     category = request.args.get('category')
     search_term = request.args.get('search')
     pos_filter = request.args.get('pos') 
+    kanji_filter = request.args.get('kanji') or None
+    if kanji_filter and not (len(kanji_filter) == 1 and item_index.is_kanji(kanji_filter)):
+        flash('漢字篩選只能輸入單一漢字', 'warning')
+        kanji_filter = None
     
     sort_by = request.args.get('sort_by', 'id')
     sort_order = request.args.get('sort_order', 'asc')
     
-    sort_by_pos = (data_type == 'vocab' and sort_by == 'pos')
-    
     # 1. 獲取查詢組件
-    select_clause, from_clause, where_clause_str, params = _get_query_components(data_type, category, search_term, pos_filter, sort_by_pos)
+    select_clause, from_clause, where_clause_str, params = _get_query_components(data_type, category, search_term, pos_filter, kanji_filter=kanji_filter)
     
     if not select_clause:
         flash('錯誤: 無效的資料類型', 'danger')
         return redirect(url_for('home'))
 
-    conn = get_db_connection()
+    conn = get_read_connection()
+    # 需在查詢前同步：查詢期間若有寫入，下次同步時會淘汰；淘汰前讀到的舊資料則因世代不符不會存入快取
+    generation = sync_fragment_cache(conn)
     items = []
+    item_rows = []
     total_items = 0
     total_pages = 1
     pagination = None
+    fuzzy_ranking = None
     
     try:
-        # 2. 計算總筆數 (使用 COUNT(DISTINCT T1.id) 確保計數正確)
-        _, count_from_clause, count_where_clause_str, count_params = _get_query_components(data_type, category, search_term, pos_filter, False)
-        count_query_optimized = f"SELECT COUNT(DISTINCT T1.id) {count_from_clause} {count_where_clause_str}"
+        # 2. 計算總筆數 (使用 COUNT(DISTINCT T1.id) 確保計數正確，與項目查詢共用同一組 FROM/WHERE)
+        count_query_optimized = f"SELECT COUNT(DISTINCT T1.id) {from_clause} {where_clause_str}"
+        
+        total_items = conn.execute(count_query_optimized, params).fetchone()[0]
         
-        total_items = conn.execute(count_query_optimized, count_params).fetchone()[0]
+        # 2-1. 完全比對找不到時，改用 trigram 索引做容錯/羅馬拼音搜尋
+        if total_items == 0 and search_term:
+            fuzzy_ranking = item_index.fuzzy_search(conn, data_type, search_term)
+            if fuzzy_ranking:
+                select_clause, from_clause, where_clause_str, params = _get_query_components(data_type, category, search_term, pos_filter, fuzzy_ranking, kanji_filter)
+                total_items = conn.execute(f"SELECT COUNT(DISTINCT T1.id) {from_clause} {where_clause_str}", params).fetchone()[0]
+                if total_items > 0:
+                    flash(f'找不到完全符合「{search_term}」的項目，以下為相似度最高的結果。', 'info')
         
         if total_items > 0:
             total_pages = math.ceil(total_items / PER_PAGE)
@@ -925,51 +1461,46 @@ def list_page(data_type):
                 page = total_pages
             
             # 3. 處理排序
-            allowed_sorts = {
-                'id': 'T1.id',
-                'term': 'T1.term',
-                'timestamp': 'T1.id', 
-                'pos': 'pos_string_for_sort',
-            }
-            sort_column = allowed_sorts.get(sort_by, 'T1.id') 
-            # 處理詞性排序 (NULLs first/last)
-            if sort_by == 'pos':
-                # 讓沒有詞性的項目排在最後 (NULLS LAST)
-                order_by_clause = f" ORDER BY {sort_column} IS NULL ASC, {sort_column} "
-                sort_order_sql = 'DESC' if sort_order.lower() == 'desc' else 'ASC'
-                order_by_clause += sort_order_sql
-            else:
-                sort_order_sql = 'DESC' if sort_order.lower() == 'desc' else 'ASC'
-                order_by_clause = f" ORDER BY {sort_column} {sort_order_sql}"
+            order_by_clause = _list_order_clause(data_type, sort_by, sort_order.lower(), bool(fuzzy_ranking))
             
             # 4. 執行分頁查詢 (LIMIT/OFFSET)
             offset = (page - 1) * PER_PAGE
             
             # 完整的 ITEMS 查詢
             items_query = f"SELECT {select_clause} {from_clause} {where_clause_str}"
-            
-            if sort_by_pos:
-                # 如果按詞性排序，必須加上 GROUP BY T1.id
-                items_query += " GROUP BY T1.id" 
-
             items_query += f" {order_by_clause} LIMIT ? OFFSET ?"
             
             items_raw = conn.execute(items_query, params + [PER_PAGE, offset]).fetchall()
             
-            # 5. 處理項目詳細信息 (分類和詞性)
-            items = []
-            for item_row in items_raw:
-                item_dict = dict(item_row)
-                item_id = item_dict['id']
-                
+            # 5. 每一列的 HTML 依 (項目 ID, 連結參數) 快取；只有未命中的項目才查詢分類等詳細資訊
+            row_context = dict(data_type=data_type, current_page=page, current_category=category,
+                               search_term=search_term, sort_by=sort_by, sort_order=sort_order,
+                               pos_filter=pos_filter, kanji_filter=kanji_filter)
+            context_key = tuple(row_context.values())
+            items = [dict(item_row) for item_row in items_raw]
+            row_keys = [('row', data_type, item['id'], context_key) for item in items]
+            item_rows = [fragment_cache.get(key) for key in row_keys]
+            missing = [item for item, html in zip(items, item_rows) if html is None]
+            
+            for item_dict in missing:
+                # 只解壓縮實際要渲染的列
+                text_codec.unpack_item(conn, item_dict)
                 # 獲取分類字串
-                item_dict['categories'] = get_item_categories_string(item_id, data_type)
+                item_dict['categories'] = get_item_categories_string(item_dict['id'], data_type)
                 
                 if data_type == 'vocab':
-                    # 獲取詞性字串
-                    item_dict['pos_string'] = get_item_pos_string(item_id)
-                    
-                items.append(item_dict)
+                    # 詞性字串直接取自 pos_sort_key
+                    item_dict['pos_string'] = item_dict.get('pos_sort_key') or ''
+            
+            # 5-1. 文法句型命中的例句數 (grammar_match_table 主鍵範圍計數)
+            if data_type == 'grammar' and missing:
+                match_counts = get_grammar_match_counts([item['id'] for item in missing], conn)
+                for item in missing:
+                    item['match_count'] = match_counts.get(item['id'], 0)
+            
+            for i, item in enumerate(items):
+                if item_rows[i] is None:
+                    item_rows[i] = fragment_cache.put(row_keys[i], render_fragment('_list_row.html', item=item, **row_context), generation)
 
             # 6. 創建模擬的分頁物件
             pagination = PaginationMock(page=page, pages=total_pages)
@@ -987,24 +1518,119 @@ def list_page(data_type):
     finally:
         conn.close()
 
-    # 7. 渲染模板
+    # 7. 篩選下拉選單與批次操作選單 (分類有變動時才淘汰，命中時不需查詢分類列表)
+    filter_html = fragment_cache.get_or_render(
+        ('filters', data_type, category, pos_filter),
+        lambda: render_fragment('_list_filters.html', data_type=data_type, current_category=category,
+                                pos_filter=pos_filter, all_categories=get_all_categories(), pos_list=MASTER_POS_TUPLES),
+        generation
+    )
+    bulk_options_html = fragment_cache.get_or_render(
+        ('bulk_options', data_type),
+        lambda: render_fragment('_bulk_options.html', data_type=data_type,
+                                all_categories=get_all_categories(), pos_list=MASTER_POS_TUPLES),
+        generation
+    )
+
+    # 8. 渲染模板
     return render_template('list_template.html', 
         data_type=data_type,
         items=items,
+        item_rows=item_rows,
+        filter_html=filter_html,
+        bulk_options_html=bulk_options_html,
         pagination=pagination,       
         current_page=page,           
         total_pages=total_pages,     
         total_items=total_items,     
         current_category=category,
         search_term=search_term,
+        is_fuzzy=bool(fuzzy_ranking),
         sort_by=sort_by,
         sort_order=sort_order,
         per_page=PER_PAGE,
-        all_categories=get_all_categories(), 
         pos_filter=pos_filter,              
-        pos_list=MASTER_POS_TUPLES           
+        kanji_filter=kanji_filter
     )
 
+# ----------------- 容錯搜尋 -----------------
+@app.route('/api/fuzzy_search', methods=['GET'])
+def api_fuzzy_search():
+    """API 路由：trigram 容錯搜尋 (支援羅馬拼音)，依相似度排序。"""
+    data_type = request.args.get('data_type', 'vocab')
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), item_index.TRIGRAM_CANDIDATE_LIMIT)
+    if data_type not in ['vocab', 'grammar']:
+        return jsonify({'success': False, 'message': '無效的資料類型'}), 400
+    
+    conn = get_read_connection()
+    try:
+        ranking = item_index.fuzzy_search(conn, data_type, query, limit=limit)
+        if not ranking:
+            return jsonify({'success': True, 'items': []})
+        table_name = get_table_name(data_type)
+        placeholders = ",".join("?" * len(ranking))
+        rows = conn.execute(f'''
+            SELECT T1.id, T1.term, R.reading_kana, R.romaji FROM {table_name} AS T1
+            LEFT JOIN term_reading_table AS R ON R.item_type = ? AND R.item_id = T1.id
+            WHERE T1.id IN ({placeholders})
+        ''', [data_type] + [item_id for item_id, _ in ranking]).fetchall()
+        by_id = {row['id']: dict(row) for row in rows}
+        items = []
+        for item_id, score in ranking:
+            if item_id in by_id:
+                by_id[item_id]['similarity'] = score
+                items.append(by_id[item_id])
+        return jsonify({'success': True, 'items': items})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+    finally:
+        conn.close()
+
+# ----------------- 自動完成 -----------------
+def sync_suggest_index():
+    """確保前綴索引已建立 (WSGI 部署時不會執行 __main__ 區塊)，並套用上次同步之後的變更日誌。"""
+    conn = get_read_connection()
+    try:
+        changes = suggest_feed.poll(conn) if suggest_index.ready else None
+        if changes is None:
+            # 先記下日誌版本再建立：建立期間的寫入會在下次同步時重新套用 (更新是冪等的)
+            suggest_feed.reset(conn)
+            suggest_index.build(conn)
+            return
+        latest = {}
+        for entity, entity_id, deleted in changes:
+            if entity in change_log.ITEM_ENTITIES:
+                latest[(entity, entity_id)] = deleted
+        for item_type in change_log.ITEM_ENTITIES:
+            ids = [item_id for (entity, item_id), deleted in latest.items() if entity == item_type and not deleted]
+            terms = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                terms.update(conn.execute(f'SELECT id, term FROM {get_table_name(item_type)} WHERE id IN ({placeholders})', chunk).fetchall())
+            for (entity, item_id), deleted in latest.items():
+                if entity != item_type:
+                    continue
+                if item_id in terms:
+                    suggest_index.update(item_type, item_id, terms[item_id])
+                else:
+                    suggest_index.remove(item_type, item_id)
+    finally:
+        conn.close()
+
+@app.route('/api/suggest', methods=['GET'])
+def api_suggest():
+    """API 路由：依表記或讀音前綴提供自動完成建議。"""
+    query = request.args.get('q', '')
+    data_type = request.args.get('data_type', 'all')
+    limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int), 50)
+    if data_type not in ['all', 'vocab', 'grammar']:
+        return jsonify({'success': False, 'message': '無效的資料類型'}), 400
+    
+    sync_suggest_index()
+    return jsonify({'success': True, 'items': suggest_index.suggest(query, data_type, limit)})
+
 # ----------------- 單字卡功能 -----------------
 
 @app.route('/flashcard/select')
@@ -1026,10 +1652,30 @@ def flashcard_data():
     data_type = data.get('data_type', 'all')
     category_filter = data.get('category_filter', 'all')
     pos_filter = data.get('pos_filter', 'all')
+    start_mode = data.get('start_mode')
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # SRS 模式：只計算已到期的卡片
+    if start_mode == 'srs':
+        if data_type not in ['all', 'vocab', 'grammar']:
+            conn.close()
+            return jsonify({'success': False, 'message': '無效的資料類型選擇'}), 400
+        try:
+            write_queue.run(srs.seed_card_states, data_type)
+            due_count = srs.count_due_cards(conn, data_type, category_filter, pos_filter)
+        except sqlite3.Error as e:
+            conn.rollback()
+            return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+        finally:
+            conn.close()
+        
+        session['last_flashcard_filters'] = data
+        session['flashcard_total_count'] = due_count
+        session['last_flashcard_index'] = 0
+        return jsonify({'success': True, 'count': due_count, 'last_index': 0})
+    
     total_count = 0
     count_jobs = [] 
 
@@ -1076,6 +1722,46 @@ def flashcard_data():
         'last_index': last_index 
     })
     
+def sync_derived_table(module):
+    """
+    依變更日誌更新持久化的衍生表 (stats_cube，需提供 is_stale 與 sync)：
+    先以唯讀連線檢查，有尚未套用的變更時才排入寫入佇列。
+    """
+    conn = get_read_connection()
+    try:
+        stale = module.is_stale(conn)
+    finally:
+        conn.close()
+    if stale:
+        write_queue.run(module.sync)
+
+def attach_quiz_choices(cards, conn, choice_count=QUIZ_CHOICES):
+    """選擇題模式：從計算出的候選中隨機抽取干擾選項，為每張卡片加上 choices (說明，已打亂) 與 answer_index。"""
+    picked = {}
+    explanations = {}
+    for item_type in change_log.ITEM_ENTITIES:
+        item_ids = [card['id'] for card in cards if card['type'] == item_type]
+        if not item_ids:
+            continue
+        ranked = distractors.get_distractors(conn, item_type, item_ids)
+        wanted = set()
+        for item_id in item_ids:
+            candidates = ranked.get(item_id, [])
+            picked[(item_type, item_id)] = random.sample(candidates, min(choice_count - 1, len(candidates)))
+            wanted.update(picked[(item_type, item_id)])
+        table_name = get_table_name(item_type)
+        for chunk in item_index._chunks(wanted):
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(f'SELECT id, explanation FROM {table_name} WHERE id IN ({placeholders})', chunk):
+                explanations[(item_type, row[0])] = text_codec.unpack(conn, row[1])
+    for card in cards:
+        choices = [explanations[(card['type'], distractor_id)] for distractor_id in picked.get((card['type'], card['id']), [])
+                   if (card['type'], distractor_id) in explanations]
+        answer_index = random.randint(0, len(choices))
+        choices.insert(answer_index, card['explanation'])
+        card['choices'] = choices
+        card['answer_index'] = answer_index
+
 @app.route('/api/get_flashcard/<int:index>', methods=['GET'])
 def api_get_flashcard(index):
     """根據 Session 中的篩選條件和指定索引獲取一整個批次卡片。"""
@@ -1094,7 +1780,7 @@ def api_get_flashcard(index):
     category_filter = filters.get('category_filter', 'all')
     pos_filter = filters.get('pos_filter', 'all')
 
-    conn = get_db_connection()
+    conn = get_read_connection()
     conn.row_factory = sqlite3.Row 
     cursor = conn.cursor()
     
@@ -1132,12 +1818,14 @@ def api_get_flashcard(index):
         # 4. 手動將詞性資訊附加回單字卡數據中
         cards = []
         for row in card_data_list:
-            card_dict = dict(row)
+            card_dict = text_codec.unpack_item(conn, dict(row))
             if card_dict['type'] == 'vocab':
                 card_dict['part_of_speech'] = get_item_pos_string(card_dict['id']) # NEW
             else:
                 card_dict['part_of_speech'] = ''
             cards.append(card_dict)
+        if start_mode == 'quiz':
+            attach_quiz_choices(cards, conn)
             
         conn.close()
         if start_mode == 'random':
@@ -1184,6 +1872,55 @@ def update_flashcard_index():
         session['last_flashcard_index'] = total_count - 1 
         return jsonify({'success': True, 'new_index': total_count - 1, 'wrapped': True})
             
+# ----------------- 間隔重複 (SRS) -----------------
+@app.route('/api/srs/due', methods=['GET'])
+def api_srs_due():
+    """依 Session 篩選條件取得下一批到期卡片 (keyset 游標分頁)。"""
+    filters = session.get('last_flashcard_filters')
+    if not filters:
+        return jsonify({'success': False, 'message': '篩選條件無效'}), 400
+    
+    cursor = None
+    after_due = request.args.get('after_due', type=int)
+    after_type = request.args.get('after_type')
+    after_id = request.args.get('after_id', type=int)
+    if after_due is not None and after_type in srs.ITEM_TYPES and after_id is not None:
+        cursor = (after_due, after_type, after_id)
+    
+    conn = get_read_connection()
+    try:
+        cards = srs.get_due_cards(conn,
+                                  filters.get('data_type', 'all'),
+                                  filters.get('category_filter', 'all'),
+                                  filters.get('pos_filter', 'all'),
+                                  BATCH_SIZE, cursor)
+        for card in cards:
+            text_codec.unpack_item(conn, card)
+            if card['type'] == 'vocab':
+                card['part_of_speech'] = get_item_pos_string(card['id'])
+            else:
+                card['part_of_speech'] = ''
+        return jsonify({'success': True, 'cards': cards})
+    except sqlite3.Error as e:
+        print(f"!!! API ERROR: 資料庫查詢錯誤: {e}")
+        return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/srs/grade', methods=['POST'])
+def api_srs_grade():
+    """批次接收評分，於單一交易內寫入排程狀態與複習紀錄。"""
+    data = request.get_json(silent=True) or {}
+    grades = data.get('grades')
+    if not isinstance(grades, list) or not grades:
+        return jsonify({'success': False, 'message': 'Missing grades in request body'}), 400
+    
+    try:
+        saved = write_queue.run(srs.apply_grades, grades)
+        return jsonify({'success': True, 'saved': saved})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫錯誤: {e}'}), 500
+
 @app.route('/flashcard/deck')
 def flashcard_deck():
     """API 單字卡顯示區"""
@@ -1195,7 +1932,8 @@ def flashcard_deck():
 
     current_index = 0
     session['last_flashcard_index'] = 0
-    session['start_mode'] = request.args.get('start_mode')
+    start_mode = request.args.get('start_mode')
+    session['start_mode'] = start_mode
     
     if total_count > 0:
         if current_index >= total_count: 
@@ -1220,15 +1958,277 @@ def flashcard_deck():
         else:
             parts.append(f"分類: {category_filter}")
         
+    if start_mode == 'srs':
+        parts.append("模式: 間隔重複 (到期卡片)")
+    elif start_mode == 'quiz':
+        parts.append("模式: 選擇題")
+        
     summary_text = " | ".join(parts)
     
     return render_template('flashcard_deck.html', 
                            current_index=current_index, 
                            total_count=total_count, 
-                           filter_summary=summary_text)
+                           filter_summary=summary_text,
+                           start_mode=start_mode)
       
+# ----------------- 統計 -----------------
+def load_stats():
+    """套用尚未處理的變更後讀取彙總表 (只讀取分類數 × 詞性數的格子，與項目數無關)。"""
+    import stats_cube
+    sync_derived_table(stats_cube)
+    conn = get_read_connection()
+    try:
+        return stats_cube.load_cube(conn)
+    finally:
+        conn.close()
+
+@app.route('/stats', methods=['GET'])
+def stats_page():
+    """統計儀表板：各類型依分類 × 詞性的項目數，每一格都連到對應篩選條件的列表頁。"""
+    import stats_cube
+    cube = load_stats()
+    pos_columns = {}
+    for item_type, stats in cube.items():
+        # 依詞性主表順序排列有項目的詞性，無詞性放在最後
+        pos_columns[item_type] = [pos for pos in MASTER_POS_LIST if pos in stats['pos']]
+        if stats_cube.NO_POS in stats['pos']:
+            pos_columns[item_type].append(stats_cube.NO_POS)
+    return render_template('stats.html', cube=cube, pos_columns=pos_columns,
+                           uncategorized=stats_cube.UNCATEGORIZED, no_pos=stats_cube.NO_POS)
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    """API 路由：分類 × 詞性的項目數 (無分類為 __uncategorized__、無詞性為 __no_pos__，與列表頁的篩選值相同)。"""
+    try:
+        cube = load_stats()
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+    return jsonify({'success': True, 'types': cube})
+
+# ----------------- 近似重複 -----------------
+def _parse_dedup_threshold():
+    import dedup
+    threshold = request.args.get('threshold', dedup.DEDUP_THRESHOLD, type=float)
+    return min(max(threshold, 0.3), 1.0)
+
+def get_duplicate_clusters(threshold, conn, limit=DUPLICATES_PAGE_LIMIT):
+    """返回 (群組總數, 前 limit 組的詳細資料)；每組的 members 帶表記、說明、分類與詞性。"""
+    clusters = duplicate_finder.clusters(conn, change_log.current_version(conn), threshold)
+    shown = clusters[:limit]
+    payloads = change_log.load_payloads(conn, [(c['type'], item_id, False) for c in shown for item_id in c['ids']])
+    details = {(p['type'], p['id']): p for p in payloads if p['op'] == 'upsert'}
+    result = []
+    for cluster in shown:
+        members = [details[(cluster['type'], item_id)] for item_id in cluster['ids'] if (cluster['type'], item_id) in details]
+        if len(members) > 1:
+            result.append({'type': cluster['type'], 'similarity': cluster['similarity'], 'members': members})
+    return len(clusters), result
+
+@app.route('/duplicates', methods=['GET'])
+def duplicates_page():
+    """近似重複檢查頁：列出相似的單字/文法群組，選擇保留的項目後一鍵合併。"""
+    threshold = _parse_dedup_threshold()
+    conn = get_read_connection()
+    try:
+        total, clusters = get_duplicate_clusters(threshold, conn)
+    finally:
+        conn.close()
+    return render_template('duplicates.html', clusters=clusters, total=total, threshold=threshold)
+
+@app.route('/api/duplicates', methods=['GET'])
+def api_duplicates():
+    """API 路由：近似重複的群組 (JSON)。"""
+    threshold = _parse_dedup_threshold()
+    limit = max(1, min(request.args.get('limit', DUPLICATES_PAGE_LIMIT, type=int), 1000))
+    conn = get_read_connection()
+    try:
+        total, clusters = get_duplicate_clusters(threshold, conn, limit)
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'threshold': threshold, 'total': total, 'clusters': clusters})
+
+@app.route('/api/duplicates/merge', methods=['POST'])
+def api_merge_duplicates():
+    """
+    API 路由：合併近似重複的項目。被合併項目的分類、詞性連結與複習紀錄併入保留的項目 (取聯集)，
+    之後刪除被合併的項目；保留項目本身的內容不變。
+    """
+    import dedup
+    data = request.get_json(silent=True) or {}
+    data_type = data.get('data_type')
+    if data_type not in ['vocab', 'grammar']:
+        return jsonify({'success': False, 'message': '無效的資料類型'}), 400
+    try:
+        keep_id = int(data.get('keep_id'))
+        merge_ids = sorted({int(item_id) for item_id in data.get('merge_ids') or []} - {keep_id})
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': '無效的項目 ID'}), 400
+    if not merge_ids:
+        return jsonify({'success': False, 'message': '請選擇要合併的項目'}), 400
+
+    table_name = get_table_name(data_type)
+
+    def merge_job(conn):
+        """返回實際刪除的筆數；保留的項目不存在時返回 None。"""
+        cursor = conn.cursor()
+        if not cursor.execute(f'SELECT 1 FROM {table_name} WHERE id = ?', (keep_id,)).fetchone():
+            return None
+        placeholders = ",".join("?" * len(merge_ids))
+        existing = [row[0] for row in cursor.execute(f'SELECT id FROM {table_name} WHERE id IN ({placeholders})', merge_ids)]
+        if not existing:
+            return 0
+        dedup.merge_links(conn, data_type, keep_id, existing)
+        placeholders = ",".join("?" * len(existing))
+        cursor.execute(f'DELETE FROM item_category_table WHERE item_type = ? AND item_id IN ({placeholders})', [data_type] + existing)
+        if data_type == 'vocab':
+            cursor.execute(f'DELETE FROM item_pos_table WHERE item_id IN ({placeholders})', existing)
+        delete_item_indexes(existing, data_type, conn)
+        cursor.execute(f'DELETE FROM {table_name} WHERE id IN ({placeholders})', existing)
+        return cursor.rowcount
+
+    try:
+        merged = write_queue.run(merge_job)
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'合併失敗: {e}'}), 500
+    if merged is None:
+        return jsonify({'success': False, 'message': '找不到要保留的項目'}), 404
+    return jsonify({'success': True, 'keep_id': keep_id, 'merged': merged})
+
+# ----------------- 差異同步 -----------------
+@app.route('/api/changes', methods=['GET'])
+def api_changes():
+    """
+    API 路由：多裝置差異同步。since 為用戶端上次取得的 version，返回之後的變更 (同一項目只保留最後狀態)。
+    首次同步或日誌已被清除時返回 reset：用戶端先記下 version 再完整載入，之後從該 version 開始同步
+    (upsert 帶完整資料，重複套用不影響結果)。has_more 為 true 時以返回的 version 繼續取得下一批。
+    """
+    since = request.args.get('since', type=int)
+    limit = max(1, min(request.args.get('limit', change_log.CHANGE_LOG_PAGE_SIZE, type=int), change_log.CHANGE_LOG_PAGE_SIZE))
+    conn = get_read_connection()
+    try:
+        if since is None or not change_log.can_resume(conn, since):
+            return jsonify({'success': True, 'reset': True, 'version': change_log.current_version(conn),
+                            'has_more': False, 'changes': []})
+        changes, version, has_more = change_log.read_changes(conn, since, limit)
+        return jsonify({'success': True, 'reset': False, 'version': version,
+                        'has_more': has_more, 'changes': change_log.load_payloads(conn, changes)})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫查詢錯誤: {e}'}), 500
+    finally:
+        conn.close()
+
+# ----------------- 多使用者分片 -----------------
+@app.before_request
+def select_learner_store():
+    """多使用者模式：依反向代理驗證後的使用者名稱取得該學習者的分片 (需要時建立並執行遷移)。"""
+    if not MULTI_LEARNER_ENABLED or request.endpoint in LEARNER_EXEMPT_ENDPOINTS:
+        return None
+    learner_id = request.headers.get(LEARNER_HEADER) or request.environ.get('REMOTE_USER')
+    if not learner_shards.is_valid_learner_id(learner_id):
+        return jsonify({'success': False, 'message': '未驗證的使用者或無效的使用者名稱'}), 401
+    g.learner_store = learner_pool.acquire(learner_id)
+    return None
+
+@app.teardown_request
+def release_learner_store(exc):
+    store = g.pop('learner_store', None)
+    if store is not None:
+        learner_pool.release(store)
+
+@app.route('/api/learners/status', methods=['GET'])
+def api_learners_status():
+    """API：目前開啟中的學習者分片 (與使用中的請求數)"""
+    return jsonify({'success': True, 'enabled': MULTI_LEARNER_ENABLED, **learner_pool.status()})
+
+# ----------------- 資料庫維護 -----------------
+def get_maintenance_scheduler():
+    """背景維護排程 (第一次使用時才載入 maintenance 模組)。"""
+    global _maintenance_scheduler
+    with _maintenance_lock:
+        if _maintenance_scheduler is None:
+            import maintenance
+            _maintenance_scheduler = maintenance.MaintenanceScheduler(DB_NAME)
+        return _maintenance_scheduler
+
+@app.before_request
+def note_request_activity():
+    """記錄最後一次請求的時間，背景維護只在閒置時執行 (尚未建立排程時不需要記錄)。"""
+    if _maintenance_scheduler is not None:
+        _maintenance_scheduler.note_activity()
+
+@app.route('/api/maintenance/status', methods=['GET'])
+def api_maintenance_status():
+    """API：資料庫空頁數量、auto_vacuum 模式與各項維護工作的最後執行時間"""
+    try:
+        status = get_maintenance_scheduler().status()
+        if READ_REPLICA_ENABLED:
+            status['read_replica'] = read_pool.status()
+        return jsonify({'success': True, **status})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'資料庫錯誤: {e}'}), 500
+
 # ----------------- 啟動應用程式 -----------------
+_background_started = False
+_background_lock = threading.Lock()
+
+@app.before_request
+def ensure_request_schema():
+    """直接以 app:app 部署 (未呼叫 create_app) 時，第一個請求前檢查結構版本；之後只是一次集合查詢。"""
+    ensure_schema()
+
+def create_app(start_background=True, warm_caches=False):
+    """
+    WSGI 進入點 (例如 gunicorn 'app:create_app()')：檢查結構版本並啟動背景備份與維護，重複呼叫不會重複啟動。
+    自動完成索引與記憶體唯讀副本預設在第一次使用時才建立，worker 不必等待即可開始服務。
+    """
+    global _background_started
+    ensure_schema(DB_NAME)
+    if warm_caches:
+        sync_suggest_index()
+        if READ_REPLICA_ENABLED:
+            read_pool.refresh()
+    with _background_lock:
+        if start_background and not _background_started:
+            if BACKUP_INTERVAL_HOURS:
+                import backup
+                backup.BackupScheduler(BACKUP_INTERVAL_HOURS * 3600, DB_NAME).start()
+            get_maintenance_scheduler().start()
+            _background_started = True
+    return app
+
+def profile_startup():
+    """--profile-startup：報告 import 與啟動各階段的耗時後結束 (不啟動伺服器與背景工作)。"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    import_total, import_children = startup.import_costs('app', cwd=app_dir)
+    profiler = startup.StartupProfiler()
+    migrated = schema_gate.migrated
+    with profiler.phase('結構檢查 (第一次)'):
+        ensure_schema(DB_NAME)
+    if schema_gate.migrated > migrated:
+        print(f"🔧 結構版本過舊，已執行 init_db (目前版本 {SCHEMA_VERSION})")
+    with profiler.phase('結構檢查 (已快取)'):
+        ensure_schema(DB_NAME)
+    with profiler.phase('讀取 user_version'):
+        startup.read_user_version(DB_NAME)
+    with profiler.phase('create_app()'):
+        create_app(start_background=False)
+    with profiler.phase('自動完成索引 (第一次使用時)'):
+        sync_suggest_index()
+    if READ_REPLICA_ENABLED:
+        with profiler.phase('記憶體唯讀副本 (第一次使用時)'):
+            read_pool.refresh()
+    write_queue.stop()
+    startup.print_report('app', import_total, import_children, profiler)
+
 if __name__ == '__main__':
-    # 確保資料庫在應用程式啟動時只創建一次
-    init_db() 
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='日語學習筆記本')
+    parser.add_argument('--profile-startup', action='store_true', help='報告 import 與啟動各階段的耗時後結束')
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+    else:
+        # debug 模式的 reloader 會啟動兩個行程，只在實際服務請求的子行程啟動備份與維護執行緒
+        create_app(start_background=os.environ.get('WERKZEUG_RUN_MAIN') == 'true', warm_caches=True)
+        app.run(debug=True)
@@ -0,0 +1,204 @@
+# backup.py
+# 線上備份：以 SQLite backup API 分段複製 (每段只短暫持有讀取鎖，不會長時間擋住 Flask 的寫入)，
+# 壓縮為 .db.gz 快照並依數量輪替；還原前會先檢查快照完整性
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+DB_NAME = 'jp_db.db'
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 14 # 保留最新的快照數量
+BACKUP_STEP_PAGES = 256 # 每段複製的頁數 (4KB 頁面約 1MB)
+BACKUP_STEP_PAUSE = 0.01 # 每段之間讓出的秒數，讓其他連線有機會寫入
+SNAPSHOT_SUFFIX = '.db.gz'
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S-%f' # 含微秒，同一秒內的兩份快照不會互相覆蓋
+
+
+def _snapshot_prefix(db_name):
+    return os.path.splitext(os.path.basename(db_name))[0] + '-'
+
+
+def _check_integrity(conn, quick=False):
+    """返回 None 表示通過，否則返回錯誤訊息。"""
+    pragma = 'quick_check' if quick else 'integrity_check'
+    result = [row[0] for row in conn.execute(f'PRAGMA {pragma}')]
+    return None if result == ['ok'] else '; '.join(result[:5])
+
+
+def _copy_database(source_conn, target_conn):
+    """以 backup API 分段複製；每段之間暫停，來源被其他連線修改時 SQLite 會自動重新開始。"""
+    source_conn.backup(
+        target_conn, pages=BACKUP_STEP_PAGES,
+        progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_PAUSE)
+    )
+
+
+def create_backup(db_name=DB_NAME, backup_dir=BACKUP_DIR, compress=True):
+    """建立一份快照並返回檔案路徑。先複製到暫存檔並檢查，通過後才以完整檔名出現在備份目錄。"""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = _snapshot_prefix(db_name) + datetime.now().strftime(TIMESTAMP_FORMAT)
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=backup_dir)
+    os.close(fd)
+    try:
+        source = sqlite3.connect(db_name)
+        target = sqlite3.connect(tmp_path)
+        try:
+            _copy_database(source, target)
+            error = _check_integrity(target, quick=True)
+        finally:
+            target.close()
+            source.close()
+        if error:
+            raise sqlite3.DatabaseError(f'備份檢查失敗: {error}')
+
+        if compress:
+            final_path = os.path.join(backup_dir, name + SNAPSHOT_SUFFIX)
+            with open(tmp_path, 'rb') as src, gzip.open(final_path + '.part', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(final_path + '.part', final_path)
+        else:
+            final_path = os.path.join(backup_dir, name + '.db')
+            os.replace(tmp_path, final_path)
+        return final_path
+    finally:
+        for leftover in (tmp_path, os.path.join(backup_dir, name + SNAPSHOT_SUFFIX + '.part')):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def list_backups(db_name=DB_NAME, backup_dir=BACKUP_DIR):
+    """返回此資料庫的快照路徑 (由舊到新；檔名含時間戳記，可直接排序)。"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _snapshot_prefix(db_name)
+    return sorted(
+        os.path.join(backup_dir, f) for f in os.listdir(backup_dir)
+        if f.startswith(prefix) and (f.endswith(SNAPSHOT_SUFFIX) or f.endswith('.db'))
+    )
+
+
+def rotate_backups(db_name=DB_NAME, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """只保留最新的 keep 份快照，返回被刪除的路徑。"""
+    snapshots = list_backups(db_name, backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def restore_backup(snapshot_path, db_name=DB_NAME, backup_dir=BACKUP_DIR):
+    """
+    從快照還原：解壓到暫存檔並執行完整的 integrity_check，通過後先替目前的資料庫建立一份快照，
+    再以 backup API 寫回 (經由 SQLite 的鎖定機制，執行中的應用程式不會讀到半套資料)。
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(db_name)))
+    os.close(fd)
+    try:
+        opener = gzip.open if snapshot_path.endswith('.gz') else open
+        with opener(snapshot_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        snapshot = sqlite3.connect(tmp_path)
+        try:
+            try:
+                error = _check_integrity(snapshot)
+            except sqlite3.DatabaseError as e: # 不是 SQLite 檔案
+                error = str(e)
+            if error:
+                raise sqlite3.DatabaseError(f'快照完整性檢查失敗，未還原: {error}')
+            safety_copy = create_backup(db_name, backup_dir) if os.path.exists(db_name) else None
+            live = sqlite3.connect(db_name, timeout=30)
+            try:
+                snapshot.backup(live) # 一次寫完，避免其他連線看到混合的內容
+            finally:
+                live.close()
+        finally:
+            snapshot.close()
+        return safety_copy
+    except (OSError, EOFError) as e:
+        raise sqlite3.DatabaseError(f'無法讀取快照 {snapshot_path}: {e}') from e
+    finally:
+        os.remove(tmp_path)
+
+
+class BackupScheduler:
+    """背景執行緒：每隔 interval 秒建立一次快照並輪替。"""
+
+    def __init__(self, interval, db_name=DB_NAME, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        self.interval = interval
+        self.db_name = db_name
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.last_backup = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_backup = create_backup(self.db_name, self.backup_dir)
+                rotate_backups(self.db_name, self.backup_dir, self.keep)
+                self.last_error = None
+            except (sqlite3.Error, OSError) as e:
+                self.last_error = str(e)
+                print(f"❌ 自動備份失敗: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='線上備份 / 還原 jp_db.db')
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='建立快照並輪替')
+    create_parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    create_parser.add_argument('--no-compress', action='store_true')
+    subparsers.add_parser('list', help='列出快照')
+    restore_parser = subparsers.add_parser('restore', help='從快照還原 (會先備份目前的資料庫)')
+    restore_parser.add_argument('snapshot', nargs='?', help='快照路徑 (預設為最新一份)')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'create':
+            start = time.time()
+            path = create_backup(args.db, args.dir, compress=not args.no_compress)
+            removed = rotate_backups(args.db, args.dir, args.keep)
+            print(f"✅ 已建立快照 {path} ({os.path.getsize(path) / 1024:.0f} KB，耗時 {time.time() - start:.2f} 秒)"
+                  + (f"，刪除 {len(removed)} 份舊快照" if removed else ""))
+        elif args.command == 'list':
+            for path in list_backups(args.db, args.dir):
+                print(f"{path}\t{os.path.getsize(path) / 1024:.0f} KB")
+        else:
+            snapshots = list_backups(args.db, args.dir)
+            snapshot = args.snapshot or (snapshots[-1] if snapshots else None)
+            if not snapshot:
+                print("❌ 找不到任何快照")
+                return 1
+            safety_copy = restore_backup(snapshot, args.db, args.dir)
+            print(f"✅ 已從 {snapshot} 還原" + (f" (還原前的資料已備份至 {safety_copy})" if safety_copy else ""))
+    except sqlite3.Error as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# change_log.py
+# 變更日誌：由觸發器在同一個交易中寫入 change_log_table (version 單調遞增)，
+# 多裝置用戶端以 /api/changes?since=<version> 取得壓縮後的差異；行程內快取也依此增量更新，不必整個失效
+import threading
+import time
+
+import text_codec
+
+CHANGE_LOG_PAGE_SIZE = 500 # /api/changes 每次最多讀取的日誌筆數
+CHANGE_LOG_RETENTION_DAYS = 90 # 日誌保留天數 (較舊的由背景維護清除，落後太多的用戶端需重新完整同步)
+ITEM_ENTITIES = ('vocab', 'grammar')
+CARD_ENTITIES = {'vocab_card': 'vocab', 'grammar_card': 'grammar'} # 卡片排程狀態 -> 項目類型
+
+_TRIGGERS = '''
+CREATE TRIGGER IF NOT EXISTS trg_vocab_log_insert AFTER INSERT ON vocab_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('vocab', NEW.id, 'I');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_vocab_log_update AFTER UPDATE OF term, explanation, example_sentence ON vocab_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('vocab', NEW.id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_vocab_log_delete AFTER DELETE ON vocab_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('vocab', OLD.id, 'D');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_grammar_log_insert AFTER INSERT ON grammar_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('grammar', NEW.id, 'I');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_grammar_log_update AFTER UPDATE OF term, explanation, example_sentence ON grammar_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('grammar', NEW.id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_grammar_log_delete AFTER DELETE ON grammar_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('grammar', OLD.id, 'D');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_category_log_insert AFTER INSERT ON category_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('category', NEW.id, 'I');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_category_log_update AFTER UPDATE OF name ON category_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('category', NEW.id, 'U');
+    INSERT INTO change_log_table (entity, entity_id, op)
+        SELECT item_type, item_id, 'U' FROM item_category_table WHERE category_id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_category_log_delete AFTER DELETE ON category_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('category', OLD.id, 'D');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_item_category_log_insert AFTER INSERT ON item_category_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES (NEW.item_type, NEW.item_id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_item_category_log_delete AFTER DELETE ON item_category_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES (OLD.item_type, OLD.item_id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_item_pos_log_insert AFTER INSERT ON item_pos_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('vocab', NEW.item_id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_item_pos_log_delete AFTER DELETE ON item_pos_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES ('vocab', OLD.item_id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_card_state_log_insert AFTER INSERT ON card_state_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES (NEW.item_type || '_card', NEW.item_id, 'I');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_card_state_log_update AFTER UPDATE ON card_state_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES (NEW.item_type || '_card', NEW.item_id, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_card_state_log_delete AFTER DELETE ON card_state_table BEGIN
+    INSERT INTO change_log_table (entity, entity_id, op) VALUES (OLD.item_type || '_card', OLD.item_id, 'D');
+END;
+'''
+
+
+def create_change_log(conn):
+    """建立 change_log_table 與各資料表的觸發器 (皆為 IF NOT EXISTS，可重複執行)。返回日誌表是否為新建立。"""
+    is_new = not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log_table'").fetchone()
+    # AUTOINCREMENT：清除舊日誌後 version 也不會重複使用，用戶端的 since 永遠有效
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_table (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''')
+    # executescript 會先 commit，改為逐句執行，維持在呼叫端的交易裡
+    for statement in _TRIGGERS.split('END;'):
+        if statement.strip():
+            conn.execute(statement + 'END;')
+    return is_new
+
+
+def current_version(conn):
+    """最新的日誌版本 (尚無任何變更時為 0)。"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log_table'").fetchone()
+    return row[0] if row else 0
+
+
+def oldest_version(conn):
+    row = conn.execute('SELECT MIN(version) FROM change_log_table').fetchone()
+    return row[0]
+
+
+def can_resume(conn, since):
+    """since 之後的日誌是否仍完整保留 (未被清除)；否則用戶端/快取需重新完整同步。"""
+    current = current_version(conn)
+    if since > current: # 資料庫已從備份還原等，用戶端的版本比伺服器新
+        return False
+    oldest = oldest_version(conn)
+    if oldest is None:
+        return since == current
+    return since >= oldest - 1
+
+
+def has_changes(conn, since, entities):
+    """since 之後是否有指定實體的變更 (只掃描 since 之後的日誌，例如忽略卡片排程狀態的寫入)。"""
+    placeholders = ",".join("?" * len(entities))
+    return conn.execute(f'''
+        SELECT 1 FROM change_log_table WHERE version > ? AND entity IN ({placeholders}) LIMIT 1
+    ''', [since] + list(entities)).fetchone() is not None
+
+
+def read_changes(conn, since, limit=CHANGE_LOG_PAGE_SIZE):
+    """
+    讀取 version > since 的日誌並壓縮：同一個 (entity, entity_id) 只保留最後一次的操作。
+    返回 (changes, last_version, has_more)；changes 依最後變更的版本排序，每筆為 (entity, entity_id, deleted)。
+    """
+    rows = conn.execute('''
+        SELECT version, entity, entity_id, op FROM change_log_table
+        WHERE version > ? ORDER BY version LIMIT ?
+    ''', (since, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for version, entity, entity_id, op in rows:
+        latest.pop((entity, entity_id), None) # 重新插入，維持依最後版本排序
+        latest[(entity, entity_id)] = op == 'D'
+    changes = [(entity, entity_id, deleted) for (entity, entity_id), deleted in latest.items()]
+    return changes, (rows[-1][0] if rows else since), has_more
+
+
+def _rows_by_id(conn, query, ids, extra_params=()):
+    result = {}
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(query.format(placeholders=placeholders), list(extra_params) + chunk):
+            result.setdefault(row[0], []).append(row)
+    return result
+
+
+def load_payloads(conn, changes):
+    """
+    將壓縮後的變更轉為用戶端可直接套用的差異：upsert 帶目前的完整資料，delete 只帶 ID。
+    讀取時資料列已不存在 (之後又被刪除) 的項目一律視為 delete。
+    """
+    wanted = {}
+    for entity, entity_id, deleted in changes:
+        if not deleted:
+            wanted.setdefault(entity, set()).add(entity_id)
+
+    payloads = {}
+    for item_type in ITEM_ENTITIES:
+        ids = wanted.get(item_type)
+        if not ids:
+            continue
+        table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+        items = _rows_by_id(conn, f'SELECT id, term, explanation, example_sentence FROM {table_name} WHERE id IN ({{placeholders}})', ids)
+        categories = _rows_by_id(conn, '''
+            SELECT IC.item_id, C.name FROM item_category_table AS IC
+            JOIN category_table AS C ON C.id = IC.category_id
+            WHERE IC.item_type = ? AND IC.item_id IN ({placeholders}) ORDER BY C.name
+        ''', ids, (item_type,))
+        pos = _rows_by_id(conn, '''
+            SELECT IP.item_id, P.name FROM item_pos_table AS IP
+            JOIN pos_master_table AS P ON P.id = IP.pos_id
+            WHERE IP.item_id IN ({placeholders}) ORDER BY P.name
+        ''', ids) if item_type == 'vocab' else {}
+        for item_id, (row,) in items.items():
+            payload = {'term': row[1], 'explanation': text_codec.unpack(conn, row[2]), 'example_sentence': row[3],
+                       'categories': [r[1] for r in categories.get(item_id, [])]}
+            if item_type == 'vocab':
+                payload['pos'] = [r[1] for r in pos.get(item_id, [])]
+            payloads[(item_type, item_id)] = payload
+
+    if wanted.get('category'):
+        for category_id, (row,) in _rows_by_id(conn, 'SELECT id, name FROM category_table WHERE id IN ({placeholders})', wanted['category']).items():
+            payloads[('category', category_id)] = {'name': row[1]}
+
+    for entity, item_type in CARD_ENTITIES.items():
+        ids = wanted.get(entity)
+        if not ids:
+            continue
+        cards = _rows_by_id(conn, '''
+            SELECT item_id, due_at, interval_days, ease, reps, lapses, last_review_at
+            FROM card_state_table WHERE item_type = ? AND item_id IN ({placeholders})
+        ''', ids, (item_type,))
+        for item_id, (row,) in cards.items():
+            payloads[(entity, item_id)] = {'due_at': row[1], 'interval_days': row[2], 'ease': row[3],
+                                           'reps': row[4], 'lapses': row[5], 'last_review_at': row[6]}
+
+    result = []
+    for entity, entity_id, deleted in changes:
+        payload = None if deleted else payloads.get((entity, entity_id))
+        change = {'type': entity, 'id': entity_id, 'op': 'delete' if payload is None else 'upsert'}
+        if payload is not None:
+            change.update(payload)
+        result.append(change)
+    return result
+
+
+def prune_change_log(conn, retention_days=CHANGE_LOG_RETENTION_DAYS):
+    """清除超過保留天數的日誌，返回刪除的筆數。"""
+    cutoff = int(time.time()) - retention_days * 86400
+    return conn.execute('DELETE FROM change_log_table WHERE changed_at < ?', (cutoff,)).rowcount
+
+
+class ChangeFeed:
+    """
+    行程內快取的變更游標：記錄已套用到的日誌版本。
+    poll() 返回之後的壓縮變更；日誌已被清除而接不上時返回 None，呼叫端需整個重建快取。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+
+    def reset(self, conn):
+        """重建快取之前呼叫：之後發生的變更 (含重建期間) 都會在下次 poll 時取得。"""
+        with self._lock:
+            self.version = current_version(conn)
+            return self.version
+
+    def poll(self, conn):
+        with self._lock:
+            if self.version is None or not can_resume(conn, self.version):
+                return None
+            changes = []
+            has_more = True
+            while has_more:
+                page, self.version, has_more = read_changes(conn, self.version)
+                changes.extend(page)
+            return changes
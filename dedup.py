@@ -0,0 +1,208 @@
+# dedup.py
+# 近似重複偵測：表記 + 讀音 + 說明正規化後取字元 3-gram，計算 MinHash 簽章 (每個 shingle 只雜湊一次，
+# blake2b 摘要切成 MINHASH_PERMUTATIONS 個 16 位元值，各自當作一個獨立的雜湊函數取最小值)，再以 LSH 分帶分桶，
+# 只比對落在同一桶的項目，不需要 O(n²) 兩兩比較；候選配對再以實際的 shingle 集合計算 Jaccard 相似度確認
+import argparse
+import functools
+import hashlib
+import sqlite3
+import struct
+import sys
+import threading
+
+import item_index
+
+DB_NAME = 'jp_db.db'
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 30 # 簽章長度 (blake2b 摘要最長 64 bytes，最多 32 個 16 位元值)
+LSH_BANDS = 10 # 分帶數 × 每帶列數 = 簽章長度；10 × 3 時相似度 0.6 的配對約九成會落入同一桶，0.3 以下約兩成
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+DEDUP_THRESHOLD = 0.6 # Jaccard 相似度門檻
+DEDUP_MAX_BUCKET = 64 # 超過此大小的桶只與桶內第一個項目比對 (避免大量相同內容造成平方成長)
+DEDUP_SHINGLE_CACHE = 8192 # 確認候選配對時快取的 shingle 集合數 (同一桶的項目會被重複比對)
+_SIGNATURE = struct.Struct(f'>{MINHASH_PERMUTATIONS}H') # 簽章存為 bytes (10 萬筆約 6MB)，分帶直接切片當作桶的 key
+
+
+def _normalize(text):
+    return ' '.join(item_index.to_hiragana(text or '').lower().split())
+
+
+def _char_shingles(text, size=SHINGLE_SIZE):
+    # 前後加上邊界符號，只有一兩個字的表記也有 shingle，且開頭/結尾相同的項目更相近
+    text = f'^{text}$'
+    return {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+
+
+def item_shingles(item_type, term_plain, reading, explanation_plain):
+    """
+    表記與說明 (片假名轉平假名、小寫) 各自取字元 3-gram；讀音只當作一個 shingle，
+    避免短項目中讀音佔大多數，同音異義詞 (公開/航海) 被判為重複。
+    """
+    surface, term_reading = item_index.split_term(term_plain or '', item_type)
+    shingles = {'t' + s for s in _char_shingles(_normalize(surface))}
+    explanation = _normalize(explanation_plain)
+    if explanation:
+        shingles.update('e' + s for s in _char_shingles(explanation))
+    reading = _normalize(reading or term_reading)
+    if reading:
+        shingles.add('r' + reading)
+    return shingles
+
+
+def shingle_hashes(shingles):
+    """每個 shingle 的 MINHASH_PERMUTATIONS 個雜湊值 (tuple)。"""
+    return [_SIGNATURE.unpack(hashlib.blake2b(shingle.encode('utf-8'), digest_size=_SIGNATURE.size).digest())
+            for shingle in shingles]
+
+
+def minhash_signature(hashes):
+    """每個雜湊函數各自取所有 shingle 中的最小值；沒有 shingle 時返回全部為最大值的簽章。"""
+    if not hashes:
+        return b'\xff' * _SIGNATURE.size
+    return _SIGNATURE.pack(*map(min, zip(*hashes)))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _load_items(conn, item_type):
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    return conn.execute(f'''
+        SELECT T.id, T.term_plain, R.reading_kana, T.explanation_plain FROM {table_name} AS T
+        LEFT JOIN term_reading_table AS R ON R.item_type = ? AND R.item_id = T.id
+    ''', (item_type,))
+
+
+def find_duplicate_clusters(signatures, shingles_of, threshold=DEDUP_THRESHOLD):
+    """
+    signatures: {key: 簽章}；shingles_of(key) 返回該項目的 shingle 集合 (只對候選配對計算)。
+    同一桶內的候選配對以實際的 Jaccard 相似度確認後以 union-find 合併；已在同一群組的配對不必再確認，
+    大量彼此相似的項目只需確認約 n 次而非 n² 次。
+    返回 [(key 列表, 群組內確認過的最高相似度)]，只含兩個以上項目的群組。
+    """
+    parent = {}
+    best = {}
+    rejected = set() # 已確認未達門檻的配對 (不同分帶可能再次成為候選)
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for band in range(LSH_BANDS): # 逐帶分桶，同一時間只保留一帶的桶，記憶體用量與項目數成正比
+        start = band * LSH_ROWS * 2 # 每個值 2 bytes
+        end = start + LSH_ROWS * 2
+        buckets = {}
+        for key, signature in signatures.items():
+            buckets.setdefault(signature[start:end], []).append(key)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > DEDUP_MAX_BUCKET:
+                candidates = ((members[0], other) for other in members[1:])
+            else:
+                candidates = ((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+            for a, b in candidates:
+                root_a, root_b = find(a), find(b)
+                pair = (a, b) if a < b else (b, a)
+                if root_a == root_b or pair in rejected:
+                    continue
+                similarity = jaccard(shingles_of(a), shingles_of(b))
+                if similarity < threshold:
+                    rejected.add(pair)
+                    continue
+                root = min(root_a, root_b)
+                parent[max(root_a, root_b)] = root
+                best[root] = max(best.pop(root_a, 0), best.pop(root_b, 0), similarity)
+
+    groups = {}
+    for key in parent:
+        groups.setdefault(find(key), []).append(key)
+    return [(sorted(members), best[root]) for root, members in groups.items() if len(members) > 1]
+
+
+def analyze(conn, item_types=('vocab', 'grammar'), threshold=DEDUP_THRESHOLD):
+    """
+    返回近似重複的群組 (只在同一類型內分群，合併需在同一個資料表中進行)，依群組大小、最小 ID 排序：
+    [{'type', 'ids', 'similarity': 群組內最高的相似度}]
+    """
+    clusters = []
+    for item_type in item_types:
+        signatures = {}
+        rows = {}
+        for item_id, term_plain, reading, explanation_plain in _load_items(conn, item_type):
+            rows[item_id] = (term_plain, reading, explanation_plain) # 只保留原始文字，shingle 集合需要時再計算
+            signatures[item_id] = minhash_signature(shingle_hashes(item_shingles(item_type, *rows[item_id])))
+
+        @functools.lru_cache(maxsize=DEDUP_SHINGLE_CACHE)
+        def shingles_of(item_id):
+            return frozenset(item_shingles(item_type, *rows[item_id]))
+
+        for ids, similarity in find_duplicate_clusters(signatures, shingles_of, threshold):
+            clusters.append({'type': item_type, 'ids': ids, 'similarity': round(similarity, 2)})
+    clusters.sort(key=lambda c: (-len(c['ids']), c['type'], c['ids'][0]))
+    return clusters
+
+
+def merge_links(conn, item_type, keep_id, merge_ids):
+    """將被合併項目的分類、詞性連結與複習紀錄併入保留的項目 (連結取聯集)。項目本身的刪除由呼叫端處理。"""
+    placeholders = ",".join("?" * len(merge_ids))
+    conn.execute(f'''
+        INSERT OR IGNORE INTO item_category_table (item_id, item_type, category_id)
+        SELECT ?, item_type, category_id FROM item_category_table
+        WHERE item_type = ? AND item_id IN ({placeholders})
+    ''', [keep_id, item_type] + list(merge_ids))
+    if item_type == 'vocab':
+        conn.execute(f'''
+            INSERT OR IGNORE INTO item_pos_table (item_id, pos_id)
+            SELECT ?, pos_id FROM item_pos_table WHERE item_id IN ({placeholders})
+        ''', [keep_id] + list(merge_ids))
+        item_index.refresh_pos_sort_keys(conn, [keep_id])
+    conn.execute(f'''
+        UPDATE review_log_table SET item_id = ? WHERE item_type = ? AND item_id IN ({placeholders})
+    ''', [keep_id, item_type] + list(merge_ids))
+
+
+class DuplicateFinder:
+    """分析結果依資料版本 (變更日誌版本) 快取，資料未變動時重新整理頁面不必重新計算。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._clusters = None
+
+    def clusters(self, conn, version, threshold=DEDUP_THRESHOLD):
+        with self._lock:
+            if self._key != (version, threshold):
+                self._clusters = analyze(conn, threshold=threshold)
+                self._key = (version, threshold)
+            return self._clusters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='近似重複偵測 (MinHash + LSH)')
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--threshold', type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument('--limit', type=int, default=20, help='顯示的群組數')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        clusters = analyze(conn, threshold=args.threshold)
+        terms = {}
+        for item_type in ('vocab', 'grammar'):
+            table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+            terms.update({(item_type, row[0]): row[1] for row in conn.execute(f'SELECT id, term_plain FROM {table_name}')})
+    finally:
+        conn.close()
+    print(f"共 {len(clusters)} 組近似重複")
+    for cluster in clusters[:args.limit]:
+        members = ', '.join(f"{item_id}:{terms.get((cluster['type'], item_id), '')}" for item_id in cluster['ids'])
+        print(f"[{cluster['type']}] 相似度 {cluster['similarity']}: {members}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
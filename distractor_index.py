@@ -0,0 +1,197 @@
+# distractor_index.py
+# 選擇題的干擾選項：出題時才由現有的詞性 (item_pos_table)、分類與說明計算每張卡片的 DISTRACTOR_K 個候選，不另外保存逐項目的資料表。
+# 排序依詞性重疊與共同分類，同分時取說明長度相近的；說明有共同詞義 (同義詞) 的項目不會入選。
+# 特徵與分桶快取於行程內，出題前依變更日誌只重新載入變動的項目 (含其他行程與匯入腳本的寫入)
+import bisect
+import re
+import threading
+
+import change_log
+import item_index
+
+ITEM_TYPES = ('vocab', 'grammar')
+DISTRACTOR_K = 8 # 每張卡片計算的候選數 (出題時從中隨機抽取，避免每次都是同一組選項)
+CANDIDATE_WINDOW = 16 # 每一層分桶中取說明長度最接近的項目數
+CANDIDATE_POOL = 48 # 候選池達到此數量後不再往較寬鬆的分桶尋找
+POS_WEIGHT = 2 # 詞性重疊比共同分類更重要
+GLOSS_SPLIT_RE = re.compile(r'[,，;；、/／()（）\[\]「」\s]+') # 說明中分隔各個詞義的符號
+
+
+def _glosses(explanation_plain):
+    return frozenset(g for g in GLOSS_SPLIT_RE.split(explanation_plain or '') if g)
+
+
+def _select(conn, query, id_column, item_ids, params=()):
+    """item_ids 為 None 時執行整個查詢，否則分批加上 id_column IN (...) 的條件。"""
+    if item_ids is None:
+        yield from conn.execute(query, params)
+        return
+    joiner = 'AND' if ' WHERE ' in query else 'WHERE'
+    for chunk in item_index._chunks(item_ids):
+        placeholders = ",".join("?" * len(chunk))
+        yield from conn.execute(f'{query} {joiner} {id_column} IN ({placeholders})', list(params) + chunk)
+
+
+def _load_features(conn, item_type, item_ids=None):
+    """{item_id: (詞性 ID 集合, 分類 ID 集合, 說明長度, 詞義集合, 表記)}；指定 item_ids 時只載入這些項目 (已刪除的不在結果中)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    pos = {}
+    if item_type == 'vocab':
+        for item_id, pos_id in _select(conn, 'SELECT item_id, pos_id FROM item_pos_table', 'item_id', item_ids):
+            pos.setdefault(item_id, set()).add(pos_id)
+    categories = {}
+    for item_id, category_id in _select(conn, 'SELECT item_id, category_id FROM item_category_table WHERE item_type = ?',
+                                        'item_id', item_ids, (item_type,)):
+        categories.setdefault(item_id, set()).add(category_id)
+    features = {}
+    for item_id, term_plain, explanation_plain in _select(
+            conn, f'SELECT id, term_plain, explanation_plain FROM {table_name}', 'id', item_ids):
+        surface, _ = item_index.split_term(term_plain or '', item_type)
+        features[item_id] = (frozenset(pos.get(item_id, ())), frozenset(categories.get(item_id, ())),
+                             len(explanation_plain or ''), _glosses(explanation_plain), surface)
+    return features
+
+
+def _bucket_keys(feature):
+    """由嚴到寬的分桶：詞性與分類完全相同 -> 詞性相同 -> 任一詞性 -> 任一分類 -> 全部。"""
+    pos, categories = feature[0], feature[1]
+    keys = [('pos+category', pos, categories), ('pos', pos)]
+    keys.extend(('one_pos', pos_id) for pos_id in sorted(pos))
+    keys.extend(('one_category', category_id) for category_id in sorted(categories))
+    keys.append(('all',))
+    return keys
+
+
+def _build_buckets(features):
+    """每個分桶內依說明長度排序：{key: ([長度], [item_id])}，以二分搜尋取長度相近的項目。"""
+    members = {}
+    for item_id, feature in features.items():
+        if not feature[2]:
+            continue # 沒有說明的項目不能當作選項
+        for key in _bucket_keys(feature):
+            members.setdefault(key, []).append((feature[2], item_id))
+    buckets = {}
+    for key, entries in members.items():
+        entries.sort()
+        buckets[key] = ([length for length, _ in entries], [item_id for _, item_id in entries])
+    return buckets
+
+
+def _bucket_position(bucket, length, item_id):
+    lengths, ids = bucket
+    lo = bisect.bisect_left(lengths, length)
+    hi = bisect.bisect_right(lengths, length, lo)
+    return bisect.bisect_left(ids, item_id, lo, hi)
+
+
+def _move_in_buckets(buckets, item_id, old, new):
+    """把單一項目從舊特徵的分桶移到新特徵的分桶 (old/new 為 None 表示新增/刪除)，各分桶維持與 _build_buckets 相同的排序。"""
+    if old is not None and old[2]:
+        for key in _bucket_keys(old):
+            bucket = buckets[key]
+            i = _bucket_position(bucket, old[2], item_id)
+            del bucket[0][i], bucket[1][i]
+            if not bucket[1]:
+                del buckets[key]
+    if new is not None and new[2]:
+        for key in _bucket_keys(new):
+            bucket = buckets.setdefault(key, ([], []))
+            i = _bucket_position(bucket, new[2], item_id)
+            bucket[0].insert(i, new[2])
+            bucket[1].insert(i, item_id)
+
+
+def _rank_distractors(item_id, features, buckets, k=DISTRACTOR_K):
+    """返回 [(distractor_id, score)]，分數高者在前。"""
+    feature = features[item_id]
+    pos, categories, length, glosses, surface = feature
+    pool = set()
+    for key in _bucket_keys(feature):
+        bucket = buckets.get(key)
+        if bucket is None:
+            continue
+        lengths, ids = bucket
+        i = bisect.bisect_left(lengths, length)
+        pool.update(ids[max(0, i - CANDIDATE_WINDOW):i + CANDIDATE_WINDOW])
+        if len(pool) >= CANDIDATE_POOL:
+            break
+    pool.discard(item_id)
+
+    scored = []
+    for other_id in pool:
+        other_pos, other_categories, other_length, other_glosses, other_surface = features[other_id]
+        if glosses & other_glosses or surface == other_surface:
+            continue # 同義詞或同一個詞的不同讀音，選項會有兩個正確答案
+        score = POS_WEIGHT * len(pos & other_pos) + len(categories & other_categories)
+        scored.append((-score, abs(other_length - length), other_id, other_glosses))
+    scored.sort(key=lambda entry: entry[:3])
+
+    result = []
+    picked_glosses = set()
+    for negative_score, _, other_id, other_glosses in scored:
+        if other_glosses & picked_glosses:
+            continue # 干擾選項之間也不重複詞義，避免畫面上出現兩個一樣的選項
+        result.append((other_id, -negative_score))
+        picked_glosses |= other_glosses
+        if len(result) == k:
+            break
+    return result
+
+
+def _apply_changes(conn, item_type, item_ids, features, buckets):
+    """只重新載入變動項目的特徵並調整其分桶 (features / buckets 就地更新)；已刪除的項目只移除。"""
+    changed = _load_features(conn, item_type, item_ids)
+    for item_id in item_ids:
+        old, new = features.get(item_id), changed.get(item_id)
+        if old == new:
+            continue
+        _move_in_buckets(buckets, item_id, old, new)
+        if new is None:
+            del features[item_id]
+        else:
+            features[item_id] = new
+
+
+class DistractorIndex:
+    """
+    行程內快取各類型的特徵與分桶，出題時才為該批卡片計算干擾選項。
+    每次查詢前以唯讀連線讀取上次之後的變更日誌 (只看項目實體；分類與詞性的關聯變動也記為項目更新)，
+    只重新載入變動的項目；第一次使用或日誌已被清除而接不上時整個重新載入。不需要寫入佇列。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None # {item_type: (features, buckets)}
+        self._feed = change_log.ChangeFeed()
+
+    def _sync(self, conn):
+        changes = self._feed.poll(conn) if self._state is not None else None
+        if changes is None:
+            # 先記下日誌版本再載入：載入期間的寫入會在下次同步時重新套用 (重新載入是冪等的)
+            self._state = None
+            self._feed.reset(conn)
+            state = {}
+            for item_type in ITEM_TYPES:
+                features = _load_features(conn, item_type)
+                state[item_type] = (features, _build_buckets(features))
+            self._state = state
+            return
+        dirty = {item_type: set() for item_type in ITEM_TYPES}
+        for entity, entity_id, _ in changes:
+            if entity in dirty:
+                dirty[entity].add(entity_id)
+        try:
+            for item_type, item_ids in dirty.items():
+                if item_ids:
+                    _apply_changes(conn, item_type, item_ids, *self._state[item_type])
+        except Exception:
+            self._state = None # 游標已前進但快取只更新了一部分，下次整個重新載入
+            raise
+
+    def get_distractors(self, conn, item_type, item_ids, k=DISTRACTOR_K):
+        """返回 {item_id: [distractor_id, ...]} (依排名)；已刪除的項目不在結果中。"""
+        with self._lock:
+            self._sync(conn)
+            features, buckets = self._state[item_type]
+            return {item_id: [distractor_id for distractor_id, _ in _rank_distractors(item_id, features, buckets, k)]
+                    for item_id in set(item_ids) if item_id in features}
@@ -0,0 +1,248 @@
+# example_index.py
+# 「使用此單字的例句」反向索引：以 Aho-Corasick 自動機一次掃描所有例句 (example_plain 純文字欄位)
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+import change_log
+import item_index
+
+DB_NAME = 'jp_db.db'
+MIN_KANA_PATTERN_LENGTH = 2 # 純假名的表記至少 2 個字才建立連結，避免單一假名到處命中
+MIN_READING_PATTERN_LENGTH = 3 # 漢字單字的讀音較易與同音詞混淆 (刷る/する)，需更長才比對
+OVERLAY_REBUILD_THRESHOLD = 200 # 增量修改累積超過此數量時重建自動機
+SOURCE_TABLES = (('vocab', 'vocab_table'), ('grammar', 'grammar_table'))
+
+
+class AhoCorasick:
+    """純 Python 的 Aho-Corasick 自動機；輸出為 pattern 對應的 payload 集合。"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+
+    def add(self, pattern, payload):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            node = nxt
+        self._out[node].add(payload)
+
+    def finalize(self):
+        """以 BFS 建立失敗連結，並把失敗路徑上的輸出合併到每個節點。"""
+        queue = deque(self._goto[0].values()) # 第一層節點的失敗連結指向根節點
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def search(self, text):
+        """返回 text 中出現的所有 payload。"""
+        found = set()
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+def vocab_patterns(term):
+    """單字用於比對例句的字串：表記與讀音 (去除 ～ 等前後綴符號)。"""
+    surface, reading = item_index.split_term(term, 'vocab')
+    surface = surface.strip(' ～〜~・')
+    reading = reading.strip(' ～〜~・')
+    patterns = set()
+    has_kanji = any(item_index.is_kanji(ch) for ch in surface)
+    if surface and (has_kanji or len(surface) >= MIN_KANA_PATTERN_LENGTH):
+        patterns.add(surface)
+    min_reading = MIN_READING_PATTERN_LENGTH if has_kanji else MIN_KANA_PATTERN_LENGTH
+    if reading and len(reading) >= min_reading:
+        patterns.add(reading)
+    return patterns
+
+
+def _build_automaton(conn, vocab_ids=None):
+    """vocab_ids 為 None 時包含所有單字，否則只包含指定的單字。"""
+    automaton = AhoCorasick()
+    if vocab_ids is None:
+        rows = conn.execute('SELECT id, term FROM vocab_table')
+    else:
+        rows = []
+        for chunk in item_index._chunks(set(vocab_ids)):
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(conn.execute(f'SELECT id, term FROM vocab_table WHERE id IN ({placeholders})', chunk))
+    for vocab_id, term in rows:
+        for pattern in vocab_patterns(term):
+            automaton.add(pattern, vocab_id)
+    automaton.finalize()
+    return automaton
+
+
+def rebuild_example_links(conn):
+    """批次索引：建立自動機並掃描所有例句一次，重寫 example_link_table。返回連結數。"""
+    automaton = _build_automaton(conn)
+    rows = []
+    for source_type, table_name in SOURCE_TABLES:
+        for source_id, example in conn.execute(
+                f"SELECT id, example_plain FROM {table_name} WHERE example_plain IS NOT NULL AND example_plain != ''"):
+            for vocab_id in automaton.search(example):
+                rows.append((vocab_id, source_type, source_id))
+    conn.execute('DELETE FROM example_link_table')
+    conn.executemany(
+        'INSERT OR IGNORE INTO example_link_table (vocab_id, source_type, source_id) VALUES (?, ?, ?)', rows
+    )
+    return len(rows)
+
+
+def link_new_vocab(conn, vocab_ids):
+    """
+    匯入新單字後只更新相關的連結：新單字的例句以完整的自動機比對，其他例句只以新單字的字串組成的小自動機掃描
+    (只會命中含有新單字的例句)。不重寫整個 example_link_table。返回新增的連結數。
+    """
+    vocab_ids = set(vocab_ids)
+    if not vocab_ids:
+        return 0
+    automaton = _build_automaton(conn)
+    new_automaton = _build_automaton(conn, vocab_ids)
+    for chunk in item_index._chunks(vocab_ids):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM example_link_table WHERE source_type = 'vocab' AND source_id IN ({placeholders})", chunk)
+        conn.execute(f'DELETE FROM example_link_table WHERE vocab_id IN ({placeholders})', chunk)
+    rows = []
+    for source_type, table_name in SOURCE_TABLES:
+        for source_id, example in conn.execute(
+                f"SELECT id, example_plain FROM {table_name} WHERE example_plain IS NOT NULL AND example_plain != ''"):
+            is_new = source_type == 'vocab' and source_id in vocab_ids
+            for vocab_id in (automaton if is_new else new_automaton).search(example):
+                rows.append((vocab_id, source_type, source_id))
+    conn.executemany(
+        'INSERT OR IGNORE INTO example_link_table (vocab_id, source_type, source_id) VALUES (?, ?, ?)', rows
+    )
+    return len(rows)
+
+
+class ExampleLinker:
+    """
+    行程內快取的自動機 + 增量修改覆蓋層 (overlay)。
+    編輯過的單字記在 overlay 中：自動機對它們的命中結果會被忽略，改以新的字串直接比對。
+    使用前先讀取變更日誌，其他行程 (匯入腳本等) 新增/修改/刪除的單字也會加入 overlay；日誌接不上時重建自動機。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._automaton = None
+        self._overlay = {} # vocab_id -> 目前的 patterns (已刪除的單字為空集合)
+        self._feed = change_log.ChangeFeed()
+
+    def invalidate(self):
+        """寫入工作被回滾時呼叫：自動機/overlay 可能含有未 commit 的變更，下次使用時重新建立。"""
+        with self._lock:
+            self._automaton = None
+            self._overlay = {}
+
+    def _ensure_automaton(self, conn):
+        changes = self._feed.poll(conn) if self._automaton is not None else None
+        if changes is not None:
+            vocab_ids = [entity_id for entity, entity_id, _ in changes if entity == 'vocab']
+            for vocab_id in vocab_ids:
+                self._overlay[vocab_id] = set()
+            for chunk in item_index._chunks(vocab_ids):
+                placeholders = ",".join("?" * len(chunk))
+                for vocab_id, term in conn.execute(f'SELECT id, term FROM vocab_table WHERE id IN ({placeholders})', chunk):
+                    self._overlay[vocab_id] = vocab_patterns(term)
+        if changes is None or len(self._overlay) > OVERLAY_REBUILD_THRESHOLD:
+            # 先記下日誌版本再建立：之後的變更都會在下次使用時套用到 overlay
+            self._feed.reset(conn)
+            self._automaton = _build_automaton(conn)
+            self._overlay = {}
+
+    def _match(self, text):
+        found = {v for v in self._automaton.search(text) if v not in self._overlay}
+        for vocab_id, patterns in self._overlay.items():
+            if any(p in text for p in patterns):
+                found.add(vocab_id)
+        return found
+
+    def refresh_sources(self, conn, source_type, source_ids):
+        """例句新增/修改後，重新掃描這些例句。"""
+        table_name = 'vocab_table' if source_type == 'vocab' else 'grammar_table'
+        with self._lock:
+            self._ensure_automaton(conn)
+            for chunk in item_index._chunks(set(source_ids)):
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(
+                    f'DELETE FROM example_link_table WHERE source_type = ? AND source_id IN ({placeholders})',
+                    [source_type] + chunk
+                )
+                rows = []
+                for source_id, example in conn.execute(
+                        f'SELECT id, example_plain FROM {table_name} WHERE id IN ({placeholders})', chunk):
+                    if example:
+                        rows.extend((vocab_id, source_type, source_id) for vocab_id in self._match(example))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO example_link_table (vocab_id, source_type, source_id) VALUES (?, ?, ?)', rows
+                )
+
+    def refresh_vocab(self, conn, vocab_id, term):
+        """單字表記/讀音修改後，以 instr 在純文字例句中找出含有新字串的所有例句。"""
+        patterns = vocab_patterns(term)
+        with self._lock:
+            self._overlay[vocab_id] = patterns
+            conn.execute('DELETE FROM example_link_table WHERE vocab_id = ?', (vocab_id,))
+            rows = []
+            for pattern in patterns:
+                for source_type, table_name in SOURCE_TABLES:
+                    rows.extend(
+                        (vocab_id, source_type, source_id) for (source_id,) in conn.execute(
+                            f'SELECT id FROM {table_name} WHERE instr(example_plain, ?) > 0', (pattern,))
+                    )
+            conn.executemany(
+                'INSERT OR IGNORE INTO example_link_table (vocab_id, source_type, source_id) VALUES (?, ?, ?)', rows
+            )
+
+    def remove(self, conn, item_type, item_ids):
+        """項目刪除時移除相關連結 (單字本身與其例句)。"""
+        with self._lock:
+            for chunk in item_index._chunks(set(item_ids)):
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(
+                    f'DELETE FROM example_link_table WHERE source_type = ? AND source_id IN ({placeholders})',
+                    [item_type] + chunk
+                )
+                if item_type == 'vocab':
+                    self._overlay.update((vocab_id, set()) for vocab_id in chunk)
+                    conn.execute(f'DELETE FROM example_link_table WHERE vocab_id IN ({placeholders})', chunk)
+
+
+if __name__ == '__main__':
+    db_name = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    print(f"🔎 開始重建例句反向索引 ({db_name})...")
+    start = time.time()
+    conn = sqlite3.connect(db_name)
+    try:
+        link_count = rebuild_example_links(conn)
+        conn.commit()
+        print(f"✅ 完成！共建立 {link_count} 筆例句連結，耗時 {time.time() - start:.2f} 秒")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"❌ 重建失敗: {e}")
+    finally:
+        conn.close()
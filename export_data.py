@@ -0,0 +1,148 @@
+# export_data.py
+# 串流匯出：以產生器逐批輸出 TSV (與 import_anki_data 相同欄位配置) / CSV / NDJSON，記憶體用量固定
+import argparse
+import csv
+import io
+import json
+import re
+import sqlite3
+import sys
+
+import text_codec
+
+DB_NAME = 'jp_db.db'
+EXPORT_FORMATS = ('tsv', 'csv', 'ndjson')
+EXPORT_CHUNK_ROWS = 500 # 每次 yield 的列數
+EXPORT_MIMETYPES = {
+    'tsv': 'text/tab-separated-values; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# import_anki_data 讀取的欄位位置 (共 15 欄，前兩行為標頭)
+TSV_COLUMN_COUNT = 15
+TSV_TERM_COL = 1
+TSV_POS_COL = 3
+TSV_READING_COL = 4
+TSV_EXPLANATION_COL = 5
+TSV_EXAMPLE_COL = 10
+TSV_TAGS_COL = 14
+TSV_HEADER_LINES = ('#separator:tab', f'#tags column:{TSV_TAGS_COL + 1}') # Anki 匯出檔的標頭格式
+
+CSV_COLUMNS = ('id', 'term', 'pos', 'explanation', 'example_sentence', 'categories')
+READING_RE = re.compile(r'\[(.+?)\]')
+
+
+def build_export_query(data_type, from_clause, where_clause_str):
+    """
+    在列表頁的 FROM/WHERE 之上加入分類與詞性欄位 (相關子查詢，逐列計算，不需要整批載入)。
+    from_clause / where_clause_str 由 app._get_query_components 產生，篩選條件與列表頁一致。
+    """
+    pos_column = "T1.pos_sort_key" if data_type == 'vocab' else "NULL"
+    return f'''
+        SELECT DISTINCT T1.id, T1.term, T1.explanation, T1.example_sentence, {pos_column} AS pos_string,
+            (SELECT GROUP_CONCAT(K.name, ',') FROM item_category_table AS C
+             JOIN category_table AS K ON C.category_id = K.id
+             WHERE C.item_id = T1.id AND C.item_type = ?) AS category_string
+        {from_clause} {where_clause_str}
+        ORDER BY T1.id
+    '''
+
+
+def iter_export_rows(conn, data_type, query, params):
+    """逐列產生匯出用 dict (sqlite3 游標本身就是惰性讀取)。"""
+    cursor = conn.execute(query, [data_type] + list(params))
+    for item_id, term, explanation, example_sentence, pos_string, category_string in cursor:
+        yield {
+            'id': item_id,
+            'type': data_type,
+            'term': term or '',
+            'explanation': text_codec.unpack(conn, explanation) or '',
+            'example_sentence': example_sentence or '',
+            'pos': [p for p in (pos_string or '').split(',') if p],
+            'categories': [c for c in (category_string or '').split(',') if c],
+        }
+
+
+def _tsv_row(item):
+    """依 import_anki_data 的欄位位置組成一列；`單字[讀音]` 拆成單字欄與讀音欄。"""
+    row = [''] * TSV_COLUMN_COUNT
+    term = item['term']
+    if item['type'] == 'vocab':
+        match = READING_RE.search(term)
+        row[TSV_READING_COL] = match.group(1) if match else ''
+        term = READING_RE.sub('', term).strip()
+    row[0] = str(item['id'])
+    row[TSV_TERM_COL] = term
+    row[TSV_POS_COL] = ','.join(item['pos'])
+    row[TSV_EXPLANATION_COL] = item['explanation']
+    row[TSV_EXAMPLE_COL] = item['example_sentence']
+    # Anki 的標籤以空白分隔，分類名稱中的空白改為底線
+    row[TSV_TAGS_COL] = ' '.join(c.replace(' ', '_') for c in item['categories'])
+    return row
+
+
+def _csv_row(item):
+    return [item['id'], item['term'], ','.join(item['pos']), item['explanation'],
+            item['example_sentence'], ','.join(item['categories'])]
+
+
+def stream_export(rows, export_format):
+    """將列產生器轉為字串片段的產生器 (每 EXPORT_CHUNK_ROWS 列 yield 一次)。"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'tsv':
+        writer = csv.writer(buffer, delimiter='\t', lineterminator='\n')
+        buffer.write('\n'.join(TSV_HEADER_LINES) + '\n')
+    elif export_format == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(CSV_COLUMNS)
+
+    for count, item in enumerate(rows, 1):
+        if export_format == 'tsv':
+            writer.writerow(_tsv_row(item))
+        elif export_format == 'csv':
+            writer.writerow(_csv_row(item))
+        else:
+            buffer.write(json.dumps(item, ensure_ascii=False) + '\n')
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv=None):
+    """命令列匯出，篩選參數與列表頁相同。"""
+    parser = argparse.ArgumentParser(description='匯出單字/文法資料 (TSV/CSV/NDJSON)')
+    parser.add_argument('data_type', choices=['vocab', 'grammar'])
+    parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='tsv')
+    parser.add_argument('--category')
+    parser.add_argument('--search')
+    parser.add_argument('--pos')
+    parser.add_argument('--kanji')
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('-o', '--output', help='輸出檔案 (預設為標準輸出)')
+    args = parser.parse_args(argv)
+
+    from app import _get_query_components # 共用列表頁的篩選條件
+
+    _, from_clause, where_clause_str, params = _get_query_components(
+        args.data_type, args.category, args.search, args.pos, kanji_filter=args.kanji
+    )
+    query = build_export_query(args.data_type, from_clause, where_clause_str)
+    conn = sqlite3.connect(args.db)
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in stream_export(iter_export_rows(conn, args.data_type, query, params), args.export_format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# fragment_cache.py
+# 頁面片段快取：已渲染的 HTML 片段 (列表每一列、篩選下拉選單)，LRU 淘汰
+# 資料版本由不寫入的監看連線讀取 PRAGMA data_version 得到，任何連線 (含其他行程) commit 後都會改變；
+# 版本改變時由呼叫端依變更日誌決定要淘汰哪些片段 (invalidate)，未受影響的片段繼續沿用
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+DB_NAME = 'jp_db.db'
+FRAGMENT_CACHE_SIZE = 2000 # 最多保留的片段數 (一頁 20 列，約可容納 100 頁)
+
+
+class DataVersion:
+    """單調遞增的資料版本號；監看連線本身不寫入，其他連線 commit 後它讀到的 data_version 就會改變。"""
+
+    def __init__(self, db_name=DB_NAME):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._watch = None
+        self._last = None
+        self.version = 0
+
+    def current(self):
+        with self._lock:
+            if self._watch is None:
+                self._watch = sqlite3.connect(self.db_name, check_same_thread=False)
+            value = self._watch.execute('PRAGMA data_version').fetchone()[0]
+            if value != self._last:
+                self._last = value
+                self.version += 1
+            return self.version
+
+    def close(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+
+
+class FragmentCache:
+    """
+    LRU 片段快取。每次 invalidate() 都會遞增世代 (generation)；put() 帶入渲染前取得的世代，
+    若渲染期間已有淘汰發生 (資料可能是淘汰前讀到的舊資料)，該片段就不存入快取。
+    """
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stale(self, version):
+        """資料版本是否與上次 invalidate() 時不同。"""
+        return version != self._version
+
+    def invalidate(self, version, predicate=None):
+        """淘汰 predicate(key) 為真的片段 (predicate 為 None 時全部清空)，記下資料版本並返回新的世代。"""
+        with self._lock:
+            if predicate is None:
+                self.evictions += len(self._entries)
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
+                    self.evictions += 1
+            self._version = version
+            self.generation += 1
+            return self.generation
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return html
+
+    def put(self, key, html, generation=None):
+        html = Markup(html)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return html
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return html
+
+    def get_or_render(self, key, render, generation=None):
+        html = self.get(key)
+        return html if html is not None else self.put(key, render(), generation)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'generation': self.generation}
@@ -0,0 +1,342 @@
+# grammar_pattern.py
+# 文法句型比對：將文法 term 的表示法 (～、A/B、V-て形 等) 編譯為正規表示式，批次比對所有例句。
+# 句型前的接續 (名詞+の、V-て形) 與核心後緊接的字串 (+ に / な) 一併編譯，只有核心本身時太常見的助詞不建立索引
+import functools
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import item_index
+from example_index import AhoCorasick, SOURCE_TABLES
+
+DB_NAME = 'jp_db.db'
+GAP_PATTERN = '.{0,20}?' # ～ / ... 代表的任意片段
+PLACEHOLDER_PATTERN = '.{1,12}?' # 句型核心中的 A、B 等代稱
+STEM_PATTERN = r'[\u4e00-\u9fff\u3005]{1,4}[\u3041-\u309f]{0,2}' # 接續中夾在字串之間的語幹或名詞 (お+V-ます形(ます) 的「待ち」)
+MIN_LITERAL_LENGTH = 2 # 固定字串總長不足 2 的核心 ([の]、[し]) 幾乎每句都會命中，不建立索引
+MIN_BARE_KANA_LENGTH = 3 # 沒有接續或後接字串限制時，只由平假名組成且不足 3 個字的核心 ([って]、[こと]) 是常見的功能詞，不建立索引
+CORE_RE = re.compile(r'\[([^\[\]]+)\]')
+FURIGANA_RE = re.compile(r'([\u4e00-\u9fff\u3005]+)\[[\u3041-\u3096]+\]') # 中[ちゅう]、方[かた] 是讀音標註，核心為漢字本身
+GAP_RE = re.compile(r'(?:\.{2,}|…+|[~～〜])')
+PLACEHOLDER_RE = re.compile(r'[A-Za-zＡ-Ｚ]')
+OPTIONAL_RE = re.compile(r'\(([^()]*)\)')
+LABEL_RE = re.compile(r'^(?:.*形|助詞)$') # [意向形]、[助詞] 等說明標籤，不是實際字串
+KANA_RE = re.compile(r'[\u3041-\u30ff]+')
+BARE_KANA_RE = re.compile(r'[\u3041-\u309f/+]+') # 只由平假名組成的核心 (可含 / 與 + 分隔)
+NOTATION_SPACE_RE = re.compile(r'\s*([+/])\s*|\s+(?=\()') # 「名詞 + の」、「V-ない形 (ない)」中的空白
+DASH_FORM_RE = re.compile(r'(?:名詞|[いな]形)-([\u3041-\u30ff]+)') # い形-くて、名詞-で
+REMOVED_SUFFIX_RE = re.compile(r'(.+?)\(([^()]+)\)') # V-ます形(ます)：去掉語尾 (語幹)
+
+# 接續形式 -> 緊接在句型前的字串 (regex)，避免 [います] 命中「猫がいます」；
+# 未列出的形式 (名詞、な形、V-普通形、V-ます形 等) 或只取語幹時不限制前面的文字
+CONNECTION_CONTEXT = {
+    'V-て形': '[てで]',
+    'V-た形': '[ただ]',
+    'V-辞書形': '[うくぐすつぬぶむる]',
+    'V-辭書形': '[うくぐすつぬぶむる]',
+    'V-ない形': 'ない',
+    'V-ない': 'ない',
+    'V-たい形': 'たい',
+    'V-ている': 'ている',
+    'V-ている形': 'ている',
+    'い形': 'い',
+}
+
+
+def _compile_alternative(text):
+    """
+    將單一選項 (已去除空白) 轉為 regex 片段與可用於預篩的最長固定字串。
+    ～/... 轉為有限長度的任意片段，A/B 轉為代稱，(x) 轉為可省略的 x。
+    """
+    pieces = []
+    literals = []
+    for part_index, part in enumerate(GAP_RE.split(text)):
+        if part_index:
+            pieces.append(GAP_PATTERN)
+        pos = 0
+        for m in re.finditer(f'{OPTIONAL_RE.pattern}|{PLACEHOLDER_RE.pattern}', part):
+            literal = part[pos:m.start()]
+            pieces.append(re.escape(literal))
+            literals.append(literal)
+            if m.group(1) is not None:
+                pieces.append(f'(?:{re.escape(m.group(1))})?')
+            else:
+                pieces.append(PLACEHOLDER_PATTERN)
+            pos = m.end()
+        pieces.append(re.escape(part[pos:]))
+        literals.append(part[pos:])
+    return "".join(pieces), max(literals, key=len, default=''), sum(len(literal) for literal in literals)
+
+
+def _compile_core(core):
+    """
+    編譯單一 [] 核心：'+' 表示串接 (優先度較低)，'/' 表示選項。
+    返回: (regex 字串, 預篩字串集合, 是否為常見的短助詞)；核心只是說明標籤或過短時返回 (None, None, False)。
+    """
+    core = re.sub(r'\s+', '', core).strip('~～〜.…')
+    segments = []
+    keys = None
+    literal_length = 0
+    for segment in core.split('+'):
+        alternatives = [alt.strip('~～〜.…') for alt in segment.split('/')]
+        alternatives = [alt for alt in alternatives if alt and not LABEL_RE.match(alt)]
+        if not alternatives:
+            continue
+        compiled = [_compile_alternative(alt) for alt in alternatives]
+        segments.append('(?:' + '|'.join(regex for regex, _, _ in compiled) + ')')
+        literal_length += min(length for _, _, length in compiled)
+        if keys is None:
+            # 第一個片段一定會出現，其各選項的固定字串可作為預篩鍵
+            keys = {literal for _, literal, _ in compiled}
+    if not segments or literal_length < MIN_LITERAL_LENGTH:
+        return None, None, False
+    is_bare = literal_length < MIN_BARE_KANA_LENGTH and BARE_KANA_RE.fullmatch(core) is not None
+    return "".join(segments), keys, is_bare
+
+
+def _context_piece(part):
+    """接續說明中以 + 串接的單一片段 -> regex 片段；名詞、語幹等不限制文字的片段返回 None。"""
+    options = part.split('/')
+    if all(KANA_RE.fullmatch(option) for option in options):
+        if len(options) == 1:
+            return re.escape(part)
+        return '(?:' + '|'.join(re.escape(option) for option in options) + ')'
+    m = DASH_FORM_RE.fullmatch(part)
+    if m:
+        return re.escape(m.group(1))
+    m = REMOVED_SUFFIX_RE.fullmatch(part)
+    form, removed = (m.group(1), m.group(2)) if m else (part, '')
+    context = CONNECTION_CONTEXT.get(form)
+    if context is None or not removed:
+        return context
+    if KANA_RE.fullmatch(context) and context.endswith(removed) and context != removed:
+        return context[:-len(removed)] # V-たい形(い) + [がります] -> た
+    return None
+
+
+def _compile_connection(connection, core_texts):
+    """單一種接續方式 (名詞+の、お+V-ます形(ます)) -> 句型前的 regex；不限制前面的文字時返回 None。"""
+    parts = [part for part in connection.split('+') if part]
+    if any(KANA_RE.fullmatch(part) and part in text for part in parts for text in core_texts):
+        return None # 說明的是核心本身的組成 (名詞+より ... + [AよりBほうが])，不是接續
+    pieces = [_context_piece(part) for part in parts]
+    if pieces and pieces[-1] is not None and any(re.match(pieces[-1], text) for text in core_texts):
+        pieces[-1] = None # 接續的語尾已寫在核心中 (V-て形 + [ても]、名詞-の + [のに])
+    while pieces and pieces[0] is None:
+        pieces.pop(0)
+    if not pieces:
+        return None
+    regex = ''
+    for piece in pieces:
+        if piece is not None:
+            regex += piece
+        elif not regex.endswith(STEM_PATTERN):
+            regex += STEM_PATTERN # お+V-ます形(ます)：お 與核心之間是動詞語幹
+    return regex
+
+
+def _compile_prefix(text, core_texts):
+    """第一個核心之前以 + 相連的接續說明 (以空白分隔的各種接續方式) -> regex；任一種接續方式不限制時返回 None。"""
+    if not text.endswith('+'):
+        return None # [から~にかけて] 等完整句型前面只是用法說明
+    regexes = []
+    for connection in text.split():
+        regex = _compile_connection(connection, core_texts)
+        if regex is None:
+            return None
+        regexes.append(regex)
+    if not regexes:
+        return None
+    return '(?:' + '|'.join(dict.fromkeys(regexes)) + ')'
+
+
+def _compile_suffix(text):
+    """最後一個核心之後以 + 或 ～ 相連的字串 (+ に / の / だ、~ない) -> regex；接名詞或說明文字等不限制時返回 None。"""
+    text = text.strip()
+    gap = GAP_RE.match(text)
+    if gap:
+        text = text[gap.end():]
+    elif text.startswith('+'):
+        text = text[1:]
+    else:
+        return None
+    options = text.split('/')
+    if not text or not all(KANA_RE.fullmatch(option) for option in options):
+        return None
+    return (GAP_PATTERN if gap else '') + '(?:' + '|'.join(re.escape(option) for option in options) + ')'
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_grammar_term(term_plain):
+    """
+    將文法 term (純文字) 編譯為 (compiled regex, 預篩字串集合)；無法編譯時返回 (None, None)。
+    多個 [] 核心之間若以 ～/... 連接視為同一句型的前後兩段，否則視為可互換的選項。
+    第一個核心前的接續 (名詞+の、V-て形) 與最後一個核心後緊接的字串 (+ に / な / です) 也是句型的一部分；
+    兩者都不限制時，只由短平假名組成的核心 ([って]、[こと]) 不建立索引。
+    預篩字串集合中含空字串時表示無法預篩 (每句都要比對)。
+    """
+    if not term_plain:
+        return None, None
+    term_plain = NOTATION_SPACE_RE.sub(r'\1', FURIGANA_RE.sub(r'[\1]', term_plain))
+    cores = list(CORE_RE.finditer(term_plain))
+    if not cores:
+        return None, None
+    core_texts = [m.group(1).strip('~～〜.…') for m in cores]
+    prefix = _compile_prefix(term_plain[:cores[0].start()], core_texts)
+    suffix = _compile_suffix(term_plain[cores[-1].end():])
+
+    alternatives = [] # [[regex, keys, 是否為常見的短助詞, 最後一個核心的位置]]
+    for i, m in enumerate(cores):
+        regex, keys, is_bare = _compile_core(m.group(1))
+        if regex is None:
+            continue
+        between = term_plain[cores[i - 1].end():m.start()] if i else ''
+        if alternatives and GAP_RE.search(between):
+            alternatives[-1][0] += GAP_PATTERN + regex
+            alternatives[-1][2:] = [False, i]
+        else:
+            alternatives.append([regex, keys, is_bare, i])
+    if alternatives and suffix is not None and alternatives[-1][3] == len(cores) - 1:
+        alternatives[-1][0] += suffix
+        alternatives[-1][2] = False
+    if prefix is None:
+        alternatives = [alternative for alternative in alternatives if not alternative[2]]
+    if not alternatives:
+        return None, None
+
+    pattern = '|'.join(f'(?:{regex})' for regex, _, _, _ in alternatives)
+    if prefix is not None:
+        pattern = f'{prefix}(?:{pattern})'
+    keys = set().union(*(keys for _, keys, _, _ in alternatives))
+    return re.compile(pattern), keys
+
+
+def _load_matchers(conn):
+    """返回 {grammar_id: compiled regex} 與以預篩字串建立的 Aho-Corasick 自動機。"""
+    matchers = {}
+    always = set()
+    automaton = AhoCorasick()
+    for grammar_id, term_plain in conn.execute('SELECT id, term_plain FROM grammar_table'):
+        regex, keys = compile_grammar_term(term_plain)
+        if regex is None:
+            continue
+        matchers[grammar_id] = regex
+        if '' in keys:
+            always.add(grammar_id)
+        for key in keys:
+            if key:
+                automaton.add(key, grammar_id)
+    automaton.finalize()
+    return matchers, automaton, always
+
+
+def _match_sentence(text, matchers, automaton, always):
+    candidates = automaton.search(text) | always
+    return [grammar_id for grammar_id in candidates if matchers[grammar_id].search(text)]
+
+
+def rebuild_grammar_matches(conn):
+    """批次索引：編譯所有文法句型並比對全部例句一次，重寫 grammar_match_table。返回命中數。"""
+    matchers, automaton, always = _load_matchers(conn)
+    rows = []
+    for source_type, table_name in SOURCE_TABLES:
+        for source_id, example in conn.execute(
+                f"SELECT id, example_plain FROM {table_name} WHERE example_plain IS NOT NULL AND example_plain != ''"):
+            rows.extend((grammar_id, source_type, source_id)
+                        for grammar_id in _match_sentence(example, matchers, automaton, always))
+    conn.execute('DELETE FROM grammar_match_table')
+    conn.executemany(
+        'INSERT OR IGNORE INTO grammar_match_table (grammar_id, source_type, source_id) VALUES (?, ?, ?)', rows
+    )
+    return len(rows)
+
+
+class GrammarMatcher:
+    """行程內快取的已編譯句型；只重新比對有變動的文法或例句。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None # (matchers, automaton, always)
+
+    def invalidate(self):
+        """寫入工作被回滾時呼叫：快取的句型可能來自未 commit 的文法，下次使用時重新載入。"""
+        with self._lock:
+            self._state = None
+
+    def _ensure_state(self, conn):
+        if self._state is None:
+            self._state = _load_matchers(conn)
+        return self._state
+
+    def refresh_grammar(self, conn, grammar_id):
+        """文法 term 新增/修改後，以新的句型重新比對所有例句 (句型未改變時略過)。"""
+        with self._lock:
+            row = conn.execute('SELECT term_plain FROM grammar_table WHERE id = ?', (grammar_id,)).fetchone()
+            regex, _ = compile_grammar_term(row[0] if row else None)
+            if self._state is not None and self._state[0].get(grammar_id) is regex:
+                return # compile_grammar_term 有快取，term 未改變時會得到同一個物件
+            self._state = None # 句型集合改變，下次比對例句時重新建立
+            conn.execute('DELETE FROM grammar_match_table WHERE grammar_id = ?', (grammar_id,))
+            if regex is None:
+                return
+            rows = []
+            for source_type, table_name in SOURCE_TABLES:
+                for source_id, example in conn.execute(
+                        f"SELECT id, example_plain FROM {table_name} WHERE example_plain IS NOT NULL AND example_plain != ''"):
+                    if regex.search(example):
+                        rows.append((grammar_id, source_type, source_id))
+            conn.executemany(
+                'INSERT OR IGNORE INTO grammar_match_table (grammar_id, source_type, source_id) VALUES (?, ?, ?)', rows
+            )
+
+    def refresh_sources(self, conn, source_type, source_ids):
+        """例句新增/修改後，只重新比對這些例句。"""
+        table_name = 'vocab_table' if source_type == 'vocab' else 'grammar_table'
+        with self._lock:
+            matchers, automaton, always = self._ensure_state(conn)
+            for chunk in item_index._chunks(set(source_ids)):
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(
+                    f'DELETE FROM grammar_match_table WHERE source_type = ? AND source_id IN ({placeholders})',
+                    [source_type] + chunk
+                )
+                rows = []
+                for source_id, example in conn.execute(
+                        f'SELECT id, example_plain FROM {table_name} WHERE id IN ({placeholders})', chunk):
+                    if example:
+                        rows.extend((grammar_id, source_type, source_id)
+                                    for grammar_id in _match_sentence(example, matchers, automaton, always))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO grammar_match_table (grammar_id, source_type, source_id) VALUES (?, ?, ?)', rows
+                )
+
+    def remove(self, conn, item_type, item_ids):
+        """項目刪除時移除相關比對結果 (文法本身與其例句)。"""
+        with self._lock:
+            for chunk in item_index._chunks(set(item_ids)):
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(
+                    f'DELETE FROM grammar_match_table WHERE source_type = ? AND source_id IN ({placeholders})',
+                    [item_type] + chunk
+                )
+                if item_type == 'grammar':
+                    self._state = None
+                    conn.execute(f'DELETE FROM grammar_match_table WHERE grammar_id IN ({placeholders})', chunk)
+
+
+if __name__ == '__main__':
+    db_name = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    print(f"🔎 開始重建文法句型索引 ({db_name})...")
+    start = time.time()
+    conn = sqlite3.connect(db_name)
+    try:
+        match_count = rebuild_grammar_matches(conn)
+        conn.commit()
+        print(f"✅ 完成！共 {match_count} 筆例句命中，耗時 {time.time() - start:.2f} 秒")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"❌ 重建失敗: {e}")
+    finally:
+        conn.close()
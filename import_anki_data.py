@@ -1,10 +1,13 @@
 # import_anki_data.py
+import argparse
 import sqlite3
 import re
 import csv
 import os
-import sys 
-from opencc import OpenCC 
+import functools
+import item_index
+import example_index
+import grammar_pattern
 
 # --- 配置區 ---
 DB_NAME = 'jp_db.db' 
@@ -45,11 +48,14 @@ POS_CODE_MAPPER = {
     '自他動': '自他動', 
     'い形': 'い形', 
     'ナ形': 'な形',
+    'な形': 'な形',
     '副': '副', 
     '連体詞': '連体詞', 
     '連体': '連体詞',
     '接': '接續', 
+    '接續': '接續',
     '感': '感嘆', 
+    '感嘆': '感嘆',
     '助詞': '助詞', 
     '助動詞': '助動詞', 
     '接尾': '接尾', 
@@ -67,9 +73,14 @@ POS_INHERITANCE_RULES = {
 
 # --- OpenCC 初始化 (繁簡轉換) ---
 
-def initialize_opencc():
-    """初始化 OpenCC 轉換器 (s2t)"""
+@functools.lru_cache(maxsize=None)
+def get_s2t_converter():
+    """
+    OpenCC 轉換器 (s2t)：第一筆資料需要轉換時才匯入並載入字典 (約數十毫秒)，
+    --help 或只被其他模組匯入時不必付出這個成本。失敗時返回 None (說明保留原文)，同一行程只嘗試一次。
+    """
     try:
+        from opencc import OpenCC
         # 使用 's2t' (Simplified Chinese to Traditional Chinese)
         print("💡 嘗試初始化 OpenCC 繁簡轉換器...")
         return OpenCC('s2t')
@@ -78,9 +89,6 @@ def initialize_opencc():
         print(f"錯誤詳情: {e}")
         return None
 
-# 初始化 OpenCC 轉換器，並將實例儲存為全域變數
-s2t_converter = initialize_opencc() 
-
 # -------------------------------
 
 
@@ -176,126 +184,183 @@ def map_pos_codes(anki_pos_raw):
 
 # --- 核心匯入函數 (import_anki_data) ---
 
-def import_anki_data(filepath):
-    if not os.path.exists(filepath):
-        print(f"❌ 檔案未找到：{filepath}")
-        return
+def category_name_from_path(filepath):
+    """以檔名 (不含副檔名) 作為分類名稱。"""
+    category_name = os.path.splitext(os.path.basename(filepath))[0]
+    return category_name or "Imported Vocab"
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    base_name = os.path.basename(filepath)
-    category_name = os.path.splitext(base_name)[0]
+def normalize_record(term_raw, pos_raw, reading_raw, explanation_raw, example_raw):
+    """
+    將一筆 Anki 資料正規化為 (term, pos_list, explanation, example_sentence)。
+    TSV 與 .apkg 匯入共用；缺少單字或解釋時返回 None。
+    """
+    term_raw = term_raw.strip()
+    explanation_raw = explanation_raw.strip()
+    if not term_raw or not explanation_raw:
+        return None
     
-    if not category_name:
-        category_name = "Imported Vocab"
-
-    category_id = get_or_create_category(conn, category_name)
-    print(f"使用的分類名稱：【{category_name}】，分類 ID：{category_id}")
+    # --- 數據清理與正規化 (修改區) ---
     
-    i = 0
+    # 1. 先取得純淨的單字 (移除原始可能存在的 [...])
+    term_cleaned = re.sub(r'\[.+?\]', '', term_raw).strip() 
+    
+    # 2. 取得讀音
+    reading_raw = reading_raw.strip()
+    
+    # 3. 智能組裝 Term + [Reading]
+    # 過濾掉：讀音為空、讀音與單字相同(純假名)、讀音是詞源說明(以左括號開頭)
+    if reading_raw and reading_raw != term_cleaned and not reading_raw.startswith('('):
+        term = f"{term_cleaned}[{reading_raw}]"
+    else:
+        term = term_cleaned
+    
+    # ----------------------------------
+    
+    pos_list_cleaned = map_pos_codes(pos_raw.strip()) 
+    
+    # 確保使用 s2t_converter 進行轉換
+    explanation_tc = explanation_raw
+    s2t_converter = get_s2t_converter()
+    if s2t_converter:
+        explanation_tc = s2t_converter.convert(explanation_raw)
+    
+    example_sentence = re.sub(r'\[.+?\]', '', example_raw.strip()).strip()
+    return term, pos_list_cleaned, explanation_tc, example_sentence
+
+
+def import_records(conn, category_name, records):
+    """
+    批次寫入單字 (單一交易，結束時一次更新衍生索引並 commit)。
+    records: 逐筆產生 (term_raw, pos_raw, reading_raw, explanation_raw, example_raw, tags) 的可迭代物件，
+    tags 為額外分類名稱的列表。
+    """
+    cursor = conn.cursor()
+    record_number = 0 # 已讀取的資料筆數：錯誤訊息以此指出出錯位置 (0 表示尚未讀取任何資料)
     vocab_imported_count = 0
     category_link_count = 0
     pos_link_count = 0
-    
-    # 🚨 使用全域 OpenCC 變數 (s2t_converter)
-    global s2t_converter
+    imported_vocab_ids = []
+    tag_category_ids = {}
     
+    try:
+        category_id = get_or_create_category(conn, category_name)
+        print(f"使用的分類名稱：【{category_name}】，分類 ID：{category_id}")
+        
+        for record_number, record in enumerate(records, start=1):
+            *fields, tags = record
+            normalized = normalize_record(*fields)
+            if not normalized:
+                continue 
+            term, pos_list_cleaned, explanation_tc, example_sentence = normalized
+            
+            # 1. 插入到 vocab_table
+            cursor.execute("""
+                INSERT INTO vocab_table (term, explanation, example_sentence)
+                VALUES (?, ?, ?)
+            """, (term, explanation_tc, example_sentence)) # 注意這裡使用的是修正後的 term
+            
+            vocab_id = cursor.lastrowid 
+            vocab_imported_count += 1
+            imported_vocab_ids.append(vocab_id)
+            
+            # 2. 插入到 item_category_table (連結分類)
+            cursor.execute("""
+                INSERT INTO item_category_table (item_id, category_id, item_type)
+                VALUES (?, ?, ?)
+            """, (vocab_id, category_id, 'vocab'))
+            category_link_count += 1
+            
+            for tag in set(tags or []):
+                if tag not in tag_category_ids:
+                    # 不呼叫 get_or_create_category，避免在匯入途中 commit
+                    cursor.execute("INSERT OR IGNORE INTO category_table (name) VALUES (?)", (tag,))
+                    cursor.execute("SELECT id FROM category_table WHERE name = ?", (tag,))
+                    tag_category_ids[tag] = cursor.fetchone()[0]
+                tag_category_id = tag_category_ids[tag]
+                if tag_category_id != category_id:
+                    cursor.execute("""
+                        INSERT OR IGNORE INTO item_category_table (item_id, category_id, item_type)
+                        VALUES (?, ?, ?)
+                    """, (vocab_id, tag_category_id, 'vocab'))
+                    category_link_count += cursor.rowcount
+            
+            # 3. 處理詞性連結表 (item_pos_table)
+            for pos_abbr in pos_list_cleaned:
+                pos_id = get_or_create_pos(pos_abbr, conn) 
+                if pos_id:
+                    try:
+                        cursor.execute(
+                            'INSERT INTO item_pos_table (item_id, pos_id) VALUES (?, ?)',
+                            (vocab_id, pos_id)
+                        )
+                        pos_link_count += 1
+                    except sqlite3.IntegrityError:
+                        pass
+            
+        # 4. 批次更新純文字欄位、詞性排序鍵 (pos_sort_key)、讀音/trigram 索引、例句反向索引與文法句型索引
+        item_index.refresh_plain_text(conn, 'vocab', imported_vocab_ids)
+        item_index.refresh_pos_sort_keys(conn, imported_vocab_ids)
+        item_index.refresh_term_index(conn, 'vocab', imported_vocab_ids)
+        example_index.link_new_vocab(conn, imported_vocab_ids)
+        grammar_pattern.GrammarMatcher().refresh_sources(conn, 'vocab', imported_vocab_ids)
+        
+        conn.commit()
+        print("\n----------------------------------------------")
+        print(f"✅ 檔案【{category_name}】匯入成功！")
+        print(f"   -> 匯入單字總數: {vocab_imported_count} 筆")
+        print(f"   -> 分類連結數: {category_link_count} 筆")
+        print(f"   -> 詞性連結數: {pos_link_count} 筆") 
+        print("----------------------------------------------")
+        return vocab_imported_count
+            
+    except Exception as e:
+        print(f"\n❌ 匯入檔案【{category_name}】過程中發生錯誤 (已讀取 {record_number} 筆): {e}")
+        conn.rollback()
+        return 0
+
+
+def _iter_tsv_records(reader, tags_col):
+    """依固定欄位位置 (row[1], row[3], row[4], row[5], row[10]) 讀取 Anki 匯出的 TSV。"""
+    for row in reader:
+        if not row or len(row) < 15: 
+            continue
+        tags = row[tags_col].split() if tags_col is not None and tags_col < len(row) else []
+        yield row[1], row[3], row[4], row[5], row[10], tags
+
+
+def import_anki_data(filepath):
+    if not os.path.exists(filepath):
+        print(f"❌ 檔案未找到：{filepath}")
+        return
+
+    conn = get_db_connection()
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             reader = csv.reader(f, delimiter='\t')
             
             # 跳過 Anki 導出的前兩行 (通常是標籤或卡片名稱)
+            # 若標頭帶有 `#tags column:N` (Anki / export_data 匯出)，該欄的標籤也會建立為分類
+            tags_col = None
             for _ in range(2): 
-                try: next(reader) 
+                try: header = next(reader) 
                 except StopIteration: return
+                tags_match = re.match(r'#tags column:(\d+)', header[0] if header else '')
+                if tags_match:
+                    tags_col = int(tags_match.group(1)) - 1
 
-            for i, row in enumerate(reader):
-                if not row or len(row) < 15: 
-                    continue
-                
-                term_raw = row[1].strip()       
-                pos_raw = row[3].strip()        
-                explanation_raw = row[5].strip() 
-                example_raw = row[10].strip()    
-                
-                if not term_raw or not explanation_raw:
-                    continue 
-                
-                # --- 數據清理與正規化 (修改區) ---
-                
-                # 1. 先取得純淨的單字 (移除原始可能存在的 [...])
-                term_cleaned = re.sub(r'\[.+?\]', '', term_raw).strip() 
-                
-                # 2. 取得讀音 (New-N5.txt 中讀音在 index 4)
-                reading_raw = row[4].strip()
-                
-                # 3. 智能組裝 Term + [Reading]
-                # 過濾掉：讀音為空、讀音與單字相同(純假名)、讀音是詞源說明(以左括號開頭)
-                if reading_raw and reading_raw != term_cleaned and not reading_raw.startswith('('):
-                    term = f"{term_cleaned}[{reading_raw}]"
-                else:
-                    term = term_cleaned
-                
-                # ----------------------------------
-                
-                pos_list_cleaned = map_pos_codes(pos_raw) 
-                
-                # 確保使用 s2t_converter 進行轉換
-                explanation_tc = explanation_raw
-                if s2t_converter:
-                    explanation_tc = s2t_converter.convert(explanation_raw)
-                
-                example_sentence = re.sub(r'\[.+?\]', '', example_raw).strip()
-                
-                # 1. 插入到 vocab_table
-                cursor.execute("""
-                    INSERT INTO vocab_table (term, explanation, example_sentence)
-                    VALUES (?, ?, ?)
-                """, (term, explanation_tc, example_sentence)) # 注意這裡使用的是修正後的 term
-                
-                vocab_id = cursor.lastrowid 
-                vocab_imported_count += 1
-                
-                # 2. 插入到 item_category_table (連結分類)
-                cursor.execute("""
-                    INSERT INTO item_category_table (item_id, category_id, item_type)
-                    VALUES (?, ?, ?)
-                """, (vocab_id, category_id, 'vocab'))
-                category_link_count += 1
-                
-                # 3. 處理詞性連結表 (item_pos_table)
-                for pos_abbr in pos_list_cleaned:
-                    pos_id = get_or_create_pos(pos_abbr, conn) 
-                    if pos_id:
-                        try:
-                            cursor.execute(
-                                'INSERT INTO item_pos_table (item_id, pos_id) VALUES (?, ?)',
-                                (vocab_id, pos_id)
-                            )
-                            pos_link_count += 1
-                        except sqlite3.IntegrityError:
-                            pass
-                
-            conn.commit()
-            print("\n----------------------------------------------")
-            print(f"✅ 檔案【{category_name}】匯入成功！")
-            print(f"   -> 匯入單字總數: {vocab_imported_count} 筆")
-            print(f"   -> 分類連結數: {category_link_count} 筆")
-            print(f"   -> 詞性連結數: {pos_link_count} 筆") 
-            print("----------------------------------------------")
-            
-    except Exception as e:
-        print(f"\n❌ 匯入檔案【{category_name}】過程中發生錯誤 (第 {i+1} 行): {e}")
-        conn.rollback()
+            import_records(conn, category_name_from_path(filepath), _iter_tsv_records(reader, tags_col))
     finally:
         conn.close()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='匯入 Anki 匯出的 TSV 文字檔 (檔名即分類名稱)；未指定檔案時互動輸入路徑')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
     
-    if len(sys.argv) > 1:
-        anki_filepaths = sys.argv[1:] 
+    if args.files:
+        anki_filepaths = args.files
         
         print(f"\n檢測到 {len(anki_filepaths)} 個檔案，將依序匯入到 {DB_NAME}...")
         
@@ -0,0 +1,143 @@
+# import_apkg.py
+# 直接讀取 Anki 的 .apkg / collection.anki2 (SQLite)，依筆記類型的欄位名稱對應後匯入
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+from import_anki_data import get_db_connection, import_records, category_name_from_path
+
+# .apkg 內的資料庫檔名 (新版優先)；collection.anki21b 為 zstd 壓縮格式，不支援
+COLLECTION_NAMES = ('collection.anki21', 'collection.anki2')
+FIELD_SEPARATOR = '\x1f'
+
+# 欄位名稱對應 (不分大小寫，依序比對第一個符合的欄位)
+FIELD_NAME_CANDIDATES = {
+    'term': ['expression', 'vocab', 'vocabulary', 'word', 'term', 'kanji', '單字', '単語', 'front'],
+    'pos': ['part of speech', 'pos', 'type', '詞性', '品詞'],
+    'reading': ['reading', 'kana', 'furigana', '讀音', '読み'],
+    'explanation': ['meaning', 'definition', 'english', 'chinese', 'translation', '解釋', '意味', 'back'],
+    'example': ['sentence', 'example', 'example sentence', '例句', '例文'],
+}
+# 找不到欄位名稱時，退回 import_anki_data 的 TSV 欄位位置 (需有 11 個以上欄位)
+FIELD_POSITION_FALLBACK = {'term': 1, 'pos': 3, 'reading': 4, 'explanation': 5, 'example': 10}
+
+
+def _load_note_type_fields(anki_conn):
+    """返回 {note_type_id: [欄位名稱 (依 ord 排序)]}，同時支援舊版 col.models JSON 與新版 fields 表。"""
+    tables = {row[0] for row in anki_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    note_types = {}
+    if 'fields' in tables:
+        for ntid, name in anki_conn.execute('SELECT ntid, name FROM fields ORDER BY ntid, ord'):
+            note_types.setdefault(ntid, []).append(name)
+    if not note_types:
+        models_json = anki_conn.execute('SELECT models FROM col').fetchone()[0]
+        for mid, model in (json.loads(models_json) if models_json else {}).items():
+            fields = sorted(model.get('flds', []), key=lambda f: f.get('ord', 0))
+            note_types[int(mid)] = [f['name'] for f in fields]
+    return note_types
+
+
+def resolve_field_map(field_names, overrides=None):
+    """
+    依欄位名稱決定 term/pos/reading/explanation/example 的欄位索引。
+    overrides: {'term': '欄位名稱'} 形式的手動指定；無法決定 term 或 explanation 時返回 None。
+    """
+    lowered = [name.strip().lower() for name in field_names]
+    field_map = {}
+    for key, candidates in FIELD_NAME_CANDIDATES.items():
+        wanted = [overrides[key].lower()] if overrides and key in overrides else candidates
+        field_map[key] = next((lowered.index(c) for c in wanted if c in lowered), None)
+
+    if field_map['term'] is None or field_map['explanation'] is None:
+        if len(field_names) <= max(FIELD_POSITION_FALLBACK.values()):
+            return None
+        field_map = dict(FIELD_POSITION_FALLBACK)
+    return field_map
+
+
+def iter_apkg_records(anki_conn, overrides=None):
+    """以 SQL 游標逐筆讀取 notes，轉為 import_records 使用的 tuple。"""
+    note_types = _load_note_type_fields(anki_conn)
+    field_maps = {mid: resolve_field_map(names, overrides) for mid, names in note_types.items()}
+    skipped_types = {mid for mid, field_map in field_maps.items() if field_map is None}
+    for mid in skipped_types:
+        print(f"   [INFO] 筆記類型 {mid} 的欄位 {note_types[mid]} 無法對應單字/解釋，略過")
+
+    for mid, flds, tags in anki_conn.execute('SELECT mid, flds, tags FROM notes ORDER BY id'):
+        field_map = field_maps.get(mid)
+        if not field_map:
+            continue
+        values = flds.split(FIELD_SEPARATOR)
+
+        def field(key):
+            index = field_map.get(key)
+            return values[index] if index is not None and index < len(values) else ''
+
+        yield field('term'), field('pos'), field('reading'), field('explanation'), field('example'), tags.split()
+
+
+def _extract_collection(apkg_path, target_dir):
+    """從 .apkg (zip) 解出 collection 資料庫，返回解出的路徑。"""
+    with zipfile.ZipFile(apkg_path) as archive:
+        names = set(archive.namelist())
+        for name in COLLECTION_NAMES:
+            if name in names:
+                target = os.path.join(target_dir, name)
+                with archive.open(name) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                return target
+        if 'collection.anki21b' in names:
+            raise ValueError('此 .apkg 使用新版壓縮格式 (collection.anki21b)，請在 Anki 匯出時勾選「支援舊版 Anki」')
+    raise ValueError('.apkg 中找不到 collection.anki2')
+
+
+def import_apkg(filepath, overrides=None):
+    """匯入本機的 .apkg 或 collection.anki2 檔案，分類名稱為檔名。"""
+    if not os.path.isfile(filepath):
+        print(f"❌ 檔案未找到：{filepath}")
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            collection_path = _extract_collection(filepath, tmp_dir) if zipfile.is_zipfile(filepath) else filepath
+        except (ValueError, zipfile.BadZipFile) as e:
+            print(f"❌ 無法讀取 {filepath}: {e}")
+            return 0
+
+        anki_conn = sqlite3.connect(collection_path) # 只讀取，不會寫入 Anki 的資料庫
+        conn = get_db_connection()
+        try:
+            return import_records(conn, category_name_from_path(filepath), iter_apkg_records(anki_conn, overrides))
+        finally:
+            conn.close()
+            anki_conn.close()
+
+
+def _parse_field_overrides(pairs):
+    overrides = {}
+    for pair in pairs or []:
+        key, _, name = pair.partition('=')
+        if key not in FIELD_NAME_CANDIDATES or not name:
+            raise argparse.ArgumentTypeError(f'無效的欄位對應: {pair}')
+        overrides[key] = name
+    return overrides
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='直接匯入 Anki .apkg / collection.anki2')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--field', action='append', metavar='KEY=欄位名稱',
+                        help='手動指定欄位對應，例如 --field term=Expression (KEY: term/pos/reading/explanation/example)')
+    args = parser.parse_args()
+    try:
+        field_overrides = _parse_field_overrides(args.field)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    for apkg_path in args.files:
+        import_apkg(apkg_path, field_overrides)
+    print("\n🎉 所有檔案匯入完成！")
@@ -0,0 +1,354 @@
+# item_index.py
+# 項目衍生欄位/索引的維護工具 (app.py 與 import_anki_data.py 共用，不依賴 Flask)
+import html
+import math
+import re
+import unicodedata
+
+import text_codec
+
+CHUNK_SIZE = 500 # IN (...) 參數的分批大小，避免超過 SQLite 參數上限
+
+# 詞性排序鍵：依 pos_master_table 的 id 順序串接詞性名稱 (例如: '名,動')，無詞性則為 NULL
+POS_SORT_KEY_SUBQUERY = '''
+    (SELECT GROUP_CONCAT(name) FROM (
+        SELECT M.name FROM item_pos_table AS P
+        JOIN pos_master_table AS M ON P.pos_id = M.id
+        WHERE P.item_id = vocab_table.id
+        ORDER BY P.pos_id
+    ))
+'''
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# ----------------- 詞性排序鍵 (pos_sort_key) -----------------
+def refresh_pos_sort_keys(conn, item_ids):
+    """重新計算指定單字的 pos_sort_key (寫入詞性連結後呼叫)。"""
+    cursor = conn.cursor()
+    for chunk in _chunks(set(item_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(
+            f'UPDATE vocab_table SET pos_sort_key = {POS_SORT_KEY_SUBQUERY} WHERE id IN ({placeholders})',
+            chunk
+        )
+
+
+def backfill_pos_sort_keys(conn):
+    """為所有單字重建 pos_sort_key (資料庫升級時使用)。"""
+    conn.execute(f'UPDATE vocab_table SET pos_sort_key = {POS_SORT_KEY_SUBQUERY}')
+
+
+# ----------------- 文字正規化工具 -----------------
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+# 區塊標籤與 <br> 代表換行，以空白取代；行內標籤 (b/i/u/span/font/ruby 等) 常出現在單字中間，直接移除
+HTML_BLOCK_TAG_RE = re.compile(
+    r'</?(?:br|p|div|li|ul|ol|h[1-6]|blockquote|pre|hr|table|thead|tbody|tr|td|th)\b[^>]*>', re.IGNORECASE)
+# 振り仮名的讀音 (<rt>) 與括號 (<rp>) 不屬於表記本身
+RUBY_ANNOTATION_RE = re.compile(r'<(rt|rp)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+BRACKET_RE = re.compile(r'\[(.+?)\]')
+
+
+def strip_html(text):
+    """移除 Quill 產生的 HTML 標籤並還原實體字元，返回純文字 (<b>食</b>べる -> 食べる)。"""
+    if not text:
+        return ""
+    text = RUBY_ANNOTATION_RE.sub('', text)
+    text = HTML_BLOCK_TAG_RE.sub(' ', text)
+    text = HTML_TAG_RE.sub('', text)
+    text = html.unescape(text)
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def to_hiragana(text):
+    """片假名轉平假名 (與 app._convert_kana 使用相同的 Unicode 偏移)。"""
+    return text.translate(_KATAKANA_TO_HIRAGANA)
+
+
+def split_term(term, item_type='vocab'):
+    """
+    將 `單字[讀音]` 格式拆為 (表記, 讀音)。
+    - 單字：表記為移除 [..] 後的文字，讀音為括號內容；純假名單字的讀音即為表記本身。
+    - 文法：[..] 標註的是核心文法，以核心文法作為表記與讀音。
+    """
+    plain = strip_html(term)
+    readings = [r.strip() for r in BRACKET_RE.findall(plain) if r.strip()]
+    if item_type == 'grammar':
+        surface = " ".join(readings) if readings else plain
+    else:
+        surface = BRACKET_RE.sub('', plain).strip()
+    reading = " ".join(readings)
+    if not reading and all(_is_kana(ch) or not ch.strip() for ch in surface):
+        reading = surface
+    return surface, to_hiragana(reading)
+
+
+def _is_kana(ch):
+    return 0x3041 <= ord(ch) <= 0x3096 or 0x30A1 <= ord(ch) <= 0x30FC
+
+
+def is_kanji(ch):
+    """CJK 統一漢字 (含擴充 A 區與相容漢字)。"""
+    code = ord(ch)
+    return 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0xF900 <= code <= 0xFAFF
+
+
+def extract_kanji(surface):
+    """返回表記中出現的漢字集合 (不含讀音與說明)。"""
+    return {ch for ch in surface if is_kanji(ch)}
+
+
+# ----------------- 純文字影子欄位 (搜尋用) -----------------
+PLAIN_TEXT_COLUMNS = (('term', 'term_plain'), ('explanation', 'explanation_plain'), ('example_sentence', 'example_plain'))
+
+
+def _plain_text_set_clause(conn):
+    """註冊 SQL 函數 plain_text()，讓影子欄位可以用單一 UPDATE 批次寫入 (壓縮過的欄位先解壓縮)。"""
+    text_codec.load_dictionaries(conn)
+    conn.create_function('plain_text', 1, lambda value: strip_html(text_codec.unpack(conn, value)), deterministic=True)
+    return ", ".join(f"{plain} = plain_text({source})" for source, plain in PLAIN_TEXT_COLUMNS)
+
+
+def refresh_plain_text(conn, item_type, item_ids):
+    """寫入時擷取 term/explanation/example_sentence 的純文字 (去除 Quill HTML 並 NFKC 正規化)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    set_clause = _plain_text_set_clause(conn)
+    for chunk in _chunks(set(item_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f'UPDATE {table_name} SET {set_clause} WHERE id IN ({placeholders})', chunk)
+
+
+def backfill_plain_text(conn, item_type):
+    """為既有資料回填純文字影子欄位 (資料庫升級時使用)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    conn.execute(f'UPDATE {table_name} SET {_plain_text_set_clause(conn)}')
+
+
+# ----------------- 羅馬拼音 (平文式) -----------------
+_ROMAJI_DIGRAPHS = {
+    'きゃ': 'kya', 'きゅ': 'kyu', 'きょ': 'kyo', 'しゃ': 'sha', 'しゅ': 'shu', 'しょ': 'sho',
+    'ちゃ': 'cha', 'ちゅ': 'chu', 'ちょ': 'cho', 'にゃ': 'nya', 'にゅ': 'nyu', 'にょ': 'nyo',
+    'ひゃ': 'hya', 'ひゅ': 'hyu', 'ひょ': 'hyo', 'みゃ': 'mya', 'みゅ': 'myu', 'みょ': 'myo',
+    'りゃ': 'rya', 'りゅ': 'ryu', 'りょ': 'ryo', 'ぎゃ': 'gya', 'ぎゅ': 'gyu', 'ぎょ': 'gyo',
+    'じゃ': 'ja', 'じゅ': 'ju', 'じょ': 'jo', 'ぢゃ': 'ja', 'ぢゅ': 'ju', 'ぢょ': 'jo',
+    'びゃ': 'bya', 'びゅ': 'byu', 'びょ': 'byo', 'ぴゃ': 'pya', 'ぴゅ': 'pyu', 'ぴょ': 'pyo',
+    'しぇ': 'she', 'ちぇ': 'che', 'じぇ': 'je', 'てぃ': 'ti', 'でぃ': 'di', 'とぅ': 'tu',
+    'ふぁ': 'fa', 'ふぃ': 'fi', 'ふぇ': 'fe', 'ふぉ': 'fo', 'うぃ': 'wi', 'うぇ': 'we', 'うぉ': 'wo',
+    'ゔぁ': 'va', 'ゔぃ': 'vi', 'ゔぇ': 've', 'ゔぉ': 'vo',
+}
+_ROMAJI_MONOGRAPHS = dict(zip(
+    'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわゐゑをん'
+    'がぎぐげござじずぜぞだぢづでどばびぶべぼぱぴぷぺぽぁぃぅぇぉゃゅょゎゔ',
+    ['a', 'i', 'u', 'e', 'o', 'ka', 'ki', 'ku', 'ke', 'ko', 'sa', 'shi', 'su', 'se', 'so',
+     'ta', 'chi', 'tsu', 'te', 'to', 'na', 'ni', 'nu', 'ne', 'no', 'ha', 'hi', 'fu', 'he', 'ho',
+     'ma', 'mi', 'mu', 'me', 'mo', 'ya', 'yu', 'yo', 'ra', 'ri', 'ru', 're', 'ro', 'wa', 'i', 'e', 'o', 'n',
+     'ga', 'gi', 'gu', 'ge', 'go', 'za', 'ji', 'zu', 'ze', 'zo', 'da', 'ji', 'zu', 'de', 'do',
+     'ba', 'bi', 'bu', 'be', 'bo', 'pa', 'pi', 'pu', 'pe', 'po', 'a', 'i', 'u', 'e', 'o', 'ya', 'yu', 'yo', 'wa', 'vu']
+))
+
+
+def to_romaji(text):
+    """平假名/片假名轉羅馬拼音 (處理拗音、促音「っ」與長音「ー」)，其他字元保留。"""
+    text = to_hiragana(text or "")
+    result = []
+    i = 0
+    double_next = False
+    while i < len(text):
+        pair = text[i:i + 2]
+        if pair in _ROMAJI_DIGRAPHS:
+            roman = _ROMAJI_DIGRAPHS[pair]
+            i += 2
+        elif text[i] == 'っ':
+            double_next = True
+            i += 1
+            continue
+        elif text[i] == 'ー':
+            # 長音：重複前一個母音
+            roman = next((c for c in reversed("".join(result)) if c in 'aeiou'), '')
+            i += 1
+        else:
+            roman = _ROMAJI_MONOGRAPHS.get(text[i], text[i])
+            i += 1
+        if double_next and roman and roman[0].isalpha() and roman[0] not in 'aeiou':
+            roman = ('t' if roman.startswith('ch') else roman[0]) + roman
+        double_next = False
+        result.append(roman)
+    return "".join(result).lower()
+
+
+# ----------------- Trigram 索引 -----------------
+TRIGRAM_MIN_SIMILARITY = 0.3
+TRIGRAM_CANDIDATE_LIMIT = 100
+
+
+def trigrams(text):
+    """以 pg_trgm 相同的方式切出 trigram：每個詞前補兩個空白、後補一個空白。"""
+    grams = set()
+    for word in text.lower().split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def _is_ascii_gram(gram):
+    return gram.isascii()
+
+
+def term_trigrams(surface, reading, romaji):
+    """返回 (假名/漢字 trigram 集合, 羅馬拼音 trigram 集合)。"""
+    kana_grams = {g for g in trigrams(to_hiragana(surface)) | trigrams(reading) if not _is_ascii_gram(g)}
+    romaji_grams = {g for g in trigrams(romaji) if _is_ascii_gram(g)}
+    return kana_grams, romaji_grams
+
+
+def refresh_term_index(conn, item_type, item_ids):
+    """重新計算指定項目的讀音、羅馬拼音、trigram 與漢字索引 (新增/編輯/匯入後呼叫)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    cursor = conn.cursor()
+    for chunk in _chunks(set(item_ids)):
+        placeholders = ",".join("?" * len(chunk))
+        rows = cursor.execute(
+            f'SELECT id, term FROM {table_name} WHERE id IN ({placeholders})', chunk
+        ).fetchall()
+        _delete_term_index(cursor, item_type, chunk)
+        _insert_term_index(cursor, item_type, rows)
+
+
+def _insert_term_index(cursor, item_type, rows):
+    """rows: [(item_id, term)]"""
+    reading_rows = []
+    gram_rows = []
+    kanji_rows = []
+    for item_id, term in rows:
+        surface, reading = split_term(term, item_type)
+        romaji = to_romaji(reading or surface)
+        kana_grams, romaji_grams = term_trigrams(surface, reading, romaji)
+        reading_rows.append((item_id, item_type, surface, reading, romaji, len(kana_grams), len(romaji_grams)))
+        gram_rows.extend((g, item_type, item_id) for g in kana_grams | romaji_grams)
+        kanji_rows.extend((k, item_type, item_id) for k in extract_kanji(surface))
+
+    cursor.executemany('''
+        INSERT INTO term_reading_table (item_id, item_type, surface, reading_kana, romaji, kana_gram_count, romaji_gram_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', reading_rows)
+    cursor.executemany(
+        'INSERT OR IGNORE INTO trigram_index_table (trigram, item_type, item_id) VALUES (?, ?, ?)',
+        gram_rows
+    )
+    cursor.executemany(
+        'INSERT OR IGNORE INTO kanji_index_table (kanji, item_type, item_id) VALUES (?, ?, ?)',
+        kanji_rows
+    )
+
+
+def _delete_term_index(cursor, item_type, item_ids):
+    """
+    trigram 與漢字索引只有主鍵 (trigram/kanji, item_type, item_id)：由 term_reading_table 保存的表記、讀音與
+    羅馬拼音重新算出舊的 trigram 與漢字，逐筆以主鍵刪除，不需要另一個依項目排序的索引。
+    """
+    placeholders = ",".join("?" * len(item_ids))
+    gram_rows = []
+    kanji_rows = []
+    for item_id, surface, reading, romaji in cursor.execute(f'''
+        SELECT item_id, surface, reading_kana, romaji FROM term_reading_table
+        WHERE item_type = ? AND item_id IN ({placeholders})
+    ''', [item_type] + list(item_ids)).fetchall():
+        kana_grams, romaji_grams = term_trigrams(surface or '', reading or '', romaji or '')
+        gram_rows.extend((g, item_type, item_id) for g in kana_grams | romaji_grams)
+        kanji_rows.extend((k, item_type, item_id) for k in extract_kanji(surface or ''))
+    cursor.executemany('DELETE FROM trigram_index_table WHERE trigram = ? AND item_type = ? AND item_id = ?', gram_rows)
+    cursor.executemany('DELETE FROM kanji_index_table WHERE kanji = ? AND item_type = ? AND item_id = ?', kanji_rows)
+    cursor.execute(f'DELETE FROM term_reading_table WHERE item_type = ? AND item_id IN ({placeholders})',
+                   [item_type] + list(item_ids))
+
+
+def delete_term_index(conn, item_type, item_ids):
+    """刪除項目時移除其讀音、trigram 與漢字索引。"""
+    cursor = conn.cursor()
+    for chunk in _chunks(set(item_ids)):
+        _delete_term_index(cursor, item_type, chunk)
+
+
+def backfill_term_index(conn, item_type):
+    """為指定類型的所有項目重建讀音、trigram 與漢字索引 (資料庫升級時使用，先清除該類型的舊索引)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    cursor = conn.cursor()
+    for index_table in ('term_reading_table', 'trigram_index_table', 'kanji_index_table'):
+        cursor.execute(f'DELETE FROM {index_table} WHERE item_type = ?', (item_type,))
+    rows = cursor.execute(f'SELECT id, term FROM {table_name}').fetchall()
+    for start in range(0, len(rows), CHUNK_SIZE):
+        _insert_term_index(cursor, item_type, rows[start:start + CHUNK_SIZE])
+
+
+def backfill_kanji_index(conn, item_type):
+    """只重建指定類型的漢字索引 (資料庫升級時使用)。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    rows = []
+    for item_id, term in conn.execute(f'SELECT id, term FROM {table_name}'):
+        surface, _ = split_term(term, item_type)
+        rows.extend((k, item_type, item_id) for k in extract_kanji(surface))
+    conn.execute('DELETE FROM kanji_index_table WHERE item_type = ?', (item_type,))
+    conn.executemany('INSERT OR IGNORE INTO kanji_index_table (kanji, item_type, item_id) VALUES (?, ?, ?)', rows)
+
+
+def fuzzy_search(conn, item_type, query, limit=TRIGRAM_CANDIDATE_LIMIT, min_similarity=TRIGRAM_MIN_SIMILARITY):
+    """
+    以 trigram 索引做容錯搜尋，依 Jaccard 相似度排序。
+    - 英數查詢 (例如 'taberu') 比對羅馬拼音；其他查詢比對假名/漢字，假名查詢同時比對其羅馬拼音。
+    返回: [(item_id, similarity), ...]
+    """
+    query = unicodedata.normalize('NFKC', query or "").strip().lower()
+    if not query:
+        return []
+
+    if query.isascii():
+        kana_q, romaji_q = set(), {g for g in trigrams(query) if _is_ascii_gram(g)}
+    else:
+        folded = to_hiragana(query)
+        kana_q = {g for g in trigrams(folded) if not _is_ascii_gram(g)}
+        romaji = to_romaji(folded)
+        romaji_q = {g for g in trigrams(romaji) if _is_ascii_gram(g)} if romaji.isascii() else set()
+
+    scores = {}
+    for grams, count_column in ((kana_q, 'kana_gram_count'), (romaji_q, 'romaji_gram_count')):
+        if not grams:
+            continue
+        placeholders = ",".join("?" * len(grams))
+        # 相似度 >= min_similarity 的必要條件：共同 trigram 數 >= min_similarity * 查詢 trigram 數
+        min_shared = max(1, math.ceil(min_similarity * len(grams)))
+        # 每個 trigram 都是主鍵 (trigram, item_type, item_id) 上的一次範圍掃描
+        rows = conn.execute(f'''
+            SELECT G.item_id, COUNT(*) AS shared
+            FROM trigram_index_table AS G
+            WHERE G.trigram IN ({placeholders}) AND G.item_type = ?
+            GROUP BY G.item_id
+            HAVING COUNT(*) >= ?
+        ''', list(grams) + [item_type, min_shared]).fetchall()
+        if not rows:
+            continue
+        totals = {}
+        for chunk in _chunks([row[0] for row in rows]):
+            id_placeholders = ",".join("?" * len(chunk))
+            totals.update(conn.execute(f'''
+                SELECT item_id, {count_column} FROM term_reading_table
+                WHERE item_type = ? AND item_id IN ({id_placeholders})
+            ''', [item_type] + chunk).fetchall())
+        for item_id, shared in rows:
+            total = totals.get(item_id)
+            similarity = shared / (len(grams) + (total or 0) - shared)
+            if similarity > scores.get(item_id, 0):
+                scores[item_id] = similarity
+
+    ranked = sorted(
+        ((item_id, round(score, 4)) for item_id, score in scores.items() if score >= min_similarity),
+        key=lambda x: (-x[1], x[0])
+    )
+    return ranked[:limit]
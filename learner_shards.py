@@ -0,0 +1,175 @@
+# learner_shards.py
+# 多使用者模式：每位學習者一個 SQLite 檔案 (learners/<id>.db)，各自有寫入執行緒、讀取連線池與行程內快取，
+# 寫入鎖只在同一位學習者的請求之間競爭。開啟中的分片以 LRU 限制數量；新分片由共用的基礎題庫複製而來，
+# 結構遷移 (init_db) 在該分片第一次被使用時才執行，每個行程每個分片只執行一次
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+from change_log import ChangeFeed
+from example_index import ExampleLinker
+from fragment_cache import DataVersion, FragmentCache
+from grammar_pattern import GrammarMatcher
+from read_replica import ReadReplica, ReadConnectionPool
+from suggest_index import SuggestIndex
+from write_queue import WriteQueue
+
+LEARNER_DIR = 'learners'
+LEARNER_POOL_SIZE = 16 # 同時開啟的分片上限 (每個分片有一條寫入執行緒、數條讀取連線與記憶體索引)
+LEARNER_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}') # 學習者 ID 直接作為檔名，只允許安全字元
+LEARNER_ONLY_TABLES = ('card_state_table', 'review_log_table', 'change_log_table') # 複製基礎題庫後清空的個人資料
+
+
+def is_valid_learner_id(learner_id):
+    return bool(learner_id) and LEARNER_ID_PATTERN.fullmatch(learner_id) is not None
+
+
+def create_shard(base_deck, path):
+    """
+    以 backup API 從基礎題庫 (唯讀開啟) 複製出新的分片，並清空排程、複習紀錄與變更日誌。
+    先寫入暫存檔再 os.replace，中途失敗不會留下不完整的分片。基礎題庫不存在時建立空的分片。
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.part'
+    target = sqlite3.connect(temp_path)
+    try:
+        if base_deck and os.path.exists(base_deck):
+            source = sqlite3.connect(base_deck)
+            try:
+                source.execute('PRAGMA query_only = ON')
+                source.backup(target)
+            finally:
+                source.close()
+            existing = {row[0] for row in target.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table_name in LEARNER_ONLY_TABLES: # 依序刪除：排程刪除時觸發器寫入的日誌最後一併清除
+                if table_name in existing:
+                    target.execute(f'DELETE FROM {table_name}')
+            target.commit()
+    finally:
+        target.close()
+    os.replace(temp_path, path)
+
+
+class LearnerStore:
+    """一個資料庫檔案及其專屬的連線與行程內快取 (單人模式下只有一個，即 jp_db.db)。"""
+
+    def __init__(self, db_name, read_replica=False):
+        self.db_name = db_name
+        self.read_pool = ReadReplica(db_name) if read_replica else ReadConnectionPool(db_name)
+        self.write_queue = WriteQueue(db_name)
+        self.data_version = DataVersion(db_name)
+        self.fragment_cache = FragmentCache()
+        self.fragment_feed = ChangeFeed()
+        self.suggest_index = SuggestIndex()
+        self.suggest_feed = ChangeFeed()
+        self.example_linker = ExampleLinker()
+        self.grammar_matcher = GrammarMatcher()
+        # 例句連結與文法句型的快取在寫入工作中更新，工作被回滾時一併丟棄
+        self.write_queue.add_rollback_listener(self.example_linker.invalidate)
+        self.write_queue.add_rollback_listener(self.grammar_matcher.invalidate)
+        self.in_use = 0 # 使用中的請求數，大於 0 時不會被淘汰
+        self.prepare_lock = threading.Lock()
+
+    # 重複檢查與選擇題只有少數頁面使用，第一次使用時才載入模組並建立快取
+    @cached_property
+    def duplicate_finder(self):
+        from dedup import DuplicateFinder
+        return DuplicateFinder()
+
+    @cached_property
+    def distractors(self):
+        from distractor_index import DistractorIndex
+        return DistractorIndex()
+
+    def close(self):
+        """等待寫入佇列清空後關閉所有連線 (正在使用的讀取連線會在歸還時關閉)。"""
+        self.write_queue.stop()
+        self.read_pool.close()
+        self.data_version.close()
+
+
+class LearnerShardPool:
+    """
+    學習者 ID -> LearnerStore 的 LRU。acquire() 與 release() 成對呼叫 (每個請求一次)；
+    超過上限時淘汰最久未使用且沒有請求在使用的分片，全部都在使用中時暫時允許超過上限。
+    """
+
+    def __init__(self, base_deck, migrate, learner_dir=LEARNER_DIR, max_open=LEARNER_POOL_SIZE, read_replica=False):
+        self.base_deck = base_deck
+        self.migrate = migrate # migrate(db_name)：建立/升級資料表結構 (可重複執行)
+        self.learner_dir = learner_dir
+        self.max_open = max_open
+        self.read_replica = read_replica
+        self._lock = threading.Lock()
+        self._open = OrderedDict()
+        self._migrated = set() # 本行程已執行過遷移的分片 (淘汰後重新開啟不必再執行)
+        self.opened = 0
+        self.evicted = 0
+
+    def shard_path(self, learner_id):
+        return os.path.join(self.learner_dir, f'{learner_id}.db')
+
+    def acquire(self, learner_id):
+        if not is_valid_learner_id(learner_id):
+            raise ValueError(f'無效的學習者 ID: {learner_id!r}')
+        with self._lock:
+            store = self._open.get(learner_id)
+            if store is None:
+                store = LearnerStore(self.shard_path(learner_id), self.read_replica)
+                self._open[learner_id] = store
+                self.opened += 1
+            self._open.move_to_end(learner_id)
+            store.in_use += 1
+            evicted = self._evict_locked()
+        self._close_all(evicted)
+        try:
+            self._prepare(learner_id, store)
+        except Exception:
+            self.release(store)
+            raise
+        return store
+
+    def release(self, store):
+        with self._lock:
+            store.in_use -= 1
+            evicted = self._evict_locked()
+        self._close_all(evicted)
+
+    def _prepare(self, learner_id, store):
+        with store.prepare_lock:
+            if learner_id in self._migrated:
+                return
+            if not os.path.exists(store.db_name):
+                create_shard(self.base_deck, store.db_name)
+            self.migrate(store.db_name)
+            self._migrated.add(learner_id)
+
+    def _evict_locked(self):
+        evicted = []
+        for learner_id, store in list(self._open.items()):
+            if len(self._open) <= self.max_open:
+                break
+            if store.in_use == 0:
+                del self._open[learner_id]
+                evicted.append(store)
+        self.evicted += len(evicted)
+        return evicted
+
+    @staticmethod
+    def _close_all(stores):
+        # 在鎖外關閉：寫入佇列需等待尚未完成的工作
+        for store in stores:
+            store.close()
+
+    def status(self):
+        with self._lock:
+            return {
+                'open': len(self._open), # 不列出學習者 ID，狀態 API 不洩漏其他使用者
+                'in_use': sum(store.in_use for store in self._open.values()),
+                'max_open': self.max_open,
+                'opened': self.opened,
+                'evicted': self.evicted,
+            }
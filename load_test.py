@@ -0,0 +1,427 @@
+# load_test.py
+# 本機負載測試：以合成資料庫啟動應用程式 (多執行緒或多行程伺服器)，由多個虛擬使用者同時重播實際的學習流程
+# (列表篩選與翻頁、搜尋與自動完成、建立單字卡並自動播放、偶爾編輯)，報告吞吐量、各端點的 p50/p99 延遲
+# 與寫入鎖錯誤 (database is locked / 寫入佇列已滿)，用於比較不同的伺服器設定
+import argparse
+import contextlib
+import http.cookiejar
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import startup
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = 'jp_db.db' # 伺服器在工作目錄中使用的資料庫 (與 app.DB_NAME 相同)
+SYNTHETIC_ITEMS = 5000 # 合成資料庫的單字數 (文法為其十分之一)
+SYNTHETIC_SEED = 42
+LOAD_CATEGORIES = ('LT-N5', 'LT-N4', 'LT-N3', 'LT-N2', 'LT-N1')
+LOAD_TAG = 'LT-常用' # 部分單字額外加上的分類 (多重分類)
+POS_CODES = ('名', '名', '名', '自動1', '他動2', '自他動3', 'い形', 'な形', '副', '名・な形', '感')
+KANJI = '日月火水木金土山川田人口目耳手足力上下中大小本学生先年時間今分半何週毎前後午東西南北右左外国語話読書聞見行来出入休食飲買売立待持使作思知言会同'
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわんがぎぐげござじずぜぞだでどばびぶべぼ'
+GLOSSES = ('吃', '喝', '看', '寫', '學習', '老師', '學生', '時間', '今天', '明天', '朋友', '工作', '休息', '買', '賣',
+           '等待', '使用', '製作', '思考', '知道', '說話', '見面', '相同', '外國', '語言', '書本', '上面', '下面', '大的', '小的')
+GRAMMAR_ENDINGS = ('ことにする', 'ようになる', 'ばかりだ', 'わけではない', 'にちがいない', 'ことがある', 'つもりだ', 'はずだ')
+
+USERS = 8
+DURATION = 30 # 秒
+THINK_TIME = 0.0 # 每個請求之間的停頓秒數 (0 為盡量施壓)
+CARDS_PER_SESSION = 40 # 每次自動播放的卡片數
+BATCH_SIZE = 20 # 與 app.BATCH_SIZE 相同：每 BATCH_SIZE 張卡片載入一批
+FLOW_WEIGHTS = {'browse': 35, 'search': 25, 'study': 30, 'edit': 10} # 各流程的比例
+REQUEST_TIMEOUT = 60
+SERVER_READY_TIMEOUT = 30
+LOCK_ERROR_MARKERS = (b'database is locked', b'database table is locked', '寫入佇列已滿'.encode('utf-8'))
+
+
+# ----------------- 合成資料庫 -----------------
+
+def _random_word(rng):
+    surface = ''.join(rng.choice(KANJI) for _ in range(rng.randint(1, 2))) + rng.choice(('', '', 'る', 'い', 'する'))
+    reading = ''.join(rng.choice(KANA) for _ in range(rng.randint(2, 4)))
+    return surface, reading
+
+
+def _synthetic_vocab(rng, count):
+    """每個分類一組 import_records 的資料：{分類: [(term, pos, reading, explanation, example, tags)]}"""
+    records = {category: [] for category in LOAD_CATEGORIES}
+    for _ in range(count):
+        surface, reading = _random_word(rng)
+        explanation = '；'.join(rng.sample(GLOSSES, rng.randint(1, 3))) + f' ({rng.randint(1, 999)})'
+        tags = [LOAD_TAG] if rng.random() < 0.3 else []
+        records[rng.choice(LOAD_CATEGORIES)].append(
+            (surface, rng.choice(POS_CODES), reading, explanation, f'{surface}を使った例文です。', tags))
+    return records
+
+
+def build_synthetic_db(path, items=SYNTHETIC_ITEMS, seed=SYNTHETIC_SEED):
+    """建立合成資料庫：結構與應用程式相同，單字經由匯入腳本寫入 (含所有衍生索引)，最後重建預先計算的表。"""
+    sys.path.insert(0, APP_DIR)
+    import app
+    import example_index
+    import grammar_pattern
+    import import_anki_data
+    import item_index
+    import stats_cube
+
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()): # 匯入腳本每個分類都會輸出摘要
+        app.init_db(path)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for category, records in _synthetic_vocab(rng, items).items():
+                import_anki_data.import_records(conn, category, records)
+            grammar_ids = []
+            for _ in range(max(items // 10, 1)):
+                surface, _ = _random_word(rng)
+                cursor = conn.execute(
+                    'INSERT INTO grammar_table (term, explanation, example_sentence) VALUES (?, ?, ?)',
+                    (f'〜{rng.choice(GRAMMAR_ENDINGS)}', '；'.join(rng.sample(GLOSSES, 2)), f'{surface}ことにする。'))
+                grammar_ids.append(cursor.lastrowid)
+            category_id = import_anki_data.get_or_create_category(conn, LOAD_CATEGORIES[0])
+            conn.executemany('INSERT INTO item_category_table (item_id, category_id, item_type) VALUES (?, ?, ?)',
+                             [(grammar_id, category_id, 'grammar') for grammar_id in grammar_ids])
+            item_index.refresh_plain_text(conn, 'grammar', grammar_ids)
+            item_index.refresh_term_index(conn, 'grammar', grammar_ids)
+            example_index.rebuild_example_links(conn)
+            grammar_pattern.rebuild_grammar_matches(conn)
+            stats_cube.rebuild(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def load_targets(path):
+    """虛擬使用者需要的資料：分類、詞性、讀音與可編輯的單字 (id, term, 說明, 分類, 詞性)。"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        categories = [row[0] for row in conn.execute('SELECT name FROM category_table ORDER BY name')]
+        pos_names = [row[0] for row in conn.execute('SELECT DISTINCT P.name FROM pos_master_table AS P JOIN item_pos_table AS I ON I.pos_id = P.id')]
+        readings = [row[0] for row in conn.execute(
+            "SELECT reading_kana FROM term_reading_table WHERE item_type = 'vocab' AND reading_kana != '' LIMIT 2000")]
+        vocab = []
+        for item_id, term, explanation in conn.execute(
+                'SELECT id, term, explanation_plain FROM vocab_table ORDER BY random() LIMIT 500'):
+            item_categories = [row[0] for row in conn.execute('''
+                SELECT C.name FROM item_category_table AS L JOIN category_table AS C ON C.id = L.category_id
+                WHERE L.item_type = 'vocab' AND L.item_id = ?''', (item_id,))]
+            item_pos = [row[0] for row in conn.execute('''
+                SELECT P.name FROM item_pos_table AS L JOIN pos_master_table AS P ON P.id = L.pos_id
+                WHERE L.item_id = ?''', (item_id,))]
+            vocab.append((item_id, term, explanation or '', item_categories, item_pos))
+    finally:
+        conn.close()
+    return {'categories': categories, 'pos': pos_names, 'readings': readings or ['あ'], 'vocab': vocab}
+
+
+# ----------------- 伺服器 -----------------
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(server, port, workers):
+    """在目前目錄 (含 jp_db.db) 以指定設定啟動伺服器 (由 start_server 在子行程中呼叫)。"""
+    import logging
+    sys.path.insert(0, APP_DIR)
+    import app
+    from werkzeug.serving import run_simple
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # 每個請求一行的存取紀錄會拖慢伺服器
+    flask_app = app.create_app(start_background=False)
+    if server == 'processes':
+        # werkzeug 的多行程模式每個請求 fork 一個行程，各行程各自寫入，寫入鎖在行程之間競爭
+        run_simple('127.0.0.1', port, flask_app, threaded=False, processes=workers)
+    else:
+        run_simple('127.0.0.1', port, flask_app, threaded=True)
+
+
+def start_server(server, workdir, workers):
+    """啟動伺服器子行程並等待可以回應請求，返回 (Popen, base_url)。伺服器輸出寫入 workdir/server.log。"""
+    port = _free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'ab')
+    if server == 'gunicorn':
+        if shutil.which('gunicorn') is None:
+            raise RuntimeError("找不到 gunicorn，請先執行 'pip install gunicorn'")
+        command = ['gunicorn', '--chdir', workdir, '--pythonpath', APP_DIR, '-b', f'127.0.0.1:{port}',
+                   '-w', str(workers), '--threads', '4', 'app:create_app(start_background=False)']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', server, '--port', str(port), '--workers', str(workers)]
+    process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + SERVER_READY_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'伺服器啟動失敗，請查看 {os.path.join(workdir, "server.log")}')
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=1).close()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('等待伺服器啟動逾時')
+
+
+# ----------------- 虛擬使用者 -----------------
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """不跟隨重新導向：編輯成功的 302 本身就是結果，只量測該請求。"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    """所有虛擬使用者共用的請求紀錄：{端點: [延遲秒數]}、錯誤數與寫入鎖錯誤數。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.lock_errors = {}
+
+    def record(self, name, seconds, ok, locked):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if locked:
+                self.lock_errors[name] = self.lock_errors.get(name, 0) + 1
+
+
+class VirtualUser(threading.Thread):
+    """一位學習者：各自的 cookie (Flask session 保存單字卡進度)，依 FLOW_WEIGHTS 隨機選擇流程直到時間結束。"""
+
+    def __init__(self, user_id, base_url, targets, recorder, deadline, think_time, cards_per_session):
+        super().__init__(name=f'vu-{user_id}', daemon=True)
+        self.base_url = base_url
+        self.targets = targets
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time = think_time
+        self.cards_per_session = cards_per_session
+        self.rng = random.Random(user_id)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, name, path, params=None, json_body=None, form=None):
+        """送出請求並記錄延遲；返回 (狀態碼, 內容)。2xx/3xx 為成功，內容含寫入鎖訊息時另計為鎖錯誤。"""
+        url = self.base_url + path + ('?' + urllib.parse.urlencode(params) if params else '')
+        data, headers = None, {}
+        if json_body is not None:
+            data, headers = json.dumps(json_body).encode('utf-8'), {'Content-Type': 'application/json'}
+        elif form is not None:
+            data = urllib.parse.urlencode(form, doseq=True).encode('utf-8')
+        start = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(url, data=data, headers=headers), timeout=REQUEST_TIMEOUT) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            status, body = 0, str(e).encode('utf-8')
+        elapsed = time.perf_counter() - start
+        locked = any(marker in body for marker in LOCK_ERROR_MARKERS)
+        self.recorder.record(name, elapsed, 200 <= status < 400 and not locked, locked)
+        if self.think_time:
+            time.sleep(self.think_time)
+        return status, body
+
+    def run(self):
+        flows = list(FLOW_WEIGHTS)
+        weights = [FLOW_WEIGHTS[flow] for flow in flows]
+        while time.time() < self.deadline:
+            getattr(self, f'flow_{self.rng.choices(flows, weights)[0]}')()
+
+    def flow_browse(self):
+        """列表頁：以分類/詞性篩選後翻幾頁，偶爾換排序或看文法列表。"""
+        params = {'category': self.rng.choice(self.targets['categories'])}
+        if self.targets['pos'] and self.rng.random() < 0.5:
+            params['pos'] = self.rng.choice(self.targets['pos'])
+        if self.rng.random() < 0.3:
+            params.update(sort_by=self.rng.choice(('term', 'pos')), sort_order=self.rng.choice(('asc', 'desc')))
+        for page in range(1, self.rng.randint(2, 4)):
+            self.request('GET /list/vocab (篩選)', '/list/vocab', dict(params, page=page))
+        if self.rng.random() < 0.2:
+            self.request('GET /list/grammar', '/list/grammar')
+
+    def flow_search(self):
+        """邊輸入邊自動完成，再以完整讀音搜尋列表，偶爾使用容錯搜尋。"""
+        reading = self.rng.choice(self.targets['readings'])
+        for length in range(1, min(len(reading), 3) + 1):
+            self.request('GET /api/suggest', '/api/suggest', {'q': reading[:length]})
+        self.request('GET /list/vocab (搜尋)', '/list/vocab', {'search': reading})
+        if self.rng.random() < 0.3:
+            self.request('GET /api/fuzzy_search', '/api/fuzzy_search', {'q': reading})
+
+    def flow_study(self):
+        """建立單字卡 (依分類)，開啟單字卡頁後自動播放：每 BATCH_SIZE 張載入一批，每張卡片回報進度。"""
+        filters = {'data_type': 'vocab', 'category_filter': self.rng.choice(self.targets['categories']), 'pos_filter': 'all'}
+        status, body = self.request('POST /flashcard/data', '/flashcard/data', json_body=filters)
+        try:
+            count = json.loads(body).get('count', 0) if status == 200 else 0
+        except ValueError:
+            count = 0
+        if not count:
+            return
+        start_mode = 'quiz' if self.rng.random() < 0.2 else 'normal'
+        self.request('GET /flashcard/deck', '/flashcard/deck', {'start_mode': start_mode})
+        for index in range(min(count, self.cards_per_session)):
+            if time.time() >= self.deadline:
+                return
+            if index % BATCH_SIZE == 0:
+                self.request(f'GET /api/get_flashcard ({start_mode})', f'/api/get_flashcard/{index}')
+            self.request('POST /api/update_index', '/api/update_index', json_body={'index': index})
+
+    def flow_edit(self):
+        """開啟編輯頁後送出 (只改說明，分類與詞性維持原樣)。"""
+        if not self.targets['vocab']:
+            return
+        item_id, term, explanation, categories, pos = self.rng.choice(self.targets['vocab'])
+        self.request('GET /edit/vocab', f'/edit/vocab/{item_id}')
+        form = {'term': term, 'explanation': f'{explanation} ({self.rng.randint(1, 9999)})', 'example_sentence': '',
+                'selected_categories': categories, 'selected_pos': pos}
+        self.request('POST /edit/vocab', f'/edit/vocab/{item_id}', form=form)
+
+
+# ----------------- 報告 -----------------
+
+def _percentile(sorted_values, fraction):
+    """最近排名法的百分位數 (sorted_values 需已排序且不為空)。"""
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder, elapsed, config):
+    endpoints = []
+    all_latencies = []
+    for name, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        all_latencies.extend(latencies)
+        endpoints.append({
+            'endpoint': name,
+            'requests': len(latencies),
+            'errors': recorder.errors.get(name, 0),
+            'lock_errors': recorder.lock_errors.get(name, 0),
+            'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1),
+        })
+    all_latencies.sort()
+    total = len(all_latencies)
+    return {
+        'config': config,
+        'elapsed_s': round(elapsed, 2),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'errors': sum(recorder.errors.values()),
+        'lock_errors': sum(recorder.lock_errors.values()),
+        'p50_ms': round(_percentile(all_latencies, 0.5) * 1000, 1) if total else None,
+        'p99_ms': round(_percentile(all_latencies, 0.99) * 1000, 1) if total else None,
+        'endpoints': endpoints,
+    }
+
+
+def print_summary(summary):
+    config = summary['config']
+    print(f"\n📈 負載測試結果 (伺服器: {config['server']}，虛擬使用者: {config['users']}，{summary['elapsed_s']} 秒)")
+    print(f"   請求數: {summary['requests']}，吞吐量: {summary['throughput_rps']} req/s，"
+          f"p50: {summary['p50_ms']} ms，p99: {summary['p99_ms']} ms")
+    print(f"   錯誤: {summary['errors']}，寫入鎖錯誤: {summary['lock_errors']}")
+    print(f"\n   {startup._pad('端點', 40)}{'請求':>5}{'錯誤':>4}{'鎖':>4}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint in summary['endpoints']:
+        print(f"   {startup._pad(endpoint['endpoint'], 40)}{endpoint['requests']:>7}{endpoint['errors']:>6}{endpoint['lock_errors']:>5}"
+              f"{endpoint['p50_ms']:>9}{endpoint['p99_ms']:>9}{endpoint['max_ms']:>9}")
+
+
+def run_load(base_url, targets, users, duration, think_time, cards_per_session):
+    recorder = Recorder()
+    start = time.time()
+    deadline = start + duration
+    virtual_users = [VirtualUser(i, base_url, targets, recorder, deadline, think_time, cards_per_session)
+                     for i in range(users)]
+    for user in virtual_users:
+        user.start()
+    for user in virtual_users:
+        user.join()
+    return recorder, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本機負載測試：多個虛擬使用者同時重播學習流程')
+    parser.add_argument('--server', choices=('threads', 'processes', 'gunicorn'), default='threads',
+                        help='伺服器設定：werkzeug 多執行緒、werkzeug 多行程 (每個請求 fork) 或 gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='processes 的最大行程數 / gunicorn 的 worker 數')
+    parser.add_argument('--users', type=int, default=USERS)
+    parser.add_argument('--duration', type=float, default=DURATION, help='秒')
+    parser.add_argument('--think-time', type=float, default=THINK_TIME, help='每個請求之間的停頓秒數')
+    parser.add_argument('--cards', type=int, default=CARDS_PER_SESSION, help='每次自動播放的卡片數')
+    parser.add_argument('--items', type=int, default=SYNTHETIC_ITEMS, help='合成資料庫的單字數')
+    parser.add_argument('--workdir', help='放置合成資料庫的目錄 (已有 jp_db.db 時直接使用；未指定時使用暫存目錄並在結束後刪除)')
+    parser.add_argument('--url', help='測試已在執行中的伺服器 (不啟動伺服器)，需以 --db 指定它使用的資料庫')
+    parser.add_argument('--db', help='搭配 --url：讀取分類、讀音與可編輯項目的資料庫 (唯讀開啟)')
+    parser.add_argument('--json', dest='json_path', help='另將結果寫入 JSON 檔，方便比較不同設定')
+    parser.add_argument('--serve', choices=('threads', 'processes'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    process = None
+    workdir = args.workdir or tempfile.mkdtemp(prefix='jp_load_')
+    try:
+        if args.url:
+            if not args.db:
+                parser.error('--url 需要以 --db 指定伺服器使用的資料庫')
+            base_url, db_path = args.url.rstrip('/'), args.db
+        else:
+            os.makedirs(workdir, exist_ok=True)
+            db_path = os.path.join(workdir, DB_FILE)
+            if not os.path.exists(db_path):
+                print(f"🧪 建立合成資料庫 ({args.items} 個單字) ...")
+                start = time.time()
+                build_synthetic_db(db_path, args.items)
+                print(f"   完成，耗時 {time.time() - start:.1f} 秒 ({db_path})")
+            process, base_url = start_server(args.server, workdir, args.workers)
+        targets = load_targets(db_path)
+        print(f"🚀 {args.users} 個虛擬使用者，持續 {args.duration:g} 秒 ({base_url}) ...")
+        recorder, elapsed = run_load(base_url, targets, args.users, args.duration, args.think_time, args.cards)
+    except (RuntimeError, sqlite3.Error) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        if not args.workdir and not args.url:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {'server': 'external' if args.url else args.server, 'workers': args.workers, 'users': args.users,
+              'think_time': args.think_time, 'items': args.items}
+    summary = summarize(recorder, elapsed, config)
+    print_summary(summary)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
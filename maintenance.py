@@ -0,0 +1,222 @@
+# maintenance.py
+# 背景維護：閒置時清除過期的變更日誌、執行 incremental vacuum (歸還刪除資料後的空頁)、統計資料過期時 ANALYZE、定期 PRAGMA optimize
+# 每項工作都有時間預算，遇到使用者正在寫入 (資料庫鎖定) 時直接放棄，下次閒置再試
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import change_log
+
+DB_NAME = 'jp_db.db'
+AUTO_VACUUM_INCREMENTAL = 2 # PRAGMA auto_vacuum 的回傳值: 0=NONE, 1=FULL, 2=INCREMENTAL
+MAINTENANCE_TICK = 60 # 每隔幾秒檢查一次是否閒置
+MAINTENANCE_IDLE_SECONDS = 120 # 最後一個請求之後多久視為閒置
+MAINTENANCE_BUSY_TIMEOUT = 1 # 維護連線等待鎖定的秒數 (不跟使用者搶寫入)
+VACUUM_BUDGET = 0.5 # 每次 incremental vacuum 的時間預算 (秒)
+VACUUM_STEP_PAGES = 128 # 每一步歸還的頁數 (每一步是獨立的交易)
+VACUUM_MIN_FREE_PAGES = 64 # 空頁少於此數量時不處理
+ANALYZE_LIMIT = 1000 # PRAGMA analysis_limit：每個索引最多抽樣的列數，限制 ANALYZE 的時間
+ANALYZE_DRIFT_RATIO = 0.2 # 資料表列數與 sqlite_stat1 的紀錄相差超過 20% 時重新 ANALYZE
+ANALYZE_DRIFT_MIN_ROWS = 200 # 相差的列數也需超過此值 (小表的波動不處理)；上次檢查後的變更日誌少於此筆數時不計算列數
+OPTIMIZE_INTERVAL = 6 * 3600 # PRAGMA optimize 的間隔 (秒)
+TASKS = ('changelog', 'vacuum', 'analyze', 'optimize')
+
+
+def ensure_incremental_auto_vacuum(conn):
+    """
+    遷移：將資料庫切換為 auto_vacuum=INCREMENTAL。既有資料庫需要一次完整 VACUUM 才會生效，
+    之後刪除資料留下的空頁就能由 incremental_vacuum 分段歸還，不必再手動 VACUUM。返回是否有執行遷移。
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return False
+    conn.commit() # VACUUM 不能在交易中執行
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+def database_stats(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'file_size': page_size * page_count,
+        'free_bytes': page_size * freelist_count,
+        'auto_vacuum': conn.execute('PRAGMA auto_vacuum').fetchone()[0],
+    }
+
+
+def incremental_vacuum(conn, budget=VACUUM_BUDGET):
+    """在時間預算內分段歸還空頁，返回歸還的頁數。conn 需為 autocommit (isolation_level=None)。"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if before < VACUUM_MIN_FREE_PAGES:
+        return 0
+    deadline = time.monotonic() + budget
+    remaining = before
+    while remaining and time.monotonic() < deadline:
+        conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+        remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return before - remaining
+
+
+def stale_tables(conn):
+    """返回列數與 sqlite_stat1 紀錄偏離過多的資料表；尚未 ANALYZE 過時返回 None (表示全部)。"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        return None
+    recorded = {}
+    for table_name, stat in conn.execute('SELECT tbl, stat FROM sqlite_stat1'):
+        recorded.setdefault(table_name, int(stat.split()[0]))
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    stale = []
+    for table_name in tables:
+        actual = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        expected = recorded.get(table_name, 0)
+        drift = abs(actual - expected)
+        if drift >= ANALYZE_DRIFT_MIN_ROWS and drift > ANALYZE_DRIFT_RATIO * max(expected, 1):
+            stale.append(table_name)
+    return stale
+
+
+def analyze_stale(conn):
+    """大量匯入/刪除後重新收集統計資料 (analysis_limit 限制抽樣量)，返回處理的資料表。"""
+    stale = stale_tables(conn)
+    conn.execute(f'PRAGMA analysis_limit = {ANALYZE_LIMIT}')
+    if stale is None:
+        conn.execute('ANALYZE')
+        return ['*']
+    for table_name in stale:
+        conn.execute(f'ANALYZE "{table_name}"')
+    return stale
+
+
+def optimize(conn):
+    conn.execute(f'PRAGMA analysis_limit = {ANALYZE_LIMIT}')
+    conn.execute('PRAGMA optimize').fetchall()
+    return True
+
+
+class MaintenanceScheduler:
+    """行程內的背景維護執行緒；app 每個請求呼叫 note_activity()，閒置一段時間後才執行維護。"""
+
+    def __init__(self, db_name=DB_NAME, tick=MAINTENANCE_TICK, idle_seconds=MAINTENANCE_IDLE_SECONDS):
+        self.db_name = db_name
+        self.tick = tick
+        self.idle_seconds = idle_seconds
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock() # 避免背景執行緒與手動觸發同時執行
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_optimize = 0
+        self._analyzed_version = None # 上次檢查統計資料時的變更日誌版本
+        self.last_runs = {} # task -> {'at', 'duration', 'result'} 或 {'at', 'error'}
+
+    def note_activity(self):
+        self._last_activity = time.monotonic()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            if time.monotonic() - self._last_activity >= self.idle_seconds:
+                self.run_once()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_name, timeout=MAINTENANCE_BUSY_TIMEOUT, isolation_level=None)
+
+    def _record(self, task, func, conn):
+        """執行單一工作並記錄結果；返回 False 表示資料庫忙碌，本輪其餘工作也不再執行。"""
+        start = time.monotonic()
+        try:
+            result = func(conn)
+        except sqlite3.OperationalError as e: # 使用者正在寫入等，下次閒置再試
+            self.last_runs[task] = {'at': datetime.now().isoformat(timespec='seconds'), 'error': str(e)}
+            return False
+        self.last_runs[task] = {'at': datetime.now().isoformat(timespec='seconds'),
+                                'duration': round(time.monotonic() - start, 3), 'result': result}
+        return True
+
+    def _analyze(self, conn):
+        """
+        閒置時每輪都會呼叫：上次檢查之後的變更日誌少於 ANALYZE_DRIFT_MIN_ROWS 筆時，沒有資料表的列數可能偏離那麼多，
+        直接跳過，不必對每個資料表執行 COUNT(*)。
+        """
+        version = change_log.current_version(conn)
+        if self._analyzed_version is not None and 0 <= version - self._analyzed_version < ANALYZE_DRIFT_MIN_ROWS:
+            return []
+        result = analyze_stale(conn)
+        self._analyzed_version = version
+        return result
+
+    def run_once(self, tasks=TASKS, force=False):
+        """執行一輪維護；optimize 除非 force，否則依 OPTIMIZE_INTERVAL 間隔執行。"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            conn = self._connect()
+            try:
+                if 'changelog' in tasks and not self._record('changelog', change_log.prune_change_log, conn):
+                    return
+                if 'vacuum' in tasks and not self._record('vacuum', incremental_vacuum, conn):
+                    return
+                if 'analyze' in tasks and not self._record('analyze', self._analyze, conn):
+                    return
+                if 'optimize' in tasks and (force or time.monotonic() - self._last_optimize >= OPTIMIZE_INTERVAL):
+                    if self._record('optimize', optimize, conn):
+                        self._last_optimize = time.monotonic()
+            finally:
+                conn.close()
+        finally:
+            self._lock.release()
+
+    def status(self):
+        conn = self._connect()
+        try:
+            stats = database_stats(conn)
+        finally:
+            conn.close()
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        stats['idle_seconds'] = round(time.monotonic() - self._last_activity, 1)
+        stats['last_runs'] = self.last_runs
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='資料庫維護 (清除過期變更日誌 / incremental vacuum / ANALYZE / PRAGMA optimize)')
+    parser.add_argument('tasks', nargs='*', choices=TASKS + ('status',), default=list(TASKS))
+    parser.add_argument('--db', default=DB_NAME)
+    args = parser.parse_args(argv)
+
+    scheduler = MaintenanceScheduler(args.db)
+    tasks = [task for task in args.tasks if task != 'status']
+    if tasks:
+        conn = sqlite3.connect(args.db)
+        try:
+            if ensure_incremental_auto_vacuum(conn):
+                print("🔧 已將資料庫切換為 auto_vacuum=INCREMENTAL")
+        finally:
+            conn.close()
+        scheduler.run_once(tasks, force=True)
+    for key, value in scheduler.status().items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+# read_replica.py
+# 唯讀連線池：連線 (與其 prepared statement 快取) 跨請求重複使用
+# 記憶體唯讀副本：以 backup API 將 jp_db.db 複製到記憶體後 serialize 成映像檔，讀取連線以 deserialize 載入，
+# 每次取得連線前檢查 PRAGMA data_version，磁碟資料被任何連線 (含其他行程) 修改過就重新複製；
+# 複製在連線池的鎖之外進行，完成後才替換映像檔，連續寫入時每 REPLICA_MIN_REFRESH_INTERVAL 秒最多複製一次
+import sqlite3
+import threading
+import time
+
+DB_NAME = 'jp_db.db'
+READ_POOL_SIZE = 8 # 保留的閒置讀取連線數
+REPLICA_POOL_SIZE = 4 # 保留的閒置副本連線數 (每條連線各有一份記憶體中的資料庫)
+CACHED_STATEMENTS = 512 # 每條連線的 prepared statement 快取數 (sqlite3 預設 128)
+REPLICA_MIN_REFRESH_INTERVAL = 0.5 # 兩次複製之間的最短間隔 (秒)，期間的讀取使用稍舊的副本
+
+
+class PooledConnection(sqlite3.Connection):
+    """連線池中的連線；close() 會歸還連線池而不是真的關閉，呼叫端可沿用 conn.close() 的寫法。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.generation = -1
+
+    def close(self):
+        if self.pool is not None:
+            self.pool._release(self)
+        else:
+            super().close()
+
+
+class ReadConnectionPool:
+    """
+    磁碟資料庫的唯讀連線池 (連線設為 query_only，誤寫會直接報錯)。
+    連線不會長時間開著讀取交易 (SELECT 不會自動 BEGIN)，每次查詢都看得到最新 commit 的資料。
+    """
+
+    def __init__(self, db_name=DB_NAME, pool_size=READ_POOL_SIZE):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+
+    def _new_connection(self, database):
+        conn = sqlite3.connect(database, factory=PooledConnection, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.pool = self
+        return conn
+
+    def connect(self):
+        """取得讀取連線 (row_factory 為 sqlite3.Row，與 get_db_connection 相同)。"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._new_connection(self.db_name)
+            conn.execute('PRAGMA query_only = ON')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reusable(self, conn):
+        return True
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed and self._reusable(conn) and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close(self):
+        """關閉閒置連線；之後歸還的連線也直接關閉。"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+
+class ReadReplica(ReadConnectionPool):
+    """
+    寫入一律走磁碟上的資料庫；副本只負責讀取。
+    監看連線本身不寫入，因此任何其他連線 commit 後它讀到的 data_version 都會改變。
+    同一時間只有一個執行緒複製映像檔；其他執行緒不等待，繼續使用目前的映像檔 (第一次建立時除外)。
+    """
+
+    def __init__(self, db_name=DB_NAME, pool_size=REPLICA_POOL_SIZE):
+        super().__init__(db_name, pool_size)
+        self._refresh_lock = threading.Lock() # 保護監看連線與複製；self._lock 只保護映像檔的替換與閒置連線
+        self._watch = None
+        self._data_version = None
+        self._image = None
+        self._refreshed_at = None
+        self.generation = 0
+        self.refresh_count = 0
+        self.last_refresh_seconds = None
+
+    def _refresh(self, force):
+        """需要時重新複製映像檔；force=False 時若其他執行緒正在複製或距離上次複製太近，直接沿用目前的映像檔。"""
+        if not self._refresh_lock.acquire(blocking=force or self._image is None):
+            return
+        try:
+            if self._watch is None:
+                self._watch = sqlite3.connect(self.db_name, check_same_thread=False)
+            version = self._watch.execute('PRAGMA data_version').fetchone()[0]
+            if self._image is not None and version == self._data_version:
+                return
+            if (not force and self._image is not None
+                    and time.monotonic() - self._refreshed_at < REPLICA_MIN_REFRESH_INTERVAL):
+                return # 版本不變，下次取得連線時再複製
+            # 先記下版本再複製：複製期間若有新的 commit，下次檢查會再刷新一次，不會漏掉
+            start = time.monotonic()
+            memory = sqlite3.connect(':memory:')
+            try:
+                self._watch.backup(memory)
+                image = memory.serialize()
+            finally:
+                memory.close()
+            with self._lock:
+                self._image = image
+                self._data_version = version
+                self.generation += 1
+            self._refreshed_at = time.monotonic()
+            self.refresh_count += 1
+            self.last_refresh_seconds = self._refreshed_at - start
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self):
+        """立即檢查並刷新映像檔 (啟動時呼叫，第一個請求就不需要等待複製)。"""
+        self._refresh(force=True)
+
+    def connect(self):
+        self._refresh(force=False)
+        with self._lock:
+            image, generation = self._image, self.generation
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._new_connection(':memory:')
+        if conn.generation != generation:
+            conn.deserialize(image)
+            conn.execute('PRAGMA query_only = ON')
+            conn.generation = generation
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reusable(self, conn):
+        # 已過期的副本不再保留，下次直接建立新的連線
+        return conn.generation == self.generation
+
+    def close(self):
+        super().close()
+        with self._refresh_lock, self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+            self._image = None
+
+    def status(self):
+        with self._lock:
+            return {
+                'generation': self.generation,
+                'refresh_count': self.refresh_count,
+                'image_bytes': len(self._image) if self._image is not None else 0,
+                'idle_connections': len(self._idle),
+                'last_refresh_seconds': self.last_refresh_seconds,
+            }
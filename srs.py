@@ -0,0 +1,297 @@
+# srs.py
+# 間隔重複 (Spaced Repetition) 排程器：SM-2 演算法 + 以索引排序的到期佇列
+import time
+
+# SM-2 預設參數
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+RELEARN_DELAY_SECONDS = 10 * 60 # 答錯後 10 分鐘再出現
+DAY_SECONDS = 24 * 60 * 60
+NEW_CARDS_PER_DAY = 20 # 每種類型每天開放的新卡片數 (開始複習時才依 ID 順序建立排程狀態，不會一次全部到期)
+
+# 前端按鈕對應的 SM-2 品質分數 (0~5)
+GRADE_AGAIN = 1
+GRADE_HARD = 3
+GRADE_GOOD = 4
+GRADE_EASY = 5
+VALID_GRADES = {GRADE_AGAIN, GRADE_HARD, GRADE_GOOD, GRADE_EASY}
+
+ITEM_TYPES = ('grammar', 'vocab') # 依字母排序，與佇列排序 (due_at, item_type, item_id) 一致
+DELETE_CHUNK_SIZE = 500 # 批次刪除時 IN (...) 的分批大小
+
+
+def now_ts():
+    return int(time.time())
+
+
+def schedule(state, grade, reviewed_at):
+    """
+    依 SM-2 計算下一次複習時間。
+    state: dict (interval_days, ease, reps, lapses)；返回新的 state dict (含 due_at)。
+    """
+    interval = state.get('interval_days') or 0
+    ease = state.get('ease') or DEFAULT_EASE
+    reps = state.get('reps') or 0
+    lapses = state.get('lapses') or 0
+
+    if grade < 3:
+        # 答錯：重新學習，短時間內再出現
+        reps = 0
+        lapses += 1
+        interval = 0
+        due_at = reviewed_at + RELEARN_DELAY_SECONDS
+    else:
+        reps += 1
+        if reps == 1:
+            interval = 1
+        elif reps == 2:
+            interval = 6
+        else:
+            interval = round(interval * ease, 2)
+        due_at = reviewed_at + int(interval * DAY_SECONDS)
+
+    # 難易度係數 (答錯也會下降)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+
+    return {
+        'interval_days': interval,
+        'ease': round(ease, 4),
+        'reps': reps,
+        'lapses': lapses,
+        'due_at': due_at,
+        'last_review_at': reviewed_at,
+    }
+
+
+# ----------------- 佇列篩選條件 -----------------
+def _filter_clauses(item_type, category_filter, pos_filter):
+    """
+    建立以 EXISTS 表示的篩選條件，讓查詢沿著到期索引走，每筆候選只做索引查找。
+    返回: (WHERE 片段列表, 參數列表)
+    """
+    clauses = []
+    params = []
+
+    if category_filter and category_filter != 'all':
+        if category_filter == '__uncategorized__':
+            clauses.append("""NOT EXISTS (
+                SELECT 1 FROM item_category_table AS C
+                WHERE C.item_id = S.item_id AND C.item_type = S.item_type)""")
+        else:
+            clauses.append("""EXISTS (
+                SELECT 1 FROM item_category_table AS C
+                JOIN category_table AS K ON C.category_id = K.id
+                WHERE C.item_id = S.item_id AND C.item_type = S.item_type AND K.name = ?)""")
+            params.append(category_filter)
+
+    if item_type == 'vocab' and pos_filter and pos_filter != 'all':
+        pos_abbr = pos_filter.split(' ')[0].strip()
+        clauses.append("""EXISTS (
+            SELECT 1 FROM item_pos_table AS P
+            JOIN pos_master_table AS M ON P.pos_id = M.id
+            WHERE P.item_id = S.item_id AND M.name = ?)""")
+        params.append(pos_abbr)
+
+    return clauses, params
+
+
+def _cursor_clause(item_type, cursor):
+    """
+    將 (due_at, item_type, item_id) 的游標轉為單一類型分支可用的範圍條件，
+    使 (item_type, due_at, item_id) 索引可以直接從游標位置往後掃描。
+    """
+    if not cursor:
+        return "", []
+    c_due, c_type, c_id = cursor
+    if item_type > c_type:
+        return " AND S.due_at >= ?", [c_due]
+    if item_type == c_type:
+        return " AND (S.due_at, S.item_id) > (?, ?)", [c_due, c_id]
+    return " AND S.due_at > ?", [c_due]
+
+
+def _types_for(data_type):
+    if data_type in ITEM_TYPES:
+        return [data_type]
+    return list(ITEM_TYPES)
+
+
+# ----------------- 佇列查詢 -----------------
+def seed_card_states(conn, data_type, now=None, per_day=NEW_CARDS_PER_DAY):
+    """
+    開放今天的新卡片：每種類型 24 小時內最多開放 per_day 張 (尚未複習過的卡片 + 24 小時內第一次複習的卡片)，
+    不足的部分依 ID 順序為尚未有排程狀態的項目建立狀態並立即到期。其餘項目等之後的工作階段才建立，
+    第一次使用時不必為整個題庫寫入狀態與變更日誌。返回建立的卡片數。
+    """
+    now = now or now_ts()
+    since = now - DAY_SECONDS
+    cursor = conn.cursor()
+    seeded = 0
+    for item_type in _types_for(data_type):
+        table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+        introduced = cursor.execute('''
+            SELECT COUNT(*) FROM card_state_table AS S
+            WHERE S.item_type = ? AND (S.last_review_at IS NULL OR (S.last_review_at >= ? AND NOT EXISTS (
+                SELECT 1 FROM review_log_table AS R
+                WHERE R.item_type = S.item_type AND R.item_id = S.item_id AND R.reviewed_at < ?)))
+        ''', (item_type, since, since)).fetchone()[0]
+        if introduced >= per_day:
+            continue
+        new_ids = [row[0] for row in cursor.execute(f'''
+            SELECT T1.id FROM {table_name} AS T1
+            WHERE NOT EXISTS (SELECT 1 FROM card_state_table AS S WHERE S.item_type = ? AND S.item_id = T1.id)
+            ORDER BY T1.id
+            LIMIT ?
+        ''', (item_type, per_day - introduced))]
+        cursor.executemany('''
+            INSERT OR IGNORE INTO card_state_table (item_id, item_type, due_at, interval_days, ease, reps, lapses)
+            VALUES (?, ?, ?, 0, ?, 0, 0)
+        ''', [(item_id, item_type, now, DEFAULT_EASE) for item_id in new_ids])
+        seeded += len(new_ids)
+    return seeded
+
+
+def stagger_new_cards(conn, now=None, per_day=NEW_CARDS_PER_DAY):
+    """
+    遷移：舊版本把所有新卡片設為立即到期；將尚未複習過的卡片依 ID 順序重新分散為每天 per_day 張。
+    返回重新排程的卡片數。
+    """
+    now = now or now_ts()
+    rows = []
+    for item_type in ITEM_TYPES:
+        ids = [row[0] for row in conn.execute(
+            'SELECT item_id FROM card_state_table WHERE item_type = ? AND last_review_at IS NULL ORDER BY item_id',
+            (item_type,))]
+        rows.extend((now + (k // per_day) * DAY_SECONDS, item_type, item_id) for k, item_id in enumerate(ids))
+    conn.executemany('UPDATE card_state_table SET due_at = ? WHERE item_type = ? AND item_id = ?', rows)
+    return len(rows)
+
+
+def count_due_cards(conn, data_type, category_filter, pos_filter, now=None):
+    """計算目前篩選條件下已到期的卡片數。"""
+    now = now or now_ts()
+    total = 0
+    for item_type in _types_for(data_type):
+        clauses, params = _filter_clauses(item_type, category_filter, pos_filter)
+        where_sql = "".join(f" AND {c}" for c in clauses)
+        row = conn.execute(
+            f"SELECT COUNT(*) FROM card_state_table AS S WHERE S.item_type = ? AND S.due_at <= ?{where_sql}",
+            [item_type, now] + params
+        ).fetchone()
+        total += row[0]
+    return total
+
+
+def get_due_cards(conn, data_type, category_filter, pos_filter, limit, cursor=None, now=None):
+    """
+    取得下一批已到期的卡片 (依 due_at, item_type, item_id 排序)。
+    cursor 為上一批最後一張卡片的 (due_at, item_type, item_id)，用於 keyset 分頁。
+    """
+    now = now or now_ts()
+    branches = []
+    params = []
+
+    for item_type in _types_for(data_type):
+        table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+        clauses, filter_params = _filter_clauses(item_type, category_filter, pos_filter)
+        cursor_sql, cursor_params = _cursor_clause(item_type, cursor)
+        where_sql = "".join(f" AND {c}" for c in clauses)
+
+        # 每個分支各自沿 (item_type, due_at, item_id) 索引掃描，並以 LIMIT 限制範圍
+        branches.append(f'''
+            SELECT * FROM (
+                SELECT S.item_id AS id, S.item_type AS type, S.due_at, S.interval_days, S.reps,
+                       T1.term, '' AS reading, T1.explanation, T1.example_sentence
+                FROM card_state_table AS S
+                JOIN {table_name} AS T1 ON T1.id = S.item_id
+                WHERE S.item_type = ? AND S.due_at <= ?{cursor_sql}{where_sql}
+                ORDER BY S.due_at, S.item_id
+                LIMIT ?
+            )
+        ''')
+        params.extend([item_type, now] + cursor_params + filter_params + [limit])
+
+    query = " UNION ALL ".join(branches) + " ORDER BY due_at, type, id LIMIT ?"
+    params.append(limit)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+# ----------------- 批次評分 -----------------
+def apply_grades(conn, grades, now=None):
+    """
+    批次寫入評分結果：一次讀取所有相關狀態，計算後以 executemany 寫回。
+    grades: [{'id': int, 'type': 'vocab'|'grammar', 'grade': int, 'reviewed_at': int(可省略)}]
+    返回: 成功處理的筆數
+    """
+    now = now or now_ts()
+    valid = []
+    for g in grades:
+        try:
+            item_id = int(g['id'])
+            grade = int(g['grade'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        item_type = g.get('type')
+        if item_type not in ITEM_TYPES or grade not in VALID_GRADES:
+            continue
+        reviewed_at = g.get('reviewed_at')
+        reviewed_at = int(reviewed_at) if isinstance(reviewed_at, (int, float)) and 0 < reviewed_at <= now else now
+        valid.append((item_id, item_type, grade, reviewed_at))
+
+    if not valid:
+        return 0
+
+    # 1. 一次讀取所有卡片的目前狀態
+    states = {}
+    for item_type in ITEM_TYPES:
+        ids = list({v[0] for v in valid if v[1] == item_type})
+        if not ids:
+            continue
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(f'''
+            SELECT item_id, item_type, interval_days, ease, reps, lapses FROM card_state_table
+            WHERE item_type = ? AND item_id IN ({placeholders})
+        ''', [item_type] + ids).fetchall()
+        for row in rows:
+            states[(row['item_id'], row['item_type'])] = dict(row)
+
+    # 2. 依時間順序計算新狀態 (同一張卡片在同一批內評分多次時依序累積)
+    log_rows = []
+    for item_id, item_type, grade, reviewed_at in sorted(valid, key=lambda v: v[3]):
+        key = (item_id, item_type)
+        new_state = schedule(states.get(key, {}), grade, reviewed_at)
+        states[key] = new_state
+        log_rows.append((item_id, item_type, grade, reviewed_at, new_state['interval_days'], new_state['ease']))
+
+    state_rows = [
+        (item_id, item_type, s['due_at'], s['interval_days'], s['ease'], s['reps'], s['lapses'], s['last_review_at'])
+        for (item_id, item_type), s in states.items() if 'due_at' in s
+    ]
+
+    # 3. 批次寫入
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO card_state_table (item_id, item_type, due_at, interval_days, ease, reps, lapses, last_review_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(item_type, item_id) DO UPDATE SET
+            due_at = excluded.due_at, interval_days = excluded.interval_days, ease = excluded.ease,
+            reps = excluded.reps, lapses = excluded.lapses, last_review_at = excluded.last_review_at
+    ''', state_rows)
+    cursor.executemany('''
+        INSERT INTO review_log_table (item_id, item_type, grade, reviewed_at, interval_days, ease)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', log_rows)
+
+    return len(log_rows)
+
+
+def delete_card_states(conn, item_type, item_ids):
+    """刪除項目時一併移除排程狀態與複習紀錄。"""
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), DELETE_CHUNK_SIZE):
+        chunk = item_ids[start:start + DELETE_CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f'DELETE FROM card_state_table WHERE item_type = ? AND item_id IN ({placeholders})',
+                     [item_type] + chunk)
+        conn.execute(f'DELETE FROM review_log_table WHERE item_type = ? AND item_id IN ({placeholders})',
+                     [item_type] + chunk)
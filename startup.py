@@ -0,0 +1,117 @@
+# startup.py
+# 啟動流程：資料表結構的版本記錄在 PRAGMA user_version，每個行程對每個資料庫只讀取一次版本號，
+# 版本過舊時才執行遷移 (init_db)，之後的檢查只是一次集合查詢；另提供 --profile-startup 的耗時報告
+# (各模組的 import 時間由子行程的 python -X importtime 量測，不受本行程已載入的模組影響)
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+IMPORT_REPORT_LIMIT = 12 # 報告中列出的 import 項目數 (依累計時間)
+
+
+def read_user_version(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+class SchemaGate:
+    """
+    每個資料庫在本行程只檢查一次結構版本。migrate(db_name) 的每個步驟都需可重複執行，並在全部完成後
+    最後才寫入 PRAGMA user_version = version (中途失敗時版本維持舊值，下次重新執行)；
+    其他資料庫 (學習者分片) 的檢查不會被正在遷移的資料庫擋住。
+    """
+
+    def __init__(self, version, migrate):
+        self.version = version
+        self.migrate = migrate
+        self._lock = threading.Lock()
+        self._db_locks = {}
+        self._checked = set()
+        self.migrated = 0
+
+    def ensure(self, db_name):
+        """返回本次呼叫是否為本行程第一次檢查此資料庫 (版本過舊時已執行遷移)。"""
+        if db_name in self._checked:
+            return False
+        with self._lock:
+            db_lock = self._db_locks.setdefault(db_name, threading.Lock())
+        with db_lock:
+            if db_name in self._checked:
+                return False
+            if read_user_version(db_name) < self.version:
+                self.migrate(db_name)
+                self.migrated += 1
+            self._checked.add(db_name)
+            return True
+
+
+class StartupProfiler:
+    """記錄啟動各階段的耗時：with profiler.phase('名稱'): ..."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+
+def import_costs(module_name, cwd=None, limit=IMPORT_REPORT_LIMIT):
+    """
+    在子行程以 -X importtime 匯入模組，返回 (模組本身的累計秒數, [(直接匯入的模組, 累計秒數)])，
+    後者依累計時間排序。模組匯入失敗時返回 (None, [])。
+    """
+    import subprocess # 只有產生報告時才需要
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                            cwd=cwd or os.getcwd(), capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, []
+    children = []
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue # 標題列
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2 # 子模組先列出，每一層多縮排兩格
+        name = name.strip()
+        seconds = int(cumulative) / 1e6
+        if depth == 0:
+            if name == module_name:
+                total = seconds
+                break
+            children = [] # 直譯器本身的 import (site 等)，不屬於這個模組
+        elif depth == 1:
+            children.append((name, seconds))
+    children.sort(key=lambda entry: -entry[1])
+    return total, children[:limit]
+
+
+def _pad(text, width):
+    """依顯示寬度補空白 (中文字佔兩格)。"""
+    used = sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+    return text + ' ' * max(width - used, 1)
+
+
+def print_report(module_name, import_total, import_children, profiler):
+    print("⏱️ 啟動耗時")
+    if import_total is None:
+        print(f"  import {module_name}: 無法量測")
+    else:
+        print(f"  {_pad('import ' + module_name, 36)}{import_total * 1000:9.1f} ms")
+        for name, seconds in import_children:
+            print(f"    {_pad(name, 34)}{seconds * 1000:9.1f} ms")
+    for name, seconds in profiler.phases:
+        print(f"  {_pad(name, 36)}{seconds * 1000:9.1f} ms")
@@ -0,0 +1,232 @@
+# stats_cube.py
+# 統計儀表板的預先彙總：(類型, 分類, 詞性) 的項目數存在 stats_cube_table，含「全部」邊際合計與「無分類/無詞性」，
+# 儀表板只讀取彙總表 (列數只與分類數 × 詞性數有關，與項目數無關)。每個項目上次計入的分類/詞性記錄在
+# stats_item_table，依變更日誌只對有變動的項目扣除舊的格子、加上新的格子
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+import change_log
+import item_index
+
+DB_NAME = 'jp_db.db'
+ITEM_TYPES = ('vocab', 'grammar')
+CUBE_ALL = -1 # 邊際合計 (不分分類/詞性，每個項目只計一次)
+CUBE_NONE = 0 # 無分類/無詞性
+UNCATEGORIZED = '__uncategorized__' # 與列表頁的篩選值相同，可直接作為下鑽連結的參數
+NO_POS = '__no_pos__'
+STATS_ENTITIES = change_log.ITEM_ENTITIES + ('category',) # 會影響彙總表的日誌實體
+
+
+def create_stats_tables(conn):
+    """建立彙總表、項目快照與狀態表。返回彙總表是否為新建立。"""
+    is_new = not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_cube_table'").fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_cube_table (
+            item_type TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            pos_id INTEGER NOT NULL,
+            item_count INTEGER NOT NULL,
+            PRIMARY KEY (item_type, category_id, pos_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_item_table (
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            category_ids TEXT NOT NULL,
+            pos_ids TEXT NOT NULL,
+            PRIMARY KEY (item_type, item_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_state_table (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    return is_new
+
+
+def _cells(category_ids, pos_ids):
+    """一個項目計入的格子：各分類 (或無分類) 加上全部 × 各詞性 (或無詞性) 加上全部。"""
+    categories = (category_ids or (CUBE_NONE,)) + (CUBE_ALL,)
+    pos = (pos_ids or (CUBE_NONE,)) + (CUBE_ALL,)
+    return [(category_id, pos_id) for category_id in categories for pos_id in pos]
+
+
+def _encode(ids):
+    return ','.join(map(str, ids))
+
+
+def _decode(text):
+    return tuple(int(value) for value in text.split(',')) if text else ()
+
+
+def _current_links(conn, item_type, item_ids=None):
+    """{item_id: (分類 ID tuple, 詞性 ID tuple)}，只含仍存在的項目；item_ids 為 None 時讀取全部。"""
+    table_name = 'vocab_table' if item_type == 'vocab' else 'grammar_table'
+    links = {}
+    chunks = [None] if item_ids is None else item_index._chunks(item_ids)
+    for chunk in chunks:
+        id_filter, id_params = ('', []) if chunk is None else (f'AND item_id IN ({",".join("?" * len(chunk))})', chunk)
+        item_filter = '' if chunk is None else f'WHERE id IN ({",".join("?" * len(chunk))})'
+        categories = {}
+        for item_id, category_id in conn.execute(
+                f'SELECT item_id, category_id FROM item_category_table WHERE item_type = ? {id_filter}', [item_type] + id_params):
+            categories.setdefault(item_id, set()).add(category_id)
+        pos = {}
+        if item_type == 'vocab':
+            for item_id, pos_id in conn.execute(f'SELECT item_id, pos_id FROM item_pos_table WHERE 1 {id_filter}', id_params):
+                pos.setdefault(item_id, set()).add(pos_id)
+        for (item_id,) in conn.execute(f'SELECT id FROM {table_name} {item_filter}', id_params):
+            links[item_id] = (tuple(sorted(categories.get(item_id, ()))), tuple(sorted(pos.get(item_id, ()))))
+    return links
+
+
+def _write_snapshot(conn, item_type, links):
+    conn.executemany(
+        'INSERT OR REPLACE INTO stats_item_table (item_type, item_id, category_ids, pos_ids) VALUES (?, ?, ?, ?)',
+        [(item_type, item_id, _encode(category_ids), _encode(pos_ids)) for item_id, (category_ids, pos_ids) in links.items()]
+    )
+
+
+def rebuild(conn):
+    """重新計算整個彙總表並記錄目前的日誌版本。返回計入的項目數。"""
+    version = change_log.current_version(conn)
+    conn.execute('DELETE FROM stats_cube_table')
+    conn.execute('DELETE FROM stats_item_table')
+    count = 0
+    for item_type in ITEM_TYPES:
+        links = _current_links(conn, item_type)
+        counts = Counter()
+        for category_ids, pos_ids in links.values():
+            counts.update(_cells(category_ids, pos_ids))
+        conn.executemany(
+            'INSERT INTO stats_cube_table (item_type, category_id, pos_id, item_count) VALUES (?, ?, ?, ?)',
+            [(item_type, category_id, pos_id, n) for (category_id, pos_id), n in counts.items()]
+        )
+        _write_snapshot(conn, item_type, links)
+        count += len(links)
+    conn.execute('INSERT OR REPLACE INTO stats_state_table (id, version) VALUES (1, ?)', (version,))
+    return count
+
+
+def apply_changes(conn, item_type, item_ids):
+    """以快照扣除這些項目原本計入的格子、加上目前的格子 (已刪除的項目只扣除)。返回有變動的格子數。"""
+    item_ids = list(set(item_ids))
+    delta = Counter()
+    for chunk in item_index._chunks(item_ids):
+        placeholders = ",".join("?" * len(chunk))
+        for category_ids, pos_ids in conn.execute(
+                f'SELECT category_ids, pos_ids FROM stats_item_table WHERE item_type = ? AND item_id IN ({placeholders})',
+                [item_type] + chunk):
+            delta.subtract(_cells(_decode(category_ids), _decode(pos_ids)))
+        conn.execute(f'DELETE FROM stats_item_table WHERE item_type = ? AND item_id IN ({placeholders})', [item_type] + chunk)
+    links = _current_links(conn, item_type, item_ids)
+    for category_ids, pos_ids in links.values():
+        delta.update(_cells(category_ids, pos_ids))
+    _write_snapshot(conn, item_type, links)
+
+    changed = [(item_type, category_id, pos_id, n) for (category_id, pos_id), n in delta.items() if n]
+    conn.executemany('''
+        INSERT INTO stats_cube_table (item_type, category_id, pos_id, item_count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (item_type, category_id, pos_id) DO UPDATE SET item_count = item_count + excluded.item_count
+    ''', changed)
+    conn.execute('DELETE FROM stats_cube_table WHERE item_type = ? AND item_count <= 0', (item_type,))
+    return len(changed)
+
+
+def is_stale(conn):
+    """
+    是否有尚未套用的變更 (唯讀查詢，需要時才排入寫入佇列)。只看項目與分類的日誌 (分類/詞性的關聯變動也記為項目更新)，
+    複習卡片寫入的排程狀態日誌不影響彙總表，不會觸發同步。
+    """
+    row = conn.execute('SELECT version FROM stats_state_table WHERE id = 1').fetchone()
+    if row is None:
+        return True
+    if row[0] == change_log.current_version(conn):
+        return False
+    if not change_log.can_resume(conn, row[0]):
+        return True
+    return change_log.has_changes(conn, row[0], STATS_ENTITIES)
+
+
+def sync(conn):
+    """在寫入交易中執行：套用上次同步之後有變動的項目；日誌已被清除而接不上時整個重建。"""
+    row = conn.execute('SELECT version FROM stats_state_table WHERE id = 1').fetchone()
+    if row is None or not change_log.can_resume(conn, row[0]):
+        return rebuild(conn)
+    dirty = {item_type: set() for item_type in ITEM_TYPES}
+    version = row[0]
+    has_more = True
+    while has_more:
+        changes, version, has_more = change_log.read_changes(conn, version)
+        for entity, entity_id, _ in changes:
+            if entity in dirty:
+                dirty[entity].add(entity_id)
+    count = sum(apply_changes(conn, item_type, item_ids) for item_type, item_ids in dirty.items() if item_ids)
+    conn.execute('UPDATE stats_state_table SET version = ? WHERE id = 1', (version,))
+    return count
+
+
+def load_cube(conn):
+    """
+    讀取彙總表，返回 {類型: {'total', 'uncategorized', 'no_pos', 'pos': {詞性: 數量}, 'categories': [...]}}。
+    categories 每筆為 {'name', 'count', 'pos': {詞性: 數量}}，無分類為 UNCATEGORIZED、無詞性為 NO_POS。
+    """
+    rows = conn.execute('''
+        SELECT S.item_type, S.category_id, C.name, S.pos_id, P.name, S.item_count
+        FROM stats_cube_table AS S
+        LEFT JOIN category_table AS C ON C.id = S.category_id
+        LEFT JOIN pos_master_table AS P ON P.id = S.pos_id
+        ORDER BY S.item_type, C.name, S.pos_id = 0, S.pos_id
+    ''').fetchall()
+    cube = {item_type: {'total': 0, 'uncategorized': 0, 'no_pos': 0, 'pos': {}, 'categories': []} for item_type in ITEM_TYPES}
+    rows_by_category = {}
+    for item_type, category_id, category_name, pos_id, pos_name, n in rows:
+        stats = cube.setdefault(item_type, {'total': 0, 'uncategorized': 0, 'no_pos': 0, 'pos': {}, 'categories': []})
+        pos_key = None if pos_id == CUBE_ALL else (NO_POS if pos_id == CUBE_NONE else pos_name)
+        if category_id == CUBE_ALL:
+            if pos_key is None:
+                stats['total'] = n
+            else:
+                stats['pos'][pos_key] = n
+                if pos_key == NO_POS:
+                    stats['no_pos'] = n
+            continue
+        name = UNCATEGORIZED if category_id == CUBE_NONE else category_name
+        if name is None:
+            continue # 分類已被刪除，連結的變更尚未同步
+        category = rows_by_category.get((item_type, name))
+        if category is None:
+            category = rows_by_category[(item_type, name)] = {'name': name, 'count': 0, 'pos': {}}
+            stats['categories'].append(category)
+        if pos_key is None:
+            category['count'] = n
+            if name == UNCATEGORIZED:
+                stats['uncategorized'] = n
+        else:
+            category['pos'][pos_key] = n
+    for stats in cube.values():
+        # 無分類排在最後
+        stats['categories'].sort(key=lambda category: (category['name'] == UNCATEGORIZED, category['name']))
+    return cube
+
+
+if __name__ == '__main__':
+    db_name = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    print(f"📊 開始重建統計彙總表 ({db_name})...")
+    start = time.time()
+    conn = sqlite3.connect(db_name)
+    try:
+        create_stats_tables(conn)
+        item_count = rebuild(conn)
+        conn.commit()
+        print(f"✅ 完成！共 {item_count} 個項目，耗時 {time.time() - start:.2f} 秒")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"❌ 重建失敗: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,86 @@
+# suggest_index.py
+# 自動完成用的記憶體前綴索引：排序陣列 + bisect
+import bisect
+import threading
+
+import item_index
+
+
+class SuggestIndex:
+    """
+    以排序後的 (key, item_type, item_id) 陣列做前綴查詢。
+    key 包含表記 (片假名轉平假名、小寫) 與 `單字[讀音]` 中的讀音，兩者都能命中同一個項目。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = [] # 排序後的 (key, item_type, item_id)
+        self._items = {} # (item_type, item_id) -> {'term', 'reading', 'keys'}
+        self.ready = False
+
+    @staticmethod
+    def _make_entry(item_type, term):
+        surface, reading = item_index.split_term(term, item_type)
+        keys = {k for k in (item_index.to_hiragana(surface).lower(), reading) if k}
+        return {'term': surface, 'reading': reading, 'keys': keys}
+
+    def build(self, conn):
+        """從 vocab_table / grammar_table 重建整個索引。"""
+        keys = []
+        items = {}
+        for item_type, table_name in (('vocab', 'vocab_table'), ('grammar', 'grammar_table')):
+            for item_id, term in conn.execute(f'SELECT id, term FROM {table_name}'):
+                entry = self._make_entry(item_type, term)
+                items[(item_type, item_id)] = entry
+                keys.extend((k, item_type, item_id) for k in entry['keys'])
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._items = items
+            self.ready = True
+
+    def _remove_locked(self, item_type, item_id):
+        entry = self._items.pop((item_type, item_id), None)
+        if not entry:
+            return
+        for k in entry['keys']:
+            pos = bisect.bisect_left(self._keys, (k, item_type, item_id))
+            if pos < len(self._keys) and self._keys[pos] == (k, item_type, item_id):
+                del self._keys[pos]
+
+    def update(self, item_type, item_id, term):
+        """新增或編輯項目後增量更新。"""
+        entry = self._make_entry(item_type, term)
+        with self._lock:
+            self._remove_locked(item_type, item_id)
+            self._items[(item_type, item_id)] = entry
+            for k in entry['keys']:
+                bisect.insort(self._keys, (k, item_type, item_id))
+
+    def remove(self, item_type, item_id):
+        """刪除項目後增量更新。"""
+        with self._lock:
+            self._remove_locked(item_type, item_id)
+
+    def suggest(self, prefix, data_type='all', limit=10):
+        """返回以 prefix 開頭的項目 (依 key 字典序，較短/完全相符者在前)。"""
+        prefix = item_index.to_hiragana(item_index.strip_html(prefix)).lower()
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            pos = bisect.bisect_left(self._keys, (prefix,))
+            while pos < len(self._keys) and len(results) < limit:
+                key, item_type, item_id = self._keys[pos]
+                pos += 1
+                if not key.startswith(prefix):
+                    break
+                if data_type != 'all' and item_type != data_type:
+                    continue
+                if (item_type, item_id) in seen:
+                    continue
+                seen.add((item_type, item_id))
+                entry = self._items[(item_type, item_id)]
+                results.append({'id': item_id, 'type': item_type, 'term': entry['term'], 'reading': entry['reading']})
+        return results
@@ -0,0 +1,229 @@
+# text_codec.py
+# 大型文字欄位的透明壓縮：超過門檻的 explanation 以 zlib (raw deflate) + 共用預設字典壓縮後存為 BLOB，
+# 字典由現有資料訓練後存在 compression_dict_table。讀取端只對實際返回的列解壓縮 (unpack)，
+# 搜尋一律使用 *_plain 影子欄位 (item_index 寫入影子欄位時會先解壓縮)，不會掃描壓縮後的內容
+import argparse
+import collections
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from datetime import datetime
+
+DB_NAME = 'jp_db.db'
+COMPRESSED_COLUMNS = ('explanation',) # 需要壓縮的欄位 (讀取端皆需經過 unpack)
+COMPRESSED_TABLES = ('vocab_table', 'grammar_table')
+COMPRESS_MIN_BYTES = 256 # 小於此長度 (UTF-8 位元組) 的值維持原本的 TEXT
+COMPRESS_LEVEL = 9
+BLOB_MAGIC = b'Z1' # 壓縮格式標頭：magic (2 bytes) + 字典 checksum (4 bytes, 0 = 不使用字典) + raw deflate
+HEADER = struct.Struct('>2sI')
+DICT_MAX_BYTES = 32 * 1024 # zlib 視窗只有 32KB，更長的字典前段用不到
+DICT_SAMPLE_ROWS = 2000 # 訓練字典時抽樣的列數
+DICT_MIN_SAMPLES = 50 # 樣本少於此數量時不訓練 (直接壓縮不使用字典)
+DICT_TOKEN_RE = re.compile(r'<[^>]{1,80}>|[^<>\s。、，,.;；:：()（）]{2,24}') # HTML 標籤與文字片段
+
+_dictionaries = {} # checksum -> 字典 bytes (以內容 checksum 為 key，多個資料庫分片可共用)
+_dictionaries_lock = threading.Lock()
+
+
+def create_dictionary_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dict_table (
+            id INTEGER PRIMARY KEY,
+            checksum INTEGER NOT NULL UNIQUE,
+            dictionary BLOB NOT NULL,
+            sample_rows INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+def train_dictionary(samples, max_bytes=DICT_MAX_BYTES):
+    """以樣本中重複出現的片段組成 zlib 預設字典；節省越多的片段放在越後面 (距離越近，編碼越短)。"""
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(DICT_TOKEN_RE.findall(sample))
+    scored = sorted(((count * len(token.encode('utf-8')), token) for token, count in counts.items() if count > 1),
+                    reverse=True)
+    picked = []
+    size = 0
+    for _, token in scored:
+        encoded = token.encode('utf-8')
+        if size + len(encoded) > max_bytes:
+            continue
+        picked.append(encoded)
+        size += len(encoded)
+    return b''.join(reversed(picked))
+
+
+def _table_exists(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+
+def load_dictionaries(conn):
+    """將資料庫中的所有字典載入快取 (在 SQL 函數中解壓縮前呼叫，避免在函數內再查詢)。"""
+    if not _table_exists(conn, 'compression_dict_table'):
+        return
+    rows = conn.execute('SELECT checksum, dictionary FROM compression_dict_table').fetchall()
+    with _dictionaries_lock:
+        for checksum, dictionary in rows:
+            _dictionaries[checksum] = bytes(dictionary)
+
+
+def _get_dictionary(conn, checksum):
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(checksum)
+    if dictionary is None:
+        load_dictionaries(conn)
+        with _dictionaries_lock:
+            dictionary = _dictionaries.get(checksum)
+        if dictionary is None:
+            raise ValueError(f'找不到壓縮字典 (checksum={checksum})')
+    return dictionary
+
+
+def current_dictionary(conn):
+    """返回最新的字典 (checksum, bytes)；尚未訓練時返回 (0, b'')。"""
+    if not _table_exists(conn, 'compression_dict_table'):
+        return 0, b''
+    row = conn.execute('SELECT checksum, dictionary FROM compression_dict_table ORDER BY id DESC LIMIT 1').fetchone()
+    if row is None:
+        return 0, b''
+    with _dictionaries_lock:
+        _dictionaries[row[0]] = bytes(row[1])
+    return row[0], bytes(row[1])
+
+
+def train(conn, sample_rows=DICT_SAMPLE_ROWS):
+    """從既有資料抽樣訓練新字典並存入資料庫 (舊字典保留，已壓縮的資料仍可解壓縮)。返回 checksum，樣本不足時返回 0。"""
+    samples = []
+    for table_name in COMPRESSED_TABLES:
+        for column in COMPRESSED_COLUMNS:
+            rows = conn.execute(f'''
+                SELECT {column} FROM {table_name}
+                WHERE {column} IS NOT NULL AND length(CAST({column} AS BLOB)) >= ?
+                ORDER BY random() LIMIT ?
+            ''', (COMPRESS_MIN_BYTES // 4, sample_rows)).fetchall()
+            samples.extend(unpack(conn, row[0]) for row in rows)
+    if len(samples) < DICT_MIN_SAMPLES:
+        return 0
+    dictionary = train_dictionary(samples)
+    if not dictionary:
+        return 0
+    checksum = zlib.crc32(dictionary)
+    conn.execute('''
+        INSERT OR IGNORE INTO compression_dict_table (checksum, dictionary, sample_rows, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (checksum, dictionary, len(samples), datetime.now().isoformat(timespec='seconds')))
+    with _dictionaries_lock:
+        _dictionaries[checksum] = dictionary
+    return checksum
+
+
+def pack(conn, text):
+    """寫入前呼叫：夠長且壓縮後確實變小時返回壓縮後的 bytes，否則原樣返回。"""
+    if not isinstance(text, str) or len(text) < COMPRESS_MIN_BYTES // 4:
+        return text
+    raw = text.encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return text
+    checksum, dictionary = current_dictionary(conn)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+    packed = HEADER.pack(BLOB_MAGIC, checksum) + compressor.compress(raw) + compressor.flush()
+    return packed if len(packed) < len(raw) else text
+
+
+def unpack(conn, value):
+    """讀取後呼叫：壓縮過的 BLOB 還原為字串，其他值原樣返回。"""
+    if not isinstance(value, bytes) or not value.startswith(BLOB_MAGIC):
+        return value
+    _, checksum = HEADER.unpack_from(value)
+    decompressor = zlib.decompressobj(-15, zdict=_get_dictionary(conn, checksum) if checksum else b'')
+    return (decompressor.decompress(value[HEADER.size:]) + decompressor.flush()).decode('utf-8')
+
+
+def unpack_item(conn, item):
+    """將 dict 中所有壓縮欄位還原 (原地修改並返回該 dict)。"""
+    for column in COMPRESSED_COLUMNS:
+        if column in item:
+            item[column] = unpack(conn, item[column])
+    return item
+
+
+def compress_existing(conn):
+    """遷移：將超過門檻的既有文字改寫為壓縮格式 (尚無字典時先嘗試訓練)。返回改寫的列數。"""
+    create_dictionary_table(conn)
+    if current_dictionary(conn)[0] == 0:
+        train(conn)
+    rewritten = 0
+    for table_name in COMPRESSED_TABLES:
+        for column in COMPRESSED_COLUMNS:
+            rows = conn.execute(f'''
+                SELECT id, {column} FROM {table_name}
+                WHERE typeof({column}) = 'text' AND length(CAST({column} AS BLOB)) >= ?
+            ''', (COMPRESS_MIN_BYTES,)).fetchall()
+            updates = []
+            for item_id, text in rows:
+                packed = pack(conn, text)
+                if isinstance(packed, bytes):
+                    updates.append((packed, item_id))
+            conn.executemany(f'UPDATE {table_name} SET {column} = ? WHERE id = ?', updates)
+            rewritten += len(updates)
+    return rewritten
+
+
+def decompress_all(conn):
+    """將所有壓縮過的值還原為 TEXT (停用壓縮時使用)。返回改寫的列數。"""
+    load_dictionaries(conn)
+    rewritten = 0
+    for table_name in COMPRESSED_TABLES:
+        for column in COMPRESSED_COLUMNS:
+            rows = conn.execute(f"SELECT id, {column} FROM {table_name} WHERE typeof({column}) = 'blob'").fetchall()
+            updates = [(unpack(conn, value), item_id) for item_id, value in rows]
+            conn.executemany(f'UPDATE {table_name} SET {column} = ? WHERE id = ?', updates)
+            rewritten += len(updates)
+    return rewritten
+
+
+def compression_stats(conn):
+    stats = {}
+    for table_name in COMPRESSED_TABLES:
+        for column in COMPRESSED_COLUMNS:
+            compressed, stored = conn.execute(f'''
+                SELECT COUNT(*), COALESCE(SUM(length({column})), 0) FROM {table_name} WHERE typeof({column}) = 'blob'
+            ''').fetchone()
+            original = sum(len(unpack(conn, row[0]).encode('utf-8')) for row in
+                           conn.execute(f"SELECT {column} FROM {table_name} WHERE typeof({column}) = 'blob'"))
+            stats[f'{table_name}.{column}'] = {'compressed_rows': compressed, 'stored_bytes': stored, 'original_bytes': original}
+    stats['dictionaries'] = conn.execute('SELECT COUNT(*) FROM compression_dict_table').fetchone()[0] \
+        if _table_exists(conn, 'compression_dict_table') else 0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='explanation 欄位的壓縮 (zlib + 訓練字典)')
+    parser.add_argument('command', choices=('stats', 'compress', 'train', 'decompress'))
+    parser.add_argument('--db', default=DB_NAME)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'compress':
+            print(f"已壓縮 {compress_existing(conn)} 筆")
+        elif args.command == 'train':
+            create_dictionary_table(conn)
+            checksum = train(conn)
+            print(f"已建立新字典 (checksum={checksum})，之後寫入的資料會使用新字典" if checksum else "樣本不足，未建立字典")
+        elif args.command == 'decompress':
+            print(f"已還原 {decompress_all(conn)} 筆")
+        conn.commit()
+        for key, value in compression_stats(conn).items():
+            print(f"{key}: {value}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
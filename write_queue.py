@@ -0,0 +1,157 @@
+# write_queue.py
+# 單一寫入執行緒：請求執行緒把寫入工作放進有界佇列並等待 Future，
+# 寫入執行緒一次取出多個工作，在同一個交易中依序執行 (每個工作各自一個 SAVEPOINT) 後一起 commit
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+DB_NAME = 'jp_db.db'
+WRITE_QUEUE_SIZE = 256 # 佇列上限，超過時請求會等待 WRITE_SUBMIT_TIMEOUT 秒後失敗
+WRITE_SUBMIT_TIMEOUT = 5
+GROUP_COMMIT_MAX_JOBS = 32 # 每個交易最多合併的工作數
+WRITER_BUSY_TIMEOUT = 30 # 其他行程 (匯入腳本等) 持有寫入鎖時的等待秒數
+WRITER_CACHED_STATEMENTS = 512 # 寫入連線長駐，prepared statement 快取可跨請求重複使用
+
+
+class WriteQueueFull(sqlite3.OperationalError):
+    """佇列已滿；繼承 sqlite3.OperationalError，既有的 except sqlite3.Error 會一併處理。"""
+
+
+class WriteQueue:
+    """
+    工作為 func(conn, *args)：只使用傳入的連線、不自行 commit/rollback，返回值會成為 Future 的結果。
+    單一工作失敗只會回滾該工作的 SAVEPOINT；commit 失敗時同一批的工作全部失敗。
+    資料庫回滾時記憶體中的快取不會跟著還原：在工作中更新行程內快取的物件需以 add_rollback_listener 註冊，回滾後丟棄快取。
+    """
+
+    def __init__(self, db_name=DB_NAME, maxsize=WRITE_QUEUE_SIZE, max_batch=GROUP_COMMIT_MAX_JOBS):
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._rollback_listeners = []
+        self.committed_batches = 0
+        self.committed_jobs = 0
+        self.rolled_back = 0
+
+    def add_rollback_listener(self, callback):
+        """任何工作或整批被回滾後 (在寫入執行緒中) 呼叫 callback()。"""
+        self._rollback_listeners.append(callback)
+
+    def _notify_rollback(self):
+        self.rolled_back += 1
+        for callback in self._rollback_listeners:
+            callback()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """等佇列中已有的工作完成後結束寫入執行緒。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, func, *args):
+        """放入佇列並返回 Future (第一次呼叫時自動啟動寫入執行緒，WSGI 部署也能使用)。"""
+        if self._thread is None:
+            self.start()
+        future = Future()
+        try:
+            self._queue.put((func, args, future), timeout=WRITE_SUBMIT_TIMEOUT)
+        except queue.Full:
+            raise WriteQueueFull('寫入佇列已滿，請稍後再試') from None
+        return future
+
+    def run(self, func, *args):
+        """提交並等待結果；工作中發生的例外會在呼叫端重新拋出。"""
+        return self.submit(func, *args).result()
+
+    def _connect(self):
+        # isolation_level=None：交易由寫入執行緒明確控制 (BEGIN IMMEDIATE / SAVEPOINT / COMMIT)
+        conn = sqlite3.connect(self.db_name, timeout=WRITER_BUSY_TIMEOUT, isolation_level=None,
+                               cached_statements=WRITER_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _take_batch(self):
+        """阻塞等待第一個工作，再不等待地取出佇列中已有的工作；返回 (batch, 是否收到結束訊號)。"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._take_batch()
+                if not batch:
+                    continue
+                try:
+                    self._execute_batch(conn, batch)
+                except sqlite3.Error as e: # SAVEPOINT 本身失敗等，整批失敗但執行緒繼續服務
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    self._notify_rollback()
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+
+    def _execute_batch(self, conn, batch):
+        batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        done = []
+        for func, args, future in batch:
+            conn.execute('SAVEPOINT write_job')
+            try:
+                result = func(conn, *args)
+            except Exception as e:
+                conn.execute('ROLLBACK TO write_job')
+                conn.execute('RELEASE write_job')
+                self._notify_rollback()
+                future.set_exception(e)
+                continue
+            conn.execute('RELEASE write_job')
+            done.append((future, result))
+
+        try:
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            self._notify_rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        self.committed_batches += 1
+        self.committed_jobs += len(done)
+        for future, result in done:
+            future.set_result(result)